@@ -95,18 +95,18 @@ def generate_code(protocol: callable, cfg: CodeGenConfig, mpc_frameworks: list,
     return job_queue
 
 
-def dispatch_jobs(job_queue: list, conclave_config: CodeGenConfig, time_dispatch: bool = False):
+def dispatch_jobs(job_queue: list, conclave_config: CodeGenConfig, time_dispatch: bool = False,
+                  networked_peer: SalmonPeer = None):
     """
     Dispatches jobs to respective backends.
     :param time_dispatch: will record the execution time of dispatch if true
     :param job_queue: jobs to dispatch
     :param conclave_config: conclave configuration
+    :param networked_peer: already connected peer to reuse, e.g. a daemon's, instead of connecting a new one
     """
 
-    networked_peer = None
-
     # if more than one party is involved in the protocol, we need a networked peer
-    if len(conclave_config.all_pids) > 1:
+    if networked_peer is None and len(conclave_config.all_pids) > 1:
         networked_peer = _setup_networked_peer(conclave_config.network_config)
 
     if time_dispatch:
@@ -128,14 +128,19 @@ def dispatch_jobs(job_queue: list, conclave_config: CodeGenConfig, time_dispatch
 
 
 def generate_and_dispatch(protocol: callable, conclave_config: CodeGenConfig, mpc_frameworks: list,
-                          local_frameworks: list, apply_optimizations: bool = True):
+                          local_frameworks: list, apply_optimizations: bool = True,
+                          networked_peer: SalmonPeer = None):
     """
     Calls generate_code to generate code from protocol and :func:`~conclave.__init__.dispatch_jobs` to
     dispatch it.
     """
 
+    # a connected peer may have measured the links between parties, which placement decisions are
+    # based on, all parties have to place by the same measurements
+    if networked_peer is not None and conclave_config.link_matrix is None:
+        conclave_config.with_link_matrix(networked_peer.agree_link_matrix())
     job_queue = generate_code(protocol, conclave_config, mpc_frameworks, local_frameworks, apply_optimizations)
-    dispatch_jobs(job_queue, conclave_config)
+    dispatch_jobs(job_queue, conclave_config, networked_peer=networked_peer)
 
 
 def _setup_networked_peer(network_config):
@@ -0,0 +1,97 @@
+"""
+Bloom filters over key columns.
+
+pub_intersect uses them to let one party send only those of its keys the other party may
+hold. Filters are built and probed a whole column at a time, with the bit positions of a key
+derived by double hashing two 64-bit mixes of its value.
+"""
+import math
+import struct
+
+import numpy as np
+
+# number of bits and number of hash functions, in front of the bit array
+BLOOM_HEADER = struct.Struct("<qB")
+# xored into keys to derive the second hash
+SECOND_HASH_SEED = np.uint64(0x9E3779B97F4A7C15)
+
+
+def _mix(values: np.ndarray):
+    """ splitmix64 finalizer, spreads the bits of 64-bit values. """
+    values = (values ^ (values >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    values = (values ^ (values >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return values ^ (values >> np.uint64(31))
+
+
+def _key_bits(keys):
+    keys = np.asarray(keys)
+    if keys.dtype.kind == "f":
+        return keys.astype(np.float64).view(np.uint64)
+    # int32 and int64 keys with the same value hash the same
+    return keys.astype(np.int64).view(np.uint64)
+
+
+class BloomFilter:
+    """
+    Set membership with false positives but no false negatives.
+
+    >>> bloom = BloomFilter.from_keys(np.arange(1000), 0.01)
+    >>> bool(bloom.contains(np.arange(1000)).all())
+    True
+    >>> received = BloomFilter.from_bytes(bloom.to_bytes())
+    >>> bool(received.contains(np.arange(1000, 101000)).mean() < 0.02)
+    True
+    """
+
+    def __init__(self, num_bits: int, num_hashes: int, bits: np.ndarray = None):
+        self.num_bits = num_bits
+        self.num_hashes = num_hashes
+        self.bits = bits if bits is not None else np.zeros((num_bits + 7) // 8, dtype=np.uint8)
+
+    @classmethod
+    def for_size(cls, num_keys: int, fp_rate: float):
+        """ Empty filter sized for num_keys keys at the given false-positive rate. """
+        if not 0 < fp_rate < 1:
+            raise Exception("Invalid false-positive rate {}".format(fp_rate))
+        num_keys = max(num_keys, 1)
+        num_bits = max(8, math.ceil(-num_keys * math.log(fp_rate) / math.log(2) ** 2))
+        num_hashes = max(1, round(num_bits / num_keys * math.log(2)))
+        return cls(num_bits, num_hashes)
+
+    @classmethod
+    def from_keys(cls, keys, fp_rate: float):
+        """ Filter holding keys, which should be distinct for the sizing to be tight. """
+        keys = np.asarray(keys)
+        bloom = cls.for_size(len(keys), fp_rate)
+        bloom.add(keys)
+        return bloom
+
+    def _positions(self, keys):
+        bits = _key_bits(keys)
+        first, second = _mix(bits), _mix(bits ^ SECOND_HASH_SEED) | np.uint64(1)
+        for idx in range(self.num_hashes):
+            yield (first + np.uint64(idx) * second) % np.uint64(self.num_bits)
+
+    def add(self, keys):
+        flags = np.unpackbits(self.bits, count=self.num_bits, bitorder="little").astype(bool)
+        for positions in self._positions(keys):
+            flags[positions] = True
+        self.bits = np.packbits(flags, bitorder="little")
+
+    def contains(self, keys):
+        """ Boolean mask of the keys that may be in the filter. """
+        mask = np.ones(len(np.asarray(keys)), dtype=bool)
+        for positions in self._positions(keys):
+            mask &= (self.bits[positions >> np.uint64(3)] >> (positions & np.uint64(7)).astype(np.uint8)) & 1 == 1
+        return mask
+
+    def to_bytes(self):
+        return BLOOM_HEADER.pack(self.num_bits, self.num_hashes) + self.bits.tobytes()
+
+    @classmethod
+    def from_bytes(cls, data: bytes):
+        num_bits, num_hashes = BLOOM_HEADER.unpack_from(data)
+        bits = np.frombuffer(data, dtype=np.uint8, offset=BLOOM_HEADER.size).copy()
+        if len(bits) != (num_bits + 7) // 8:
+            raise Exception("Malformed Bloom filter")
+        return cls(num_bits, num_hashes, bits)
@@ -0,0 +1,319 @@
+"""
+Persistent, multiplexed data connections between the parties of a workflow run.
+
+Instead of a fresh socket per public op, each party pair shares one TCP connection for the
+lifetime of the run. Ops exchange data over logical streams on that connection, named by the
+code generator the same way for both parties. A stream behaves like a connected socket (sendall, recv_into, close), so the runtime's
+send/receive functions work on either.
+
+On the wire, each frame is a header (frame kind, name length and payload length), the stream
+name and the payload. Large sends are split into frames of at most MAX_FRAME_SIZE bytes, so
+streams of concurrent ops interleave. A reader thread per connection hands arriving payloads to
+their stream; data that arrives for a stream before its op opens it is buffered. Frames for
+streams that were closed already are dropped.
+
+Each stream is flow controlled on its own: a sender has at most STREAM_WINDOW bytes in flight
+that the receiving op has not consumed yet, and the receiver grants credit for more with credit
+frames as it consumes them. This bounds the data buffered per stream, while the reader thread
+never blocks and streams of other ops keep flowing.
+
+The client side announces each stream it opens with an empty frame. That way the server side can
+bind a stream to its connection before any data flows, even when the server sends first.
+"""
+import atexit
+import socket
+import struct
+import threading
+import time
+
+# frame kind, length of the stream name and of the payload
+MUX_HEADER = struct.Struct("<BHI")
+DATA_FRAME = 0
+CREDIT_FRAME = 1
+# number of bytes granted, the payload of credit frames
+CREDIT = struct.Struct("<q")
+MAX_FRAME_SIZE = 2 ** 20
+# bytes a sender may have in flight per stream, granted again once half of it was consumed
+STREAM_WINDOW = 2 ** 23
+# connection attempts back off exponentially between these delays (in seconds) and give up
+# after CONNECT_TIMEOUT seconds
+CONNECT_RETRY_MIN = 0.01
+CONNECT_RETRY_MAX = 0.5
+CONNECT_TIMEOUT = 600
+# seconds the server side waits for the client side to open a stream
+STREAM_TIMEOUT = 600
+
+# endpoints by (host, port, is_server), live for the whole run, and a lock per endpoint that is
+# held while it is created, which may take a while for clients waiting for their server
+_endpoints = {}
+_endpoint_locks = {}
+_endpoints_lock = threading.Lock()
+
+
+def listen(host: str, port: int, backlog: int = 1):
+    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server_socket.bind((host, port))
+    server_socket.listen(backlog)
+    return server_socket
+
+
+def connect(host: str, port: int, timeout: float = CONNECT_TIMEOUT):
+    """ Connects to host and port, retrying with backoff until the other party listens. """
+    delay = CONNECT_RETRY_MIN
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            return socket.create_connection((host, port))
+        except OSError as e:
+            if time.monotonic() > deadline:
+                raise Exception("Could not connect to {}:{}: {}".format(host, port, e))
+            time.sleep(delay)
+            delay = min(2 * delay, CONNECT_RETRY_MAX)
+
+
+def _recv_exact(sock: socket.socket, size: int):
+    data = bytearray(size)
+    view = memoryview(data)
+    while size:
+        received = sock.recv_into(view, size)
+        if not received:
+            return None
+        view = view[received:]
+        size -= received
+    return data
+
+
+def _shutdown(sock: socket.socket):
+    """ Wakes up threads blocked on sock, which closing it does not do. """
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+
+
+class Stream:
+    """ Logical stream of one op on a multiplexed connection. """
+
+    def __init__(self, name: str, endpoint):
+        self.name = name
+        self.endpoint = endpoint
+        self.connection = None
+        self.buffer = bytearray()
+        self.closed = False
+        # bytes we may still send, and bytes received and consumed that we did not grant again yet
+        self.credit = STREAM_WINDOW
+        self.consumed = 0
+        self.cond = threading.Condition()
+
+    def _feed(self, payload: bytes):
+        with self.cond:
+            self.buffer += payload
+            self.cond.notify_all()
+
+    def _add_credit(self, credit: int):
+        with self.cond:
+            self.credit += credit
+            self.cond.notify_all()
+
+    def _connection_lost(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+    def sendall(self, data):
+        data = memoryview(data).cast("B")
+        while data:
+            with self.cond:
+                while not self.credit and not self.closed:
+                    self.cond.wait()
+                if self.closed:
+                    raise ConnectionError("Connection of stream {} was lost".format(self.name))
+                size = min(self.credit, len(data))
+                self.credit -= size
+            self.connection.send(DATA_FRAME, self.name, data[:size])
+            data = data[size:]
+
+    def recv_into(self, view: memoryview, nbytes: int = 0):
+        nbytes = nbytes or len(view)
+        with self.cond:
+            while not self.buffer and not self.closed:
+                self.cond.wait()
+            size = min(nbytes, len(self.buffer))
+            view[:size] = self.buffer[:size]
+            del self.buffer[:size]
+            self.consumed += size
+            grant = self.consumed if self.consumed >= STREAM_WINDOW // 2 else 0
+            self.consumed -= grant
+        if grant:
+            self.connection.send(CREDIT_FRAME, self.name, memoryview(CREDIT.pack(grant)))
+        return size
+
+    def close(self):
+        """ Ends the op's use of the stream, the connection itself stays open for later ops. """
+        self.endpoint.release(self.name)
+
+
+class _Connection:
+    """ One TCP connection carrying the frames of any number of streams. """
+
+    def __init__(self, sock: socket.socket, endpoint):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock = sock
+        self.endpoint = endpoint
+        self.send_lock = threading.Lock()
+        threading.Thread(target=self._read, daemon=True).start()
+
+    def send(self, kind: int, name: str, data: memoryview):
+        encoded_name = name.encode()
+        for start in range(0, max(len(data), 1), MAX_FRAME_SIZE):
+            payload = data[start:start + MAX_FRAME_SIZE]
+            with self.send_lock:
+                self.sock.sendall(MUX_HEADER.pack(kind, len(encoded_name), len(payload)) + encoded_name)
+                self.sock.sendall(payload)
+
+    def close(self):
+        _shutdown(self.sock)
+        self.sock.close()
+
+    def _read(self):
+        while True:
+            try:
+                header = _recv_exact(self.sock, MUX_HEADER.size)
+                if header is None:
+                    break
+                kind, name_size, payload_size = MUX_HEADER.unpack(header)
+                name = _recv_exact(self.sock, name_size)
+                payload = _recv_exact(self.sock, payload_size)
+            except OSError:
+                # the connection was closed under us
+                break
+            if name is None or payload is None:
+                break
+            stream = self.endpoint.stream(name.decode(), self, create=kind == DATA_FRAME)
+            if stream is None:
+                continue
+            if kind == CREDIT_FRAME:
+                stream._add_credit(CREDIT.unpack(payload)[0])
+            else:
+                stream._feed(payload)
+        self.endpoint.connection_lost(self)
+
+
+class _Endpoint:
+    """ Our side of the channel to one (host, port): the streams of all its connections by name. """
+
+    def __init__(self):
+        self.streams = {}
+        # names of the streams closed by their op, each op opens its stream once per run
+        self.released = set()
+        self.cond = threading.Condition()
+
+    def stream(self, name: str, connection: _Connection = None, create: bool = True):
+        """ The stream called name, or None if it was closed already or is not open and create is false. """
+        with self.cond:
+            if name in self.released:
+                return None
+            if name not in self.streams:
+                if not create:
+                    return None
+                self.streams[name] = Stream(name, self)
+            stream = self.streams[name]
+            if connection is not None and stream.connection is None:
+                stream.connection = connection
+                self.cond.notify_all()
+            return stream
+
+    def bound_stream(self, name: str, timeout: float = STREAM_TIMEOUT):
+        """ Waits until the other party has announced the stream. """
+        deadline = time.monotonic() + timeout
+        with self.cond:
+            while name not in self.streams or self.streams[name].connection is None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise Exception("Stream {} was not opened by the other party within {} seconds".format(
+                        name, timeout))
+                self.cond.wait(remaining)
+            return self.streams[name]
+
+    def release(self, name: str):
+        with self.cond:
+            self.streams.pop(name, None)
+            self.released.add(name)
+
+    def connection_lost(self, connection: _Connection):
+        with self.cond:
+            streams = [stream for stream in self.streams.values() if stream.connection is connection]
+        for stream in streams:
+            stream._connection_lost()
+
+
+class _ServerEndpoint(_Endpoint):
+    """ Accepts connections from any number of other parties for the whole run. """
+
+    def __init__(self, host: str, port: int):
+        super().__init__()
+        self.connections = []
+        self.server_socket = listen(host, port, backlog=8)
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            try:
+                sock, _ = self.server_socket.accept()
+            except OSError:
+                return
+            self.connections.append(_Connection(sock, self))
+
+    def open(self, name: str):
+        return self.bound_stream(name)
+
+    def close(self):
+        # closing alone would leave the socket listening until the accepting thread returns
+        _shutdown(self.server_socket)
+        self.server_socket.close()
+        for connection in self.connections:
+            connection.close()
+
+
+class _ClientEndpoint(_Endpoint):
+    """ Single connection to another party's server endpoint. """
+
+    def __init__(self, host: str, port: int):
+        super().__init__()
+        self.connection = _Connection(connect(host, port), self)
+
+    def open(self, name: str):
+        stream = self.stream(name, self.connection)
+        self.connection.send(DATA_FRAME, name, memoryview(b""))
+        return stream
+
+    def close(self):
+        self.connection.close()
+
+
+def open_stream(host: str, port: int, is_server: bool, name: str):
+    """
+    Opens the logical stream name on the run's channel to the other party. The server side listens
+    on host:port and the client side connects to it, both only once per run.
+    """
+    key = (host, port, is_server)
+    with _endpoints_lock:
+        endpoint_lock = _endpoint_locks.setdefault(key, threading.Lock())
+    with endpoint_lock:
+        if key not in _endpoints:
+            endpoint = _ServerEndpoint(host, port) if is_server else _ClientEndpoint(host, port)
+            with _endpoints_lock:
+                _endpoints[key] = endpoint
+        endpoint = _endpoints[key]
+    return endpoint.open(name)
+
+
+@atexit.register
+def close_all():
+    """ Closes all channels, called when the run ends, i.e. when a job's process exits or an in-process job returns. """
+    with _endpoints_lock:
+        for endpoint in _endpoints.values():
+            endpoint.close()
+        _endpoints.clear()
+        _endpoint_locks.clear()
@@ -0,0 +1,1008 @@
+"""
+Columnar execution engine for generated Python jobs.
+
+Exposes the same primitives as :mod:`conclave.codegen.libs.python` but stores
+relations as one typed NumPy array per column instead of lists of rows, so that
+operators run as vectorized array operations.
+"""
+import itertools
+import mmap
+import threading
+
+import numpy as np
+
+import conclave.codegen.libs.python as rowlib
+from conclave.codegen.libs.bloom import BloomFilter
+
+DTYPE = np.int64
+# array type of each column type code
+CODE_DTYPES = {"q": np.int64, "i": np.int32, "d": np.float64}
+
+
+class ColumnarRel:
+    """
+    Relation stored column-wise, as one typed array per column.
+
+    >>> rel = ColumnarRel.from_rows([[1, 2], [3, 4]], 2)
+    >>> len(rel), rel.num_cols()
+    (2, 2)
+    >>> (rel + rel).to_rows()
+    [[1, 2], [3, 4], [1, 2], [3, 4]]
+    """
+
+    def __init__(self, cols: list, num_rows: [int, None] = None):
+        self.cols = [col if isinstance(col, np.ndarray) else np.asarray(col, dtype=DTYPE) for col in cols]
+        self.num_rows = len(self.cols[0]) if self.cols else (num_rows or 0)
+
+    @classmethod
+    def from_rows(cls, rows: list, num_cols: int):
+        """ Build columnar relation from a list of rows. Columns holding floats become float64, all others int64. """
+        if not rows:
+            return cls([np.empty(0, dtype=DTYPE) for _ in range(num_cols)])
+        return cls([_col_array(col) for col in zip(*rows)], len(rows))
+
+    def col_types(self):
+        """ Return the type code of each column. """
+        return "".join([_type_code(col) for col in self.cols])
+
+    def num_cols(self):
+        """ Return number of columns. """
+        return len(self.cols)
+
+    def take(self, indexes):
+        """ Return relation made up of the rows at the given indexes. """
+        return ColumnarRel([col[indexes] for col in self.cols], len(indexes))
+
+    def to_rows(self):
+        """ Return relation as a list of rows. """
+        if not self.cols:
+            return [[] for _ in range(self.num_rows)]
+        return [list(row) for row in zip(*[col.tolist() for col in self.cols])]
+
+    def __len__(self):
+        return self.num_rows
+
+    def __iter__(self):
+        return iter(self.to_rows())
+
+    def __getitem__(self, idx: int):
+        return [col[idx].item() for col in self.cols]
+
+    def __add__(self, other):
+        other = as_rel(other)
+        if not other.num_rows:
+            return self
+        if not self.num_rows:
+            return other
+        return ColumnarRel([np.concatenate([left, right]) for left, right in zip(self.cols, other.cols)])
+
+    def __str__(self):
+        return "ColumnarRel({} rows x {} cols)".format(self.num_rows, len(self.cols))
+
+
+def _col_array(values):
+    col = np.array(values)
+    return col if col.dtype.kind == "f" else col.astype(DTYPE)
+
+
+def _type_code(col: np.ndarray):
+    if col.dtype.kind == "f":
+        return "d"
+    return "i" if col.dtype == np.int32 else "q"
+
+
+def _acc_dtype(values: np.ndarray):
+    """ Type to accumulate sums of values in, so that narrow integer columns don't overflow. """
+    return np.result_type(values.dtype, DTYPE)
+
+
+def _mean(sums: np.ndarray, counts: np.ndarray):
+    """ Means of integer columns are truncated, like int(sum / count) in the row engine. """
+    means = sums / counts
+    return means if sums.dtype.kind == "f" else np.trunc(means).astype(DTYPE)
+
+
+def as_rel(rel):
+    """ Convert list of rows (or packed flags) to columnar relation if necessary. """
+    if isinstance(rel, ColumnarRel):
+        return rel
+    if isinstance(rel, rowlib.PackedFlags):
+        bits = np.frombuffer(rel.bits, dtype=np.uint8)
+        return ColumnarRel([np.unpackbits(bits, count=rel.num_rows, bitorder="little").astype(DTYPE)])
+    return ColumnarRel.from_rows(rel, len(rel[0]) if rel else 0)
+
+
+def _empty_like(num_cols: int):
+    return ColumnarRel([np.empty(0, dtype=DTYPE) for _ in range(num_cols)])
+
+
+def _key_col(rel: ColumnarRel, idx: int):
+    # relations converted from empty row lists have no columns at all
+    return rel.cols[idx] if rel.cols else np.empty(0, dtype=DTYPE)
+
+
+def format_rows(rel: ColumnarRel, start: int, stop: int):
+    """ Formats a block of rows as CSV lines in one go. """
+    line = ",".join(["%s" if col.dtype.kind == "f" else "%d" for col in rel.cols]) + "\n"
+    return "".join(map(line.__mod__, zip(*[col[start:stop].tolist() for col in rel.cols])))
+
+
+def write_rel(job_dir, rel_name, rel, schema_header):
+    write_rel_chunks(job_dir, rel_name, [rel], schema_header)
+
+
+def write_rel_chunks(job_dir, rel_name, chunks, schema_header):
+    """ Same as write_rel but consumes an iterable of chunks. """
+    print("Will write to {}/{}".format(job_dir, rel_name))
+    path = "{}/{}".format(job_dir, rel_name)
+    with open(path, "w", buffering=rowlib.WRITE_BUFFER_SIZE) as f:
+        # hack header
+        f.write(schema_header + "\n")
+        for chunk in chunks:
+            if isinstance(chunk, rowlib.PackedFlags):
+                # keep the flags packed, only one block at a time is expanded
+                for block in chunk.chunks():
+                    f.write(rowlib.format_rows(block))
+                continue
+            chunk = as_rel(chunk)
+            if not chunk.cols:
+                continue
+            for start in range(0, chunk.num_rows, rowlib.CHUNK_SIZE):
+                f.write(format_rows(chunk, start, start + rowlib.CHUNK_SIZE))
+
+
+def read_rel_chunks(path_to_rel, chunk_size: int = rowlib.CHUNK_SIZE, delimiter: str = ",", col_types: str = None):
+    """
+    Lazily reads relation from CSV file, yielding columnar relations of at most chunk_size rows.
+    Each column gets the array type of its type code in col_types (int64 by default).
+    """
+    with open(path_to_rel, "r") as f:
+        first_line = f.readline()
+        if not first_line:
+            return
+        num_cols = len(first_line.split(delimiter))
+        col_types = rowlib.col_type_codes(num_cols, col_types)
+        if len(set(col_types)) == 1:
+            dtype = np.dtype(CODE_DTYPES[col_types[0]])
+        else:
+            dtype = np.dtype([("c{}".format(idx), CODE_DTYPES[code]) for idx, code in enumerate(col_types)])
+        if rowlib.is_header_line(first_line, delimiter):
+            print("skipped header")
+            lines = f
+        else:
+            lines = itertools.chain([first_line], f)
+        while True:
+            block = list(itertools.islice(lines, chunk_size))
+            if not block:
+                return
+            data = np.loadtxt(block, dtype=dtype, delimiter=delimiter, ndmin=1 if dtype.names else 2)
+            if not data.size:
+                continue
+            if dtype.names:
+                yield ColumnarRel([np.ascontiguousarray(data[name]) for name in dtype.names])
+            else:
+                yield ColumnarRel([np.ascontiguousarray(data[:, idx]) for idx in range(num_cols)])
+
+
+def read_rel(path_to_rel, delimiter: str = ",", col_types: str = None):
+    with open(path_to_rel, "r") as f:
+        first_line = f.readline()
+    num_cols = len(first_line.split(delimiter)) if first_line.strip() else 0
+    chunks = list(read_rel_chunks(path_to_rel, delimiter=delimiter, col_types=col_types))
+    if not chunks:
+        return _empty_like(num_cols)
+    if len(chunks) == 1:
+        return chunks[0]
+    return ColumnarRel([np.concatenate(cols) for cols in zip(*[chunk.cols for chunk in chunks])])
+
+
+def write_rel_bin(job_dir, rel_name, rel, num_cols, col_types: str = None):
+    rel = as_rel(rel)
+    print("Will write to {}/{}".format(job_dir, rel_name))
+    path = "{}/{}".format(job_dir, rel_name)
+    # relations converted from empty row lists have no columns to take types from
+    if col_types is None and rel.cols:
+        col_types = rel.col_types()
+    col_types = rowlib.col_type_codes(num_cols, col_types)
+    with open(path, "wb") as f:
+        f.write(rowlib.pack_rel_header(col_types, rel.num_rows))
+        for col, code in zip(rel.cols, col_types):
+            data = np.ascontiguousarray(col, dtype=np.dtype(CODE_DTYPES[code]).newbyteorder("<"))
+            f.write(data.data)
+            f.write(b"\0" * (-data.nbytes % 8))
+
+
+def read_rel_bin(path_to_rel):
+    """ Maps binary relation file into memory. Columns are read-only views of the mapped file. """
+    with open(path_to_rel, "rb") as f:
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    col_types, num_rows, offset = rowlib.unpack_rel_header(buf)
+    cols = []
+    for code in col_types:
+        dtype = np.dtype(CODE_DTYPES[code]).newbyteorder("<")
+        cols.append(np.frombuffer(buf, dtype=dtype, count=num_rows, offset=offset))
+        offset += num_rows * dtype.itemsize + (-num_rows * dtype.itemsize % 8)
+    return ColumnarRel(cols, num_rows)
+
+
+def num_rows(rel):
+    return ColumnarRel([np.array([len(rel)], dtype=DTYPE)])
+
+
+def project(rel, selected_cols):
+    rel = as_rel(rel)
+    if not rel.cols:
+        return _empty_like(len(selected_cols))
+    return ColumnarRel([rel.cols[idx] for idx in selected_cols], rel.num_rows)
+
+
+def _group(keys: np.ndarray):
+    """
+    Group equal keys. Returns the stable sort order of the keys, the offset of each group in that order,
+    and the permutation that lists groups in order of first appearance (matching the row engine's output).
+    """
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+    boundaries = np.empty(len(keys), dtype=bool)
+    boundaries[:1] = True
+    np.not_equal(sorted_keys[1:], sorted_keys[:-1], out=boundaries[1:])
+    starts = np.flatnonzero(boundaries)
+    appearance = np.argsort(order[starts], kind="stable")
+    return order, starts, appearance
+
+
+def aggregate(rel, group_by_idx, over_idx, aggregator):
+    rel = as_rel(rel)
+    if not rel.num_rows:
+        return _empty_like(2)
+    keys = rel.cols[group_by_idx]
+    order, starts, appearance = _group(keys)
+    values = rel.cols[over_idx][order]
+    sums = np.add.reduceat(values, starts, dtype=_acc_dtype(values))
+    return ColumnarRel([keys[order[starts]][appearance], sums[appearance]])
+
+
+def aggregate_count(rel, group_by_idx):
+    rel = as_rel(rel)
+    if not rel.num_rows:
+        return _empty_like(2)
+    keys = rel.cols[group_by_idx]
+    order, starts, appearance = _group(keys)
+    counts = np.diff(np.append(starts, len(keys)))
+    return ColumnarRel([keys[order[starts]][appearance], counts[appearance].astype(DTYPE)])
+
+
+def _composite_key(cols: list):
+    """
+    Encode the values of several key columns into a single integer key per row. Each column is
+    replaced by its dense rank and the ranks are combined positionally; the combined key is
+    re-densified whenever its range would overflow.
+    """
+    key = np.zeros(len(cols[0]), dtype=DTYPE)
+    key_range = 1
+    for col in cols:
+        uniques, codes = np.unique(col, return_inverse=True)
+        if key_range * len(uniques) >= 2 ** 62:
+            uniques_so_far, key = np.unique(key, return_inverse=True)
+            key_range = len(uniques_so_far)
+        key = key * len(uniques) + codes.reshape(-1)
+        key_range *= len(uniques)
+    return key
+
+
+def group_by(rel, group_by_idxs, aggs):
+    """
+    Group by any number of columns and compute several aggregates in a single pass. Each entry
+    of aggs is an (over_idx, aggregator) pair where aggregator is one of sum, count, min, max
+    or mean (over_idx is ignored for count).
+
+    >>> rel = ColumnarRel.from_rows([[1, 2, 5], [1, 2, 7], [0, 2, 4]], 3)
+    >>> group_by(rel, [0, 1], [(2, "sum"), (None, "count"), (2, "min"), (2, "max"), (2, "mean")]).to_rows()
+    [[1, 2, 12, 2, 5, 7, 6], [0, 2, 4, 1, 4, 4, 4]]
+    """
+    rel = as_rel(rel)
+    if not rel.num_rows:
+        return _empty_like(len(group_by_idxs) + len(aggs))
+    key_cols = [rel.cols[idx] for idx in group_by_idxs]
+    keys = key_cols[0] if len(key_cols) == 1 else _composite_key(key_cols)
+    order, starts, appearance = _group(keys)
+    first_rows = order[starts][appearance]
+    counts = np.diff(np.append(starts, len(keys)))
+
+    out_cols = [col[first_rows] for col in key_cols]
+    for over_idx, aggregator in aggs:
+        if aggregator == "count":
+            out_cols.append(counts[appearance].astype(DTYPE))
+            continue
+        values = rel.cols[over_idx][order]
+        if aggregator == "sum":
+            res = np.add.reduceat(values, starts, dtype=_acc_dtype(values))
+        elif aggregator == "min":
+            res = np.minimum.reduceat(values, starts)
+        elif aggregator == "max":
+            res = np.maximum.reduceat(values, starts)
+        elif aggregator == "mean":
+            res = _mean(np.add.reduceat(values, starts, dtype=_acc_dtype(values)), counts)
+        else:
+            raise Exception("Unknown aggregator {}".format(aggregator))
+        out_cols.append(res[appearance])
+    return ColumnarRel(out_cols)
+
+
+def stream_group_by(chunks, group_by_idxs, aggs):
+    """
+    Same as group_by but consumes an iterable of chunks. Each chunk is reduced to per-group partial
+    aggregates which are folded into the running state, so memory is bounded by the number of groups.
+    """
+    num_keys = len(group_by_idxs)
+    # means are carried as separate sums and counts until the end
+    partial_aggs = []
+    for over_idx, aggregator in aggs:
+        if aggregator == "mean":
+            partial_aggs += [(over_idx, "sum"), (None, "count")]
+        else:
+            partial_aggs.append((over_idx, aggregator))
+    merge_aggs = [(num_keys + idx, "sum" if aggregator == "count" else aggregator)
+                  for idx, (_, aggregator) in enumerate(partial_aggs)]
+
+    state = None
+    for chunk in chunks:
+        partial = group_by(chunk, group_by_idxs, partial_aggs)
+        state = partial if state is None else group_by(state + partial, list(range(num_keys)), merge_aggs)
+    if state is None:
+        return _empty_like(num_keys + len(aggs))
+
+    out_cols = state.cols[:num_keys]
+    partial_cols = iter(state.cols[num_keys:])
+    for _, aggregator in aggs:
+        if aggregator == "mean":
+            sums, counts = next(partial_cols), next(partial_cols)
+            out_cols.append(_mean(sums, counts))
+        else:
+            out_cols.append(next(partial_cols))
+    return ColumnarRel(out_cols)
+
+
+def _rows(rel: ColumnarRel):
+    return zip(*[col.tolist() for col in rel.cols])
+
+
+def _same_values(values, check):
+    """ Whether values computed on integer columns match check, the same values computed on floats. """
+    if isinstance(values, (list, tuple)):
+        return isinstance(check, (list, tuple)) and len(values) == len(check) and \
+            all([_same_values(value, other) for value, other in zip(values, check)])
+    values, check = np.asarray(values), np.asarray(check)
+    if values.dtype.kind not in "biuf" or check.dtype.kind not in "biuf" or values.shape != check.shape:
+        return False
+    if values.dtype.kind == "b" or check.dtype.kind == "b":
+        return np.array_equal(values, check)
+    return np.allclose(values.astype(np.float64), check.astype(np.float64), rtol=1e-9, atol=0, equal_nan=True)
+
+
+def _eval_on_cols(row_fn, rel: ColumnarRel):
+    """
+    Evaluates row_fn, written for a single row, on the list of columns instead, which computes it
+    for all rows at once if it only indexes the row and applies operators to the values. Returns
+    whether that worked and the result. It does not if row_fn converts or branches on values, or
+    divides by zero or overflows; row_fn is then applied row by row, which raises like the row engine.
+    """
+    # narrow integer columns are widened, so that they hold results like Python ints do
+    cols = [col if col.dtype.kind == "f" else col.astype(DTYPE, copy=False) for col in rel.cols]
+    try:
+        with np.errstate(divide="raise", over="raise", invalid="raise"):
+            values = row_fn(cols)
+            if all([col.dtype.kind == "f" for col in cols]):
+                return True, values
+            # integer arrays wrap around silently when they overflow, unlike Python ints, so the
+            # result is checked against the same computation on floats, which do not
+            check = row_fn([col.astype(np.float64) for col in cols])
+    except (TypeError, ValueError, ArithmeticError):
+        return False, None
+    if not _same_values(values, check):
+        return False, None
+    return True, values
+
+
+def _eval_exactly(cols_fn, rel: ColumnarRel):
+    """
+    Evaluates cols_fn, an expression over the list of columns, to the values it has on Python ints:
+    if int64 columns overflow, it is evaluated again on columns of Python ints.
+    """
+    ok, values = _eval_on_cols(cols_fn, rel)
+    if ok:
+        return values
+    return cols_fn([col if col.dtype.kind == "f" else col.astype(object) for col in rel.cols])
+
+
+def _as_col(values, num_rows: int):
+    """ The values computed by _eval_on_cols as a column, or None if they are not one value per row. """
+    values = np.asarray(values)
+    if values.dtype.kind not in "biuf" or values.shape not in [(), (num_rows,)]:
+        return None
+    return np.broadcast_to(values, (num_rows,))
+
+
+def arithmetic_project(rel, target_col_idx, f):
+    """
+    Replaces the target column with the result of f, an expression over a row, evaluated over whole
+    columns where possible. Like in the row engine, the column takes the type of the result.
+
+    >>> arithmetic_project(as_rel([[1, 3], [2, 5]]), 1, lambda row: row[1] * 2 + row[0]).to_rows()
+    [[1, 7], [2, 12]]
+    >>> arithmetic_project(as_rel([[1, 3], [2, 5]]), 1, lambda row: int(row[1] / row[0])).to_rows()
+    [[1, 3], [2, 2]]
+    """
+    rel = as_rel(rel)
+    if not rel.num_rows:
+        return rel
+    ok, values = _eval_on_cols(f, rel)
+    target = _as_col(values, rel.num_rows) if ok else None
+    cols = list(rel.cols)
+    cols[target_col_idx] = _col_array(target if target is not None else list(map(f, _rows(rel))))
+    return ColumnarRel(cols, rel.num_rows)
+
+
+def int_div(dividend, *divisors):
+    """
+    Divides like int(a / b / ...) does on Python ints, i.e. true division followed by truncation
+    towards zero, over whole columns (scalars are broadcast).
+
+    >>> int_div(np.array([7, -7, 9]), 2, np.array([1, 1, 3])).tolist()
+    [3, -3, 1]
+    """
+    res = dividend
+    for divisor in divisors:
+        if np.any(np.asarray(divisor) == 0):
+            raise ZeroDivisionError("division by zero")
+        res = np.true_divide(res, divisor)
+    # columns of Python ints divide to columns of Python floats
+    return np.trunc(np.asarray(res, dtype=np.float64)).astype(DTYPE)
+
+
+def arithmetic_columns(rel, target_col_idx, f):
+    """
+    Replaces the target column with the result of f, a vectorized expression over the list of columns.
+    The column takes the type of the result, as in the row engine.
+
+    >>> arithmetic_columns(as_rel([[1, 3], [2, 5]]), 1, lambda cols: cols[1] * 1.5).to_rows()
+    [[1, 4.5], [2, 7.5]]
+    """
+    rel = as_rel(rel)
+    if not rel.num_rows:
+        return rel
+    cols = list(rel.cols)
+    target = np.asarray(_eval_exactly(f, rel))
+    if target.dtype.kind == "O":
+        # results that only Python ints hold raise here, like writing them out would in the row engine
+        target = _col_array(target.tolist())
+    cols[target_col_idx] = np.array(np.broadcast_to(target, (rel.num_rows,)), dtype=np.result_type(target))
+    return ColumnarRel(cols, rel.num_rows)
+
+
+def mask_filter(mask_fn, rel):
+    """ Keeps the rows selected by the boolean mask that mask_fn computes from the list of columns. """
+    rel = as_rel(rel)
+    if not rel.num_rows:
+        return rel
+    mask = np.asarray(_eval_exactly(mask_fn, rel), dtype=bool)
+    return rel.take(np.flatnonzero(np.broadcast_to(mask, (rel.num_rows,))))
+
+
+def map_rows(rel, row_fn, num_cols):
+    """
+    Applies row_fn to every row, dropping rows for which it returns None. Functions without
+    filters are evaluated over whole columns where possible.
+    """
+    rel = as_rel(rel)
+    if not rel.num_rows:
+        return _empty_like(num_cols)
+    ok, out = _eval_on_cols(row_fn, rel)
+    if ok and out is None:
+        # filters on constants only drop all rows or none
+        return _empty_like(num_cols)
+    if ok and isinstance(out, list) and len(out) == num_cols:
+        cols = [_as_col(values, rel.num_rows) for values in out]
+        if all([col is not None for col in cols]):
+            return ColumnarRel([_col_array(col) for col in cols], rel.num_rows)
+    return ColumnarRel.from_rows([out for out in map(row_fn, _rows(rel)) if out is not None], num_cols)
+
+
+def project_indeces(rel):
+    rel = as_rel(rel)
+    return ColumnarRel([np.arange(rel.num_rows, dtype=DTYPE)] + rel.cols)
+
+
+def join_flags(left, right, left_col, right_col):
+    """ Same as the row engine's join_flags, with the matching pairs found by a sort join. """
+    left, right = as_rel(left), as_rel(right)
+    num_right = right.num_rows
+    flags = rowlib.PackedFlags(left.num_rows * num_right)
+    if flags.num_rows:
+        left_idx, right_idx = join_indexes(left.cols[left_col], right.cols[right_col])
+        positions = left_idx.astype(np.int64) * num_right + right_idx
+        bits = np.zeros(len(flags.bits), dtype=np.uint8)
+        np.bitwise_or.at(bits, positions >> 3, np.left_shift(1, positions & 7).astype(np.uint8))
+        flags.bits = bytearray(bits.tobytes())
+    return flags
+
+
+def _gather_join(left, right, left_col, right_col, left_idx, right_idx):
+    """ Build joined relation (key, left non-key cols, right non-key cols) from matching row indexes. """
+    key = right.cols[right_col][right_idx]
+    from_left = [col[left_idx] for idx, col in enumerate(left.cols) if idx != left_col]
+    from_right = [col[right_idx] for idx, col in enumerate(right.cols) if idx != right_col]
+    return ColumnarRel([key] + from_left + from_right, len(right_idx))
+
+
+def join_build(left, left_col):
+    """
+    Builds the index over the left input of a join, so that it can be probed repeatedly. Keys are
+    indexed by sorting rather than hashing them, so that whole columns are probed at once; pairs
+    still come out in the order of the row engine's hash join.
+    """
+    return sort_join_build(left, left_col)
+
+
+def join_probe(build, right, right_col):
+    return sort_join_probe(build, right, right_col)
+
+
+def join(left, right, left_col, right_col):
+    return join_probe(join_build(left, left_col), right, right_col)
+
+
+def sorted_index(left_keys: np.ndarray):
+    """ Returns the stable sort order of the keys of a join's left input together with the sorted keys. """
+    order = np.argsort(left_keys, kind="stable")
+    return order, left_keys[order]
+
+
+def probe_sorted_index(index, right_keys: np.ndarray):
+    """
+    Returns the (left, right) row indexes of all pairs matching on keys, for a sorted index over the left keys.
+    Pairs are ordered by right row and then left row, which is the order the hash join emits them in.
+    """
+    order, sorted_keys = index
+    lo = np.searchsorted(sorted_keys, right_keys, side="left")
+    hi = np.searchsorted(sorted_keys, right_keys, side="right")
+    counts = hi - lo
+    right_idx = np.repeat(np.arange(len(right_keys)), counts)
+    # position of each output pair within its run of equal left keys
+    run_offsets = np.arange(len(right_idx)) - np.repeat(np.cumsum(counts) - counts, counts)
+    left_idx = order[np.repeat(lo, counts) + run_offsets]
+    return left_idx, right_idx
+
+
+def join_indexes(left_keys: np.ndarray, right_keys: np.ndarray):
+    """
+    Sort-based equi-join on integer key arrays. Returns the (left, right) row indexes of all matching pairs.
+
+    >>> left_idx, right_idx = join_indexes(np.array([3, 1, 3]), np.array([3, 2, 1]))
+    >>> left_idx.tolist(), right_idx.tolist()
+    ([0, 2, 1], [0, 0, 2])
+    """
+    return probe_sorted_index(sorted_index(left_keys), right_keys)
+
+
+def sort_join_build(left, left_col):
+    """ Sorts the keys of the left input of a sort join, so that it can be probed repeatedly. """
+    left = as_rel(left)
+    keys = left.cols[left_col] if left.num_rows else np.empty(0, dtype=DTYPE)
+    return left, left_col, sorted_index(keys)
+
+
+def sort_join_probe(build, right, right_col):
+    left, left_col, index = build
+    right = as_rel(right)
+    if not left.num_rows or not right.num_rows:
+        return _empty_like(max(left.num_cols() + right.num_cols() - 1, 0))
+    left_idx, right_idx = probe_sorted_index(index, right.cols[right_col])
+    return _gather_join(left, right, left_col, right_col, left_idx, right_idx)
+
+
+def sort_join(left, right, left_col, right_col):
+    return sort_join_probe(sort_join_build(left, left_col), right, right_col)
+
+
+def scatter_agg(values: np.ndarray, row_idx: np.ndarray, key_idx: np.ndarray, num_keys: int, aggregator: str):
+    """
+    Aggregates values[row_idx] into num_keys slots given by key_idx, i.e. the vectorized form
+    of index_agg for sum and count. values is ignored for count.
+
+    >>> scatter_agg(np.array([5, 6, 7]), np.array([0, 1, 2, 2]), np.array([1, 0, 1, 1]), 3, "sum").tolist()
+    [6, 19, 0]
+    """
+    if aggregator == "count":
+        return np.bincount(key_idx, minlength=num_keys).astype(DTYPE)
+    elif aggregator == "sum":
+        res = np.zeros(num_keys, dtype=_acc_dtype(values))
+        # unlike bincount, add.at accumulates in the values' own (integer) type
+        np.add.at(res, key_idx, values[row_idx])
+        return res
+    else:
+        raise Exception("Unknown aggregator {}".format(aggregator))
+
+
+def index_agg(rel, over_col, distinct_keys, indeces, aggregator):
+    if callable(aggregator):
+        res = rowlib.index_agg(as_rel(rel).to_rows(), over_col, as_rel(distinct_keys).to_rows(),
+                               as_rel(indeces).to_rows(), aggregator)
+        return ColumnarRel.from_rows(res, 2)
+    rel, distinct_keys, indeces = as_rel(rel), as_rel(distinct_keys), as_rel(indeces)
+    if not distinct_keys.num_rows:
+        return _empty_like(2)
+    row_idx, key_idx = indeces.cols if indeces.num_rows else (np.empty(0, dtype=np.intp),) * 2
+    values = rel.cols[over_col] if rel.num_rows else np.empty(0, dtype=DTYPE)
+    res = scatter_agg(values, row_idx, key_idx, distinct_keys.num_rows, aggregator)
+    return ColumnarRel([distinct_keys.cols[0], res])
+
+
+def sort_by(rel, sort_by_col, budget: int = rowlib.SORT_BUDGET, tmp_dir: str = None):
+    # the columns are already resident and the permutation is the only extra allocation,
+    # so there is nothing to gain from spilling runs here
+    rel = as_rel(rel)
+    return rel.take(np.argsort(_key_col(rel, sort_by_col), kind="stable"))
+
+
+def comp_neighs(rel, comp_col):
+    keys = _key_col(as_rel(rel), comp_col)
+    return ColumnarRel([(keys[1:] == keys[:-1]).astype(DTYPE)])
+
+
+def _distinct_rows(cols: list):
+    """ Position of one row per distinct combination of values in cols, in sorted order of the combinations. """
+    order = np.lexsort(cols[::-1])
+    boundaries = np.zeros(len(order), dtype=bool)
+    boundaries[:1] = True
+    for col in cols:
+        sorted_col = col[order]
+        boundaries[1:] |= sorted_col[1:] != sorted_col[:-1]
+    return order[boundaries]
+
+
+def distinct(rel, selected_cols):
+    """
+    Same as the row engine's distinct, computed with a single lexicographic sort.
+
+    >>> distinct(ColumnarRel.from_rows([[2, 1, 5], [1, 3, 5], [2, 1, 6]], 3), [0, 1]).to_rows()
+    [[1, 3], [2, 1]]
+    """
+    rel = as_rel(rel)
+    if not rel.num_rows:
+        return _empty_like(len(selected_cols))
+    cols = [rel.cols[idx] for idx in selected_cols]
+    return ColumnarRel(cols).take(_distinct_rows(cols))
+
+
+def indexes_to_flags(lookup, rel_size):
+    flags = np.zeros(rel_size, dtype=DTYPE)
+    flags[_key_col(as_rel(lookup), 0)] = 1
+    return ColumnarRel([flags])
+
+
+def arrange_by_flags(lookups, indexes_and_flags):
+    """
+    Same as the row engine's arrange_by_flags. Each real entry is followed by as many dummy entries
+    as its key has additional lookups; their output positions are computed with a cumulative sum
+    instead of appending entry by entry.
+    """
+    lookup_keys = _key_col(as_rel(lookups), 0)
+    indexes_and_flags = as_rel(indexes_and_flags)
+    if not indexes_and_flags.num_rows:
+        return _empty_like(1)
+    keys, flags = indexes_and_flags.cols[0], indexes_and_flags.cols[1]
+    # real entries (flag set) by key first, then the dummy entries
+    in_order = np.lexsort((keys, -flags))
+    distinct_keys, counts = np.unique(lookup_keys, return_counts=True)
+    real, dummies = in_order[:len(distinct_keys)], in_order[len(distinct_keys):]
+    num_dummies = counts[np.searchsorted(distinct_keys, keys[real])] - 1
+    real_positions = np.cumsum(num_dummies + 1) - num_dummies - 1
+    res = np.empty(len(real) + int(num_dummies.sum()), dtype=DTYPE)
+    is_dummy = np.ones(len(res), dtype=bool)
+    is_dummy[real_positions] = False
+    res[real_positions] = real
+    # dummies are handed out from the back
+    res[is_dummy] = dummies[::-1][:len(res) - len(real)]
+    return ColumnarRel([res])
+
+
+def cc_filter(cond_lambda, rel):
+    """
+    Keeps the rows for which cond_lambda holds, evaluated over whole columns where possible.
+
+    >>> cc_filter(lambda row: row[0] < row[1], as_rel([[1, 3], [6, 5]])).to_rows()
+    [[1, 3]]
+    """
+    rel = as_rel(rel)
+    if not rel.num_rows:
+        return rel
+    ok, values = _eval_on_cols(cond_lambda, rel)
+    mask = _as_col(values, rel.num_rows) if ok else None
+    if mask is None:
+        mask = np.fromiter(map(cond_lambda, _rows(rel)), dtype=bool, count=rel.num_rows)
+    return rel.take(np.flatnonzero(mask))
+
+
+def distinct_count(rel, selected_col):
+    keys = _key_col(as_rel(rel), selected_col)
+    return ColumnarRel([np.array([len(np.unique(keys))], dtype=DTYPE)])
+
+
+def key_union(left, right, l: int, r: int):
+    return set(key_union_as_rel(left, right, l, r).cols[0].tolist())
+
+
+def key_union_as_rel(left, right, l: int, r: int):
+    return ColumnarRel([np.union1d(_key_col(as_rel(left), l), _key_col(as_rel(right), r))])
+
+
+def to_set(rel, key: int):
+    # deduplicate in bulk so the set is built from distinct keys only
+    return set(np.unique(_key_col(as_rel(rel), key)).tolist())
+
+
+def to_rel(rel_set: set):
+    return ColumnarRel([np.fromiter(rel_set, dtype=DTYPE, count=len(rel_set))])
+
+
+def filter_by(rel, key_rel, key_col: int, use_not_in: bool = False):
+    rel, key_rel = as_rel(rel), as_rel(key_rel)
+    if not rel.num_rows:
+        return rel
+    keys = key_rel.cols[0] if key_rel.cols else np.empty(0, dtype=DTYPE)
+    mask = np.isin(rel.cols[key_col], keys, invert=use_not_in)
+    return rel.take(np.flatnonzero(mask))
+
+
+def _wire_type(col: np.ndarray):
+    """ Same as the row engine's infer_col_type, for an array. """
+    if col.dtype.kind == "f":
+        return "d"
+    if len(col) and (col.min() < -2 ** 31 or col.max() >= 2 ** 31):
+        return "q"
+    return "i"
+
+
+def send_rel(sock, rel, col_types: str = None, compress: bool = False):
+    """
+    Same wire format as the row engine's send_rel. Columns already stored with their wire type
+    are sent straight from their buffers.
+    """
+    rel = as_rel(rel)
+    if col_types is None:
+        col_types = "".join([_wire_type(col) for col in rel.cols])
+    col_types = rowlib.col_type_codes(len(rel.cols), col_types)
+    cols = [np.ascontiguousarray(col, dtype=np.dtype(CODE_DTYPES[code]).newbyteorder("<"))
+            for code, col in zip(col_types, rel.cols)]
+    rowlib.send_cols(sock, rel.num_rows, col_types, cols, compress)
+
+
+def receive_rel(sock, num_cols: int):
+    """ Receives a relation sent with either engine's send_rel straight into preallocated columns. """
+    num_rows, col_types, encodings = rowlib.receive_header(sock, num_cols)
+    cols = []
+    for code, encoding in zip(col_types, encodings):
+        col = np.empty(num_rows, dtype=np.dtype(CODE_DTYPES[code]).newbyteorder("<"))
+        rowlib.receive_col(sock, encoding, code, memoryview(col).cast("B"))
+        cols.append(col.astype(CODE_DTYPES[code], copy=False))
+    return ColumnarRel(cols, num_rows) if cols else _empty_like(num_cols)
+
+
+def chunked(rel, chunk_size: int):
+    """ Splits relation into views of at most chunk_size rows. """
+    rel = as_rel(rel)
+    for start in range(0, rel.num_rows, chunk_size):
+        yield ColumnarRel([col[start:start + chunk_size] for col in rel.cols])
+
+
+def send_rel_chunks(sock, chunks, col_types: str = None, compress: bool = False):
+    """ Same framing as the row engine's send_rel_chunks. """
+    for chunk in chunks:
+        if len(chunk):
+            send_rel(sock, chunk, col_types, compress)
+    rowlib.send_cols(sock, 0, "", [])
+
+
+def receive_rel_chunks(sock, num_cols: int):
+    """ Yields the chunks of a relation sent with either engine's send_rel_chunks as they arrive. """
+    while True:
+        chunk = receive_rel(sock, num_cols)
+        if not chunk.num_rows:
+            return
+        yield chunk
+
+
+def _receive_keys(sock):
+    # the arriving frames are received straight into arrays, which are joined in one go at the end
+    chunks = [_key_col(chunk, 0) for chunk in receive_rel_chunks(sock, 1)]
+    return np.concatenate(chunks) if chunks else np.empty(0, dtype=DTYPE)
+
+
+def public_join_as_server(host: str, port: int, rel, key_col: int, chunk_size: int = rowlib.NET_CHUNK_SIZE,
+                          compress: bool = False, stream: str = None):
+    rel = as_rel(rel)
+    sock = rowlib.open_connection(host, port, True, stream)
+    other_keys = _receive_keys(sock)
+    print("done receive")
+    my_idx, other_idx = join_indexes(_key_col(rel, key_col), other_keys)
+    # same pair order as the row engine: by our row, then by the other party's row
+    order = np.lexsort((other_idx, my_idx))
+    my_idx, other_idx = my_idx[order], other_idx[order]
+    print("done join")
+    send_rel_chunks(sock, chunked(ColumnarRel([other_idx]), chunk_size), compress=compress)
+    print("done send")
+    sock.close()
+    return rel.take(my_idx)
+
+
+def public_join_as_client(host: str, port: int, rel, key_col: int, chunk_size: int = rowlib.NET_CHUNK_SIZE,
+                          compress: bool = False, stream: str = None):
+    rel = as_rel(rel)
+    sock = rowlib.open_connection(host, port, False, stream)
+    send_rel_chunks(sock, chunked(ColumnarRel([_key_col(rel, key_col)]), chunk_size), compress=compress)
+    idx = _receive_keys(sock)
+    sock.close()
+    return rel.take(idx)
+
+
+def pub_join(host: str, port: int, is_server: bool, rel, key_col: int, chunk_size: int = rowlib.NET_CHUNK_SIZE,
+             compress: bool = False, stream: str = None):
+    if is_server:
+        return public_join_as_server(host, port, rel, key_col, chunk_size, compress, stream)
+    else:
+        return public_join_as_client(host, port, rel, key_col, chunk_size, compress, stream)
+
+
+def _concat(rels: list, num_cols: int):
+    if not rels:
+        return _empty_like(num_cols)
+    return ColumnarRel([np.concatenate(cols) for cols in zip(*[rel.cols for rel in rels])])
+
+
+def _owned_or_dummy(col: np.ndarray, idx: np.ndarray, owned: np.ndarray):
+    # dummy values are ones, like in the row engine
+    res = np.ones(len(idx), dtype=col.dtype)
+    res[owned] = col[idx[owned]]
+    return res
+
+
+def reconstruct(left, right, left_col: int, right_col: int, idx_rel, me: int, num_left_cols: int,
+                num_right_cols: int):
+    """
+    Same as the row engine's reconstruct, with the four index columns (left row, left owner, right
+    row, right owner) of idx_rel as arrays. The rows we own are gathered with masked takes and the
+    others filled with dummy values in bulk.
+
+    >>> left = ColumnarRel.from_rows([[1, 10], [2, 20]], 2)
+    >>> right = ColumnarRel.from_rows([[2, 200]], 2)
+    >>> reconstruct(left, right, 0, 0, [[1, 0, 0, 0], [0, 1, 0, 0], [0, 0, 3, 1]], 0, 2, 2).to_rows()
+    [[2, 20, 200], [2, 1, 200], [1, 10, 1]]
+    """
+    idx_rel = as_rel(idx_rel)
+    if not idx_rel.num_rows:
+        return _empty_like(num_left_cols + num_right_cols - 1)
+    left, right = as_rel(left), as_rel(right)
+    if not left.cols:
+        left = _empty_like(num_left_cols)
+    if not right.cols:
+        right = _empty_like(num_right_cols)
+    left_idx, left_own, right_idx, right_own = idx_rel.cols
+    left_owned, right_owned = left_own == me, right_own == me
+
+    key = _owned_or_dummy(right.cols[right_col], right_idx, right_owned)
+    from_left = [_owned_or_dummy(col, left_idx, left_owned) for idx, col in enumerate(left.cols) if idx != left_col]
+    from_right = [_owned_or_dummy(col, right_idx, right_owned)
+                  for idx, col in enumerate(right.cols) if idx != right_col]
+    return ColumnarRel([key] + from_left + from_right, idx_rel.num_rows)
+
+
+def _send_key_cols(sock, key_cols: list, chunk_size: int, compress: bool):
+    """ Same as the row engine's _send_keys, for key columns as arrays. """
+    def send():
+        for keys in key_cols:
+            send_rel_chunks(sock, chunked(ColumnarRel([keys]), chunk_size), compress=compress)
+
+    sender = threading.Thread(target=send, daemon=True)
+    sender.start()
+    return sender
+
+
+def public_join_as_server_part(host: str, port: int, my_left_rel, my_right_rel, left_key_col: int,
+                               right_key_col: int, num_left_cols: int, num_right_cols: int,
+                               chunk_size: int = rowlib.NET_CHUNK_SIZE, compress: bool = False, stream: str = None):
+    """
+    Same protocol as the row engine's public_join_as_server_part. The left keys of both parties are
+    sorted into one index, which our right keys and then each arriving frame of the client's right
+    keys probe in one go.
+    """
+    my_left_rel, my_right_rel = as_rel(my_left_rel), as_rel(my_right_rel)
+    sock = rowlib.open_connection(host, port, True, stream)
+    my_left_keys = _key_col(my_left_rel, left_key_col)
+    other_left_keys = _receive_keys(sock)
+    print("done receive")
+
+    # our left rows come first, so pairs are ordered by right row and then left row like in the row engine
+    left_idx = np.concatenate([np.arange(len(my_left_keys)), np.arange(len(other_left_keys))]).astype(DTYPE)
+    left_own = np.repeat(np.array([0, 1], dtype=DTYPE), [len(my_left_keys), len(other_left_keys)])
+    index = sorted_index(np.concatenate([my_left_keys, other_left_keys]))
+
+    def probe(right_keys: np.ndarray, right_own: int, offset: int):
+        pair_left, pair_right = probe_sorted_index(index, right_keys)
+        return ColumnarRel([left_idx[pair_left], left_own[pair_left], pair_right.astype(DTYPE) + offset,
+                            np.full(len(pair_right), right_own, dtype=DTYPE)], len(pair_right))
+
+    def index_rels():
+        yield probe(_key_col(my_right_rel, right_key_col), 0, 0)
+        num_received = 0
+        for chunk in receive_rel_chunks(sock, 1):
+            yield probe(_key_col(chunk, 0), 1, num_received)
+            num_received += chunk.num_rows
+
+    res = []
+
+    def reconstructed():
+        for idx_rel in index_rels():
+            for idx_chunk in chunked(idx_rel, chunk_size):
+                res.append(reconstruct(my_left_rel, my_right_rel, left_key_col, right_key_col, idx_chunk, 0,
+                                       num_left_cols, num_right_cols))
+                yield idx_chunk
+
+    send_rel_chunks(sock, reconstructed(), compress=compress)
+    print("done send")
+    sock.close()
+    return _concat(res, num_left_cols + num_right_cols - 1)
+
+
+def public_join_as_client_part(host: str, port: int, left_rel, right_rel, left_key_col: int, right_key_col: int,
+                               num_left_cols: int, num_right_cols: int, chunk_size: int = rowlib.NET_CHUNK_SIZE,
+                               compress: bool = False, stream: str = None):
+    left_rel, right_rel = as_rel(left_rel), as_rel(right_rel)
+    sock = rowlib.open_connection(host, port, False, stream)
+    sender = _send_key_cols(sock, [_key_col(left_rel, left_key_col), _key_col(right_rel, right_key_col)],
+                            chunk_size, compress)
+    res = [reconstruct(left_rel, right_rel, left_key_col, right_key_col, idx_rel, 1, num_left_cols, num_right_cols)
+           for idx_rel in receive_rel_chunks(sock, 4)]
+    sender.join()
+    sock.close()
+    return _concat(res, num_left_cols + num_right_cols - 1)
+
+
+def pub_join_part(host: str, port: int, is_server: bool, rel, other_rel, key_col: int, num_left_cols: int,
+                  num_right_cols: int, chunk_size: int = rowlib.NET_CHUNK_SIZE, compress: bool = False,
+                  stream: str = None):
+    if is_server:
+        return public_join_as_server_part(host, port, rel, other_rel, key_col, key_col, num_left_cols,
+                                          num_right_cols, chunk_size, compress, stream)
+    else:
+        return public_join_as_client_part(host, port, rel, other_rel, key_col, key_col, num_left_cols,
+                                          num_right_cols, chunk_size, compress, stream)
+
+
+def pub_intersect_as_server(host: str, port: int, my_rel, my_key_col: int, chunk_size: int = rowlib.NET_CHUNK_SIZE,
+                            compress: bool = False, bloom_fp_rate: float = None, stream: str = None):
+    """ Same protocol as the row engine's pub_intersect_as_server. """
+    sock = rowlib.open_connection(host, port, True, stream)
+    my_keys = np.unique(_key_col(as_rel(my_rel), my_key_col))
+    if bloom_fp_rate is not None:
+        rowlib.send_bytes(sock, BloomFilter.from_keys(my_keys, bloom_fp_rate).to_bytes())
+    other_keys = _receive_keys(sock)
+    print("done receive")
+    res = ColumnarRel([np.intersect1d(my_keys, other_keys)])
+    send_rel_chunks(sock, chunked(res, chunk_size), compress=compress)
+    sock.close()
+    return res
+
+
+def pub_intersect_as_client(host: str, port: int, my_rel, my_key_col: int, chunk_size: int = rowlib.NET_CHUNK_SIZE,
+                            compress: bool = False, bloom_fp_rate: float = None, stream: str = None):
+    sock = rowlib.open_connection(host, port, False, stream)
+    keys = _key_col(as_rel(my_rel), my_key_col)
+    if bloom_fp_rate is not None:
+        bloom = BloomFilter.from_bytes(rowlib.receive_bytes(sock))
+        keys = np.unique(keys)
+        keys = keys[bloom.contains(keys)]
+    send_rel_chunks(sock, chunked(ColumnarRel([keys]), chunk_size), compress=compress)
+    res = ColumnarRel([_receive_keys(sock)])
+    sock.close()
+    return res
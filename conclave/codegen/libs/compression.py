@@ -0,0 +1,148 @@
+"""
+Compact column encodings for relations sent between parties.
+
+Every column of a frame carries a one-letter encoding code in the frame header, so the
+sender picks an encoding per column and the receiver decodes whatever it is sent:
+
+    r   raw little-endian values (no payload prefix)
+    v   delta + zigzag varint, for non-decreasing integer columns such as sorted keys and indexes
+    b   bit-packing of the offsets from the column minimum, for small-range integer columns
+    z   zlib, for everything else
+
+All encoders and decoders work on whole columns with numpy, a frame holds at most
+NET_CHUNK_SIZE rows so the temporaries stay small.
+"""
+import struct
+import zlib
+
+import numpy as np
+
+RAW = "r"
+DELTA_VARINT = "v"
+BITPACK = "b"
+ZLIB = "z"
+
+# column minimum and bit width, in front of bit-packed values
+BITPACK_HEADER = struct.Struct("<qB")
+# varints hold 7 bits per byte, so 64-bit values take at most 10 bytes
+MAX_VARINT_BYTES = 10
+
+_TYPE_DTYPES = {"q": np.dtype("<i8"), "i": np.dtype("<i4"), "d": np.dtype("<f8")}
+
+
+def varint_encode(values: np.ndarray):
+    """
+    LEB128-encode unsigned 64-bit values.
+
+    >>> varint_encode(np.array([1, 300], dtype=np.uint64))
+    b'\\x01\\xac\\x02'
+    """
+    values = values.astype(np.uint64, copy=False)
+    num_bytes = np.ones(len(values), dtype=np.int64)
+    for shift in range(7, 7 * MAX_VARINT_BYTES, 7):
+        num_bytes += values >= np.uint64(1 << shift)
+    starts = np.cumsum(num_bytes) - num_bytes
+    out = np.empty(int(num_bytes.sum()), dtype=np.uint8)
+    for byte in range(MAX_VARINT_BYTES):
+        rows = np.flatnonzero(num_bytes > byte)
+        if not len(rows):
+            break
+        group = (values[rows] >> np.uint64(7 * byte)) & np.uint64(0x7F)
+        more = (num_bytes[rows] > byte + 1).astype(np.uint64) << np.uint64(7)
+        out[starts[rows] + byte] = group | more
+    return out.tobytes()
+
+
+def varint_decode(payload: bytes, num_values: int):
+    """
+    Inverse of varint_encode.
+
+    >>> varint_decode(b'\\x01\\xac\\x02', 2).tolist()
+    [1, 300]
+    """
+    data = np.frombuffer(payload, dtype=np.uint8)
+    last = data < 0x80
+    if int(last.sum()) != num_values or (len(data) and not last[-1]):
+        raise Exception("Malformed varint column")
+    if not num_values:
+        return np.empty(0, dtype=np.uint64)
+    ends = np.flatnonzero(last)
+    starts = np.concatenate([[0], ends[:-1] + 1])
+    value_idx = np.repeat(np.arange(num_values), ends - starts + 1)
+    shifts = (np.arange(len(data)) - starts[value_idx]).astype(np.uint64) * np.uint64(7)
+    groups = (data & 0x7F).astype(np.uint64) << shifts
+    # the groups of one value occupy disjoint bits, so adding them up assembles the value
+    return np.add.reduceat(groups, starts)
+
+
+def _zigzag(values: np.ndarray):
+    return (values.astype(np.int64) << np.int64(1) ^ (values.astype(np.int64) >> np.int64(63))).view(np.uint64)
+
+
+def _unzigzag(values: np.ndarray):
+    return ((values >> np.uint64(1)) ^ (np.uint64(0) - (values & np.uint64(1)))).view(np.int64)
+
+
+def _delta_varint(values: np.ndarray):
+    return varint_encode(_zigzag(np.diff(values, prepend=np.int64(0))))
+
+
+def _bitpack(values: np.ndarray, width: int):
+    low = int(values.min())
+    offsets = values.astype(np.uint64) - np.uint64(low % 2 ** 64)
+    bits = (offsets[:, None] >> np.arange(width, dtype=np.uint64)) & np.uint64(1)
+    return BITPACK_HEADER.pack(low, width) + np.packbits(bits.astype(np.uint8), bitorder="little").tobytes()
+
+
+def _bitunpack(payload: bytes, num_values: int):
+    low, width = BITPACK_HEADER.unpack_from(payload)
+    packed = np.frombuffer(payload, dtype=np.uint8, offset=BITPACK_HEADER.size)
+    bits = np.unpackbits(packed, count=num_values * width, bitorder="little").reshape(num_values, width)
+    offsets = (bits.astype(np.uint64) << np.arange(width, dtype=np.uint64)).sum(axis=1, dtype=np.uint64)
+    return (offsets + np.uint64(low % 2 ** 64)).view(np.int64)
+
+
+def encode_col(col, type_code: str):
+    """
+    Picks the encoding for a column (any buffer of little-endian values of type_code) and returns
+    it along with the encoded bytes. Columns that would not get smaller are sent raw, with a
+    payload of None.
+
+    >>> encode_col(np.arange(1000, dtype=np.int64), "q")[0]
+    'v'
+    >>> encode_col(np.array([7, 3, 5, 4] * 100, dtype=np.int64), "q")[0]
+    'b'
+    """
+    col = np.frombuffer(col, dtype=_TYPE_DTYPES[type_code])
+    if not len(col):
+        return RAW, None
+    if type_code == "d":
+        encoding, payload = ZLIB, zlib.compress(col.tobytes())
+    else:
+        values = col.astype(np.int64)
+        width = (int(values.max()) - int(values.min())).bit_length()
+        if (values[1:] >= values[:-1]).all():
+            encoding, payload = DELTA_VARINT, _delta_varint(values)
+        elif width < 8 * col.itemsize:
+            encoding, payload = BITPACK, _bitpack(values, width)
+        else:
+            encoding, payload = ZLIB, zlib.compress(col.tobytes())
+    if len(payload) >= col.nbytes:
+        return RAW, None
+    return encoding, payload
+
+
+def decode_col(payload: bytes, encoding: str, type_code: str, num_rows: int):
+    """ Decodes a column encoded with encode_col into an array of little-endian values of type_code. """
+    dtype = _TYPE_DTYPES[type_code]
+    if encoding == ZLIB:
+        col = np.frombuffer(zlib.decompress(payload), dtype=dtype)
+    elif encoding == DELTA_VARINT:
+        col = np.cumsum(_unzigzag(varint_decode(payload, num_rows)), dtype=np.int64)
+    elif encoding == BITPACK:
+        col = _bitunpack(payload, num_rows)
+    else:
+        raise Exception("Unknown column encoding {}".format(encoding))
+    if len(col) != num_rows:
+        raise Exception("Expected {} values, decoded {}".format(num_rows, len(col)))
+    return col.astype(dtype, copy=False)
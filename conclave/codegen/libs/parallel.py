@@ -0,0 +1,192 @@
+"""
+Multi-core execution of key-based primitives for generated Python jobs.
+
+Inputs are hash-partitioned by key and their key and value columns are copied into a
+memory-mapped file once. Worker processes map that file and each processes one partition,
+so only partition bounds and (small) results travel between processes.
+Results are put back into the order the serial primitives produce and returned in the
+caller's representation, i.e. lists of rows for the list engine and ColumnarRel for the
+columnar engine.
+"""
+import atexit
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import conclave.codegen.libs.columnar as collib
+
+# inputs with fewer rows than this are processed serially, worker round trips would dominate
+PARALLEL_MIN_ROWS = 2 ** 16
+# multiplier for Fibonacci hashing of keys onto partitions
+HASH_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+# files shared with workers are kept in memory where the system allows it
+SHARED_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else None
+
+# one pool per worker count, created on first use and reused across calls
+_pools = {}
+
+
+def _pool(workers: int):
+    if workers not in _pools:
+        _pools[workers] = ProcessPoolExecutor(max_workers=workers)
+    return _pools[workers]
+
+
+@atexit.register
+def shutdown_pools():
+    """ Stops the worker processes of all pools, called when the job's process exits. """
+    for pool in _pools.values():
+        pool.shutdown()
+    _pools.clear()
+
+
+class _SharedColumns:
+    """ Columns copied into a single memory-mapped file that workers map by path. """
+
+    def __init__(self, cols: list):
+        # every column starts at a multiple of 8 bytes
+        sizes = [col.nbytes + (-col.nbytes % 8) for col in cols]
+        fd, self.path = tempfile.mkstemp(suffix=".cols", dir=SHARED_DIR)
+        os.close(fd)
+        buf = np.memmap(self.path, dtype=np.uint8, mode="w+", shape=(max(sum(sizes), 1),))
+        self.layout = []
+        offset = 0
+        for col, size in zip(cols, sizes):
+            buf[offset:offset + col.nbytes].view(col.dtype)[:] = col
+            self.layout.append((offset, len(col), col.dtype.str))
+            offset += size
+        buf.flush()
+        del buf
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        os.remove(self.path)
+
+
+def _attach(path: str, layout: list):
+    buf = np.memmap(path, dtype=np.uint8, mode="r")
+    return [buf[offset:offset + length * np.dtype(dtype).itemsize].view(dtype) for offset, length, dtype in layout]
+
+
+def _partition(keys: np.ndarray, workers: int):
+    """
+    Hash-partition keys. Returns the row positions grouped by partition (ascending within each
+    partition) and the bounds of each partition in that grouping.
+    """
+    parts = ((keys.astype(np.uint64) * HASH_MULTIPLIER) >> np.uint64(32)) % np.uint64(workers)
+    positions = np.argsort(parts, kind="stable")
+    bounds = np.searchsorted(parts[positions], np.arange(workers + 1, dtype=np.uint64))
+    return positions, bounds
+
+
+def _aggregate_partition(path: str, layout: list, lo: int, hi: int, aggregator: str):
+    """ Sum or count one partition. Returns group keys, aggregates and each group's first row position. """
+    keys, values, positions = _attach(path, layout)
+    keys, positions = keys[lo:hi], positions[lo:hi]
+    order, starts, _ = collib._group(keys)
+    if aggregator == "count":
+        res = np.diff(np.append(starts, len(keys))).astype(collib.DTYPE)
+    else:
+        res = np.add.reduceat(values[lo:hi][order], starts, dtype=collib._acc_dtype(values))
+    return keys[order[starts]], res, positions[order[starts]]
+
+
+def _join_partition(path: str, layout: list, left_lo: int, left_hi: int, right_lo: int, right_hi: int):
+    """ Join one partition. Returns the original (left, right) row positions of all matching pairs. """
+    left_keys, left_positions, right_keys, right_positions = _attach(path, layout)
+    left_idx, right_idx = collib.join_indexes(left_keys[left_lo:left_hi], right_keys[right_lo:right_hi])
+    return left_positions[left_lo:left_hi][left_idx], right_positions[right_lo:right_hi][right_idx]
+
+
+def _filter_partition(path: str, layout: list, lo: int, hi: int, key_lo: int, key_hi: int, use_not_in: bool):
+    """ Filter one partition. Returns the original positions of the rows that pass. """
+    keys, positions, filter_keys = _attach(path, layout)
+    mask = np.isin(keys[lo:hi], filter_keys[key_lo:key_hi], invert=use_not_in)
+    return positions[lo:hi][mask]
+
+
+def _as_caller_rel(rel: collib.ColumnarRel, like):
+    return rel if isinstance(like, collib.ColumnarRel) else rel.to_rows()
+
+
+def _run_aggregate(rel, group_by_idx: int, over_idx: [int, None], aggregator: str, workers: int):
+    if workers <= 1 or len(rel) < PARALLEL_MIN_ROWS:
+        if aggregator == "count":
+            return _as_caller_rel(collib.aggregate_count(rel, group_by_idx), rel)
+        return _as_caller_rel(collib.aggregate(rel, group_by_idx, over_idx, aggregator), rel)
+
+    cols = collib.as_rel(rel).cols
+    keys = cols[group_by_idx]
+    positions, bounds = _partition(keys, workers)
+    values = cols[over_idx][positions] if aggregator != "count" else np.empty(0, dtype=collib.DTYPE)
+    with _SharedColumns([keys[positions], values, positions]) as shared:
+        futures = [_pool(workers).submit(_aggregate_partition, shared.path, shared.layout,
+                                         bounds[part], bounds[part + 1], aggregator)
+                   for part in range(workers)]
+        results = [future.result() for future in futures]
+
+    out_keys, out_aggs, first_positions = [np.concatenate(res) for res in zip(*results)]
+    # list groups in order of first appearance, like the serial primitives
+    appearance = np.argsort(first_positions, kind="stable")
+    return _as_caller_rel(collib.ColumnarRel([out_keys[appearance], out_aggs[appearance]]), rel)
+
+
+def par_aggregate(rel, group_by_idx: int, over_idx: int, aggregator: str, workers: int):
+    """ Parallel version of aggregate. """
+    return _run_aggregate(rel, group_by_idx, over_idx, aggregator, workers)
+
+
+def par_aggregate_count(rel, group_by_idx: int, workers: int):
+    """ Parallel version of aggregate_count. """
+    return _run_aggregate(rel, group_by_idx, None, "count", workers)
+
+
+def par_join(left, right, left_col: int, right_col: int, workers: int):
+    """
+    Parallel version of join. Both inputs are partitioned on their join keys, so matching rows
+    always end up in the same partition.
+    """
+    if workers <= 1 or len(left) + len(right) < PARALLEL_MIN_ROWS or not len(left) or not len(right):
+        return _as_caller_rel(collib.join(left, right, left_col, right_col), left)
+
+    left_rel, right_rel = collib.as_rel(left), collib.as_rel(right)
+    left_keys, right_keys = left_rel.cols[left_col], right_rel.cols[right_col]
+    left_positions, left_bounds = _partition(left_keys, workers)
+    right_positions, right_bounds = _partition(right_keys, workers)
+    with _SharedColumns([left_keys[left_positions], left_positions,
+                         right_keys[right_positions], right_positions]) as shared:
+        futures = [_pool(workers).submit(_join_partition, shared.path, shared.layout,
+                                         left_bounds[part], left_bounds[part + 1],
+                                         right_bounds[part], right_bounds[part + 1])
+                   for part in range(workers)]
+        results = [future.result() for future in futures]
+
+    left_idx, right_idx = [np.concatenate(res) for res in zip(*results)]
+    # order pairs by right row, then left row, like the serial join
+    order = np.lexsort((left_idx, right_idx))
+    return _as_caller_rel(collib._gather_join(left_rel, right_rel, left_col, right_col,
+                                              left_idx[order], right_idx[order]), left)
+
+
+def par_filter_by(rel, key_rel, key_col: int, use_not_in: bool, workers: int):
+    """ Parallel version of filter_by. """
+    if workers <= 1 or len(rel) < PARALLEL_MIN_ROWS:
+        return _as_caller_rel(collib.filter_by(rel, key_rel, key_col, use_not_in), rel)
+
+    in_rel = collib.as_rel(rel)
+    cols = in_rel.cols
+    key_rel = collib.as_rel(key_rel)
+    filter_keys = key_rel.cols[0] if key_rel.cols else np.empty(0, dtype=collib.DTYPE)
+    positions, bounds = _partition(cols[key_col], workers)
+    filter_positions, filter_bounds = _partition(filter_keys, workers)
+    with _SharedColumns([cols[key_col][positions], positions, filter_keys[filter_positions]]) as shared:
+        futures = [_pool(workers).submit(_filter_partition, shared.path, shared.layout,
+                                         bounds[part], bounds[part + 1],
+                                         filter_bounds[part], filter_bounds[part + 1], use_not_in)
+                   for part in range(workers)]
+        kept = np.sort(np.concatenate([future.result() for future in futures]))
+    return _as_caller_rel(in_rel.take(kept), rel)
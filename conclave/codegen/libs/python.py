@@ -1,35 +1,179 @@
+import array
+import heapq
+import itertools
+import mmap
+import os
+import pickle
 import socket
 import struct
-import time
-from collections import deque
-
-INT_SIZE = 4
+import sys
+import tempfile
+import threading
+
+import conclave.codegen.libs.channels as channels
+
+# number of rows parsed at once when reading CSV input
+CHUNK_SIZE = 2 ** 16
+# size of the buffer relation files are written through
+WRITE_BUFFER_SIZE = 2 ** 20
+
+# array/struct type code of each column type, binary relation files and the wire store values with these
+COL_TYPE_CODES = {"INTEGER": "q", "INT32": "i", "FLOAT": "d"}
+DEFAULT_COL_TYPE = "q"
+
+# binary relation files: header followed by one fixed-width little-endian column after another
+REL_MAGIC = b"CCRL"
+REL_VERSION = 1
+# magic, version, number of columns, number of rows
+REL_HEADER = struct.Struct("<4sHHq")
+# per-column type codes follow the header, the header and each column are padded to a multiple of 8 bytes
+# relations sent over sockets: number of rows and number of columns, followed by one type code and
+# one encoding code per column and the columns one after another
+WIRE_HEADER = struct.Struct("<qH")
+# raw columns are sent as little-endian arrays, columns in any other encoding (see compression.py)
+# and other messages are preceded by their size in bytes
+RAW_ENCODING = "r"
+PAYLOAD_SIZE = struct.Struct("<q")
+# number of rows per frame when relations are streamed between parties
+NET_CHUNK_SIZE = 2 ** 16
+# maximum number of rows sorted in memory before sorted runs are spilled to disk
+SORT_BUDGET = 2 ** 22
+# number of rows pickled at once when writing and reading sorted runs
+RUN_BATCH_SIZE = 2 ** 12
+
+
+def format_rows(rows: list):
+    """ Formats a block of rows as CSV lines in one go. """
+    if not rows:
+        return ""
+    line = ",".join(["{}"] * len(rows[0])) + "\n"
+    return "".join([line.format(*row) for row in rows])
 
 
 def write_rel(job_dir, rel_name, rel, schema_header):
+    write_rel_chunks(job_dir, rel_name, [rel], schema_header)
+
+
+def write_rel_chunks(job_dir, rel_name, chunks, schema_header):
+    """ Same as write_rel but consumes an iterable of chunks. """
     print("Will write to {}/{}".format(job_dir, rel_name))
     path = "{}/{}".format(job_dir, rel_name)
-    with open(path, "w") as f:
+    with open(path, "w", buffering=WRITE_BUFFER_SIZE) as f:
         # hack header
         f.write(schema_header + "\n")
-        for row in rel:
-            f.write(",".join([str(val) for val in row]) + "\n")
+        for chunk in chunks:
+            for start in range(0, len(chunk), CHUNK_SIZE):
+                f.write(format_rows(chunk[start:start + CHUNK_SIZE]))
 
 
-def read_rel(path_to_rel):
-    rows = []
+def is_header_line(line: str, delimiter: str):
+    try:
+        [float(val) for val in line.split(delimiter)]
+        return False
+    except ValueError:
+        return True
+
+
+def col_type_codes(num_cols: int, col_types: [str, None]):
+    """ Returns the type code of each column, which default to 64-bit integers. """
+    if col_types is None:
+        return DEFAULT_COL_TYPE * num_cols
+    if len(col_types) != num_cols or not set(col_types) <= set(COL_TYPE_CODES.values()):
+        raise Exception("Invalid column types {}".format(col_types))
+    return col_types
+
+
+def _parse_rows(block: list, delimiter: str, col_types: [str, None]):
+    if col_types is None or "d" not in col_types:
+        return [[int(val) for val in line.split(delimiter)] for line in block if not line.isspace()]
+    parsers = [float if code == "d" else int for code in col_types]
+    return [[parse(val) for parse, val in zip(parsers, line.split(delimiter))] for line in block if not line.isspace()]
+
+
+def read_rel_chunks(path_to_rel, chunk_size: int = CHUNK_SIZE, delimiter: str = ",", col_types: str = None):
+    """
+    Lazily reads relation from CSV file, yielding lists of at most chunk_size rows. Columns whose
+    type code in col_types is 'd' are parsed as floats, all others as ints.
+    """
     with open(path_to_rel, "r") as f:
-        it = iter(f.readlines())
-        for raw_row in it:
-            # TODO: only need to do this for first row
-            try:
-                split_row = [int(val) for val in raw_row.split(",")]
-                rows.append([int(val) for val in split_row])
-            except ValueError:
-                print("skipped header")
+        first_line = f.readline()
+        if not first_line:
+            return
+        if is_header_line(first_line, delimiter):
+            print("skipped header")
+            lines = f
+        else:
+            lines = itertools.chain([first_line], f)
+        while True:
+            block = list(itertools.islice(lines, chunk_size))
+            if not block:
+                return
+            yield _parse_rows(block, delimiter, col_types)
+
+
+def read_rel_rows(path_to_rel, chunk_size: int = CHUNK_SIZE, delimiter: str = ",", col_types: str = None):
+    """ Same as read_rel_chunks but yields single rows, e.g. for sorting them within a memory budget. """
+    for chunk in read_rel_chunks(path_to_rel, chunk_size, delimiter, col_types):
+        yield from chunk
+
+
+def read_rel(path_to_rel, delimiter: str = ",", col_types: str = None):
+    rows = []
+    for chunk in read_rel_chunks(path_to_rel, delimiter=delimiter, col_types=col_types):
+        rows.extend(chunk)
     return rows
 
 
+def pack_rel_header(col_types: str, num_rows: int):
+    """ Returns header of a binary relation file. """
+    header = REL_HEADER.pack(REL_MAGIC, REL_VERSION, len(col_types), num_rows) + col_types.encode()
+    return header + b"\0" * (-len(header) % 8)
+
+
+def unpack_rel_header(buf):
+    """ Parses header of a binary relation file. Returns the column type codes, number of rows and data offset. """
+    magic, version, num_cols, num_rows = REL_HEADER.unpack_from(buf, 0)
+    if magic != REL_MAGIC or version != REL_VERSION:
+        raise Exception("Not a binary relation file")
+    col_types = bytes(buf[REL_HEADER.size:REL_HEADER.size + num_cols]).decode()
+    col_type_codes(num_cols, col_types)
+    offset = REL_HEADER.size + num_cols
+    return col_types, num_rows, offset + (-offset % 8)
+
+
+def write_rel_bin(job_dir, rel_name, rel, num_cols, col_types: str = None):
+    print("Will write to {}/{}".format(job_dir, rel_name))
+    path = "{}/{}".format(job_dir, rel_name)
+    col_types = col_type_codes(num_cols, col_types)
+    with open(path, "wb") as f:
+        f.write(pack_rel_header(col_types, len(rel)))
+        for col_idx, code in enumerate(col_types):
+            col = array.array(code, [row[col_idx] for row in rel])
+            if sys.byteorder != "little":
+                col.byteswap()
+            col.tofile(f)
+            f.write(b"\0" * (-len(col) * col.itemsize % 8))
+
+
+def read_rel_bin(path_to_rel):
+    with open(path_to_rel, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        col_types, num_rows, offset = unpack_rel_header(buf)
+        cols = []
+        for code in col_types:
+            col = array.array(code)
+            size = num_rows * col.itemsize
+            col.frombytes(buf[offset:offset + size])
+            if sys.byteorder != "little":
+                col.byteswap()
+            cols.append(col)
+            offset += size + (-size % 8)
+    return [list(row) for row in zip(*cols)]
+
+
+def num_rows(rel):
+    return [[len(rel)]]
+
+
 def project(rel, selected_cols):
     return [[row[idx] for idx in selected_cols] for row in rel]
 
@@ -55,26 +199,187 @@ def aggregate_count(rel, group_by_idx):
     return [[key, value] for key, value in acc.items()]
 
 
+def _agg_init(aggregator, value):
+    if aggregator == "count":
+        return 1
+    elif aggregator == "mean":
+        return [value, 1]
+    elif aggregator in {"sum", "min", "max"}:
+        return value
+    else:
+        raise Exception("Unknown aggregator {}".format(aggregator))
+
+
+def _agg_update(aggregator, acc, value):
+    if aggregator == "sum":
+        return acc + value
+    elif aggregator == "count":
+        return acc + 1
+    elif aggregator == "min":
+        return value if value < acc else acc
+    elif aggregator == "max":
+        return value if value > acc else acc
+    else:
+        acc[0] += value
+        acc[1] += 1
+        return acc
+
+
+def _group_by_update(acc, rel, group_by_idxs, aggs):
+    for row in rel:
+        key = tuple(row[idx] for idx in group_by_idxs)
+        if key not in acc:
+            acc[key] = [_agg_init(aggregator, row[over_idx] if over_idx is not None else None)
+                        for over_idx, aggregator in aggs]
+        else:
+            values = acc[key]
+            for agg_idx, (over_idx, aggregator) in enumerate(aggs):
+                values[agg_idx] = _agg_update(
+                    aggregator, values[agg_idx], row[over_idx] if over_idx is not None else None)
+
+
+def _mean(acc):
+    # means of integer columns are truncated
+    return acc[0] / acc[1] if isinstance(acc[0], float) else int(acc[0] / acc[1])
+
+
+def _group_by_result(acc, aggs):
+    res = []
+    for key, values in acc.items():
+        out_values = [_mean(value) if aggregator == "mean" else value
+                      for value, (_, aggregator) in zip(values, aggs)]
+        res.append(list(key) + out_values)
+    return res
+
+
+def group_by(rel, group_by_idxs, aggs):
+    """
+    Group by any number of columns and compute several aggregates in a single pass. Each entry
+    of aggs is an (over_idx, aggregator) pair where aggregator is one of sum, count, min, max
+    or mean (over_idx is ignored for count). Output columns are the group columns followed by
+    one column per aggregate.
+    """
+    acc = {}
+    _group_by_update(acc, rel, group_by_idxs, aggs)
+    return _group_by_result(acc, aggs)
+
+
+def stream_group_by(chunks, group_by_idxs, aggs):
+    """ Same as group_by but consumes an iterable of chunks, only keeping per-group state. """
+    acc = {}
+    for chunk in chunks:
+        _group_by_update(acc, chunk, group_by_idxs, aggs)
+    return _group_by_result(acc, aggs)
+
+
 def arithmetic_project(rel, target_col_idx, f):
-    return [[value if idx != target_col_idx else f(row) for idx, value in enumerate(row)] for row in rel]
+    res = []
+    for row in rel:
+        out = row.copy()
+        out[target_col_idx] = f(row)
+        res.append(out)
+    return res
+
+
+def map_rows(rel, row_fn, num_cols):
+    """ Applies row_fn to every row in a single pass, dropping rows for which it returns None. """
+    return [out for out in map(row_fn, rel) if out is not None]
 
 
 def project_indeces(rel):
     return [[idx] + rest for (idx, rest) in enumerate(rel)]
 
 
-def join_flags(left, right, left_col, right_col):
-    return [[int(left_row[left_col] == right_row[right_col])] for left_row in left for right_row in right]
+# flags stored in each possible byte of a PackedFlags bitmap, least significant bit first
+BYTE_FLAGS = [tuple((byte >> bit) & 1 for bit in range(8)) for byte in range(256)]
 
 
-def join(left, right, left_col, right_col):
+class PackedFlags:
+    """
+    Relation with a single 0/1 column, stored as a bitmap with one bit per row. It can be
+    indexed, sliced and iterated like a list of [flag] rows, but only materializes the rows
+    that are asked for.
+
+    >>> flags = PackedFlags(10)
+    >>> flags.set(3)
+    >>> flags.set(9)
+    >>> len(flags), flags[3], flags[7:]
+    (10, [1], [[0], [0], [1]])
+    """
+
+    def __init__(self, num_rows: int, bits: [bytearray, None] = None):
+        self.num_rows = num_rows
+        self.bits = bits if bits is not None else bytearray((num_rows + 7) // 8)
+
+    def set(self, idx: int):
+        """ Sets the flag of row idx. """
+        self.bits[idx >> 3] |= 1 << (idx & 7)
+
+    def flags(self, start: int, stop: int):
+        """ Returns the flags of rows start to stop as a list of ints. """
+        first = start >> 3
+        flags = [flag for byte in self.bits[first:(stop + 7) >> 3] for flag in BYTE_FLAGS[byte]]
+        return flags[start - 8 * first:stop - 8 * first]
+
+    def chunks(self, chunk_size: int = CHUNK_SIZE):
+        """ Yields the rows in lists of at most chunk_size rows. """
+        for start in range(0, self.num_rows, chunk_size):
+            yield self[start:start + chunk_size]
+
+    def __len__(self):
+        return self.num_rows
+
+    def __iter__(self):
+        for chunk in self.chunks():
+            yield from chunk
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            start, stop, step = idx.indices(self.num_rows)
+            if step != 1:
+                raise Exception("Unsupported slice step {}".format(step))
+            return [[flag] for flag in self.flags(start, max(start, stop))]
+        if idx < 0:
+            idx += self.num_rows
+        if not 0 <= idx < self.num_rows:
+            raise IndexError("flag index out of range")
+        return [(self.bits[idx >> 3] >> (idx & 7)) & 1]
+
+
+def join_flags(left, right, left_col, right_col):
+    """
+    Flags, for each pair of a left and a right row in row-major order, whether their keys match.
+    Matching pairs are found through a hash table over the right keys, so the work is linear in
+    the size of the inputs and the number of matches rather than in the number of pairs.
+    """
+    right_rows_by_key = {}
+    for idx, row in enumerate(right):
+        key = row[right_col]
+        if key not in right_rows_by_key:
+            right_rows_by_key[key] = []
+        right_rows_by_key[key].append(idx)
+
+    num_right = len(right)
+    flags = PackedFlags(len(left) * num_right)
+    for left_idx, row in enumerate(left):
+        for right_idx in right_rows_by_key.get(row[left_col], ()):
+            flags.set(left_idx * num_right + right_idx)
+    return flags
+
+
+def join_build(left, left_col):
+    """ Builds the hash table over the left input of a join, so that it can be probed repeatedly. """
     left_row_map = dict()
     for left_row in left:
         key = left_row[left_col]
         if key not in left_row_map:
             left_row_map[key] = []
         left_row_map[key].append(left_row)
+    return left_row_map, left_col
+
 
+def join_probe(build, right, right_col):
+    left_row_map, left_col = build
     joined = []
     for right_row in right:
         right_key = right_row[right_col]
@@ -89,7 +394,62 @@ def join(left, right, left_col, right_col):
     return joined
 
 
+def join(left, right, left_col, right_col):
+    return join_probe(join_build(left, left_col), right, right_col)
+
+
+def sort_join_build(left, left_col):
+    """ Sorts the keys of the left input of a sort join, so that it can be probed repeatedly. """
+    # numpy is only needed for this join variant
+    import numpy as np
+    from conclave.codegen.libs.columnar import sorted_index
+
+    return left, left_col, sorted_index(np.array([row[left_col] for row in left]))
+
+
+def sort_join_probe(build, right, right_col):
+    import numpy as np
+    from conclave.codegen.libs.columnar import probe_sorted_index
+
+    left, left_col, index = build
+    if not left or not right:
+        return []
+    left_idx, right_idx = probe_sorted_index(index, np.array([row[right_col] for row in right]))
+    left_rest = [idx for idx in range(len(left[0])) if idx != left_col]
+    right_rest = [idx for idx in range(len(right[0])) if idx != right_col]
+
+    joined = []
+    for left_pos, right_pos in zip(left_idx.tolist(), right_idx.tolist()):
+        left_row = left[left_pos]
+        right_row = right[right_pos]
+        joined.append([right_row[right_col]] + [left_row[idx] for idx in left_rest]
+                      + [right_row[idx] for idx in right_rest])
+    return joined
+
+
+def sort_join(left, right, left_col, right_col):
+    return sort_join_probe(sort_join_build(left, left_col), right, right_col)
+
+
 def index_agg(rel, over_col, distinct_keys, indeces, aggregator):
+    """
+    Aggregates the over_col values of the rows listed in indeces, a relation of (row index, key index)
+    pairs, per distinct key. aggregator is either 'sum' or 'count', which are computed vectorized, or
+    a function combining a running aggregate (starting at 0) with the next value.
+    """
+    if not callable(aggregator):
+        # numpy is only needed for the vectorized aggregators
+        import numpy as np
+        from conclave.codegen.libs.columnar import scatter_agg
+
+        if not distinct_keys:
+            return []
+        row_idx = np.array([idx[0] for idx in indeces], dtype=np.intp)
+        key_idx = np.array([idx[1] for idx in indeces], dtype=np.intp)
+        values = np.array([row[over_col] for row in rel]) if rel else np.empty(0, dtype=np.int64)
+        res = scatter_agg(values, row_idx, key_idx, len(distinct_keys), aggregator)
+        return [[key[0], value] for key, value in zip(distinct_keys, res.tolist())]
+
     empty = 0
     res = [[key[0], empty] for key in distinct_keys]
     for row_idx, key_idx in indeces:
@@ -97,29 +457,98 @@ def index_agg(rel, over_col, distinct_keys, indeces, aggregator):
     return res
 
 
-def sort_by(rel, sort_by_col):
-    return sorted(rel, key=lambda row: row[sort_by_col])
+def _write_run(rows: list, tmp_dir: str):
+    """ Writes an already sorted run to a temporary file and returns its path. """
+    fd, path = tempfile.mkstemp(suffix=".run", dir=tmp_dir)
+    with os.fdopen(fd, "wb") as f:
+        for start in range(0, len(rows), RUN_BATCH_SIZE):
+            pickle.dump(rows[start:start + RUN_BATCH_SIZE], f, pickle.HIGHEST_PROTOCOL)
+    return path
+
+
+def _read_run(path: str):
+    with open(path, "rb") as f:
+        while True:
+            try:
+                batch = pickle.load(f)
+            except EOFError:
+                return
+            yield from batch
+
+
+def external_sort(rows, key, budget: int = SORT_BUDGET, tmp_dir: str = None):
+    """
+    Stable sort of an iterable of rows that holds at most budget rows in memory at once.
+
+    Inputs larger than the budget are cut into sorted runs which are spilled to tmp_dir
+    and merged k-way. Yields the rows in sorted order.
+
+    >>> list(external_sort(iter([[3, 0], [1, 1], [2, 2], [1, 3], [0, 4]]), lambda row: row[0], budget=2))
+    [[0, 4], [1, 1], [1, 3], [2, 2], [3, 0]]
+    """
+    rows = iter(rows)
+    run_paths = []
+    try:
+        while True:
+            run = list(itertools.islice(rows, budget))
+            run.sort(key=key)
+            if len(run) < budget and not run_paths:
+                # everything fit in memory
+                yield from run
+                return
+            if run:
+                run_paths.append(_write_run(run, tmp_dir))
+            if len(run) < budget:
+                break
+            run = None
+        # heapq.merge prefers earlier runs on ties, which keeps the sort stable
+        yield from heapq.merge(*[_read_run(path) for path in run_paths], key=key)
+    finally:
+        for path in run_paths:
+            os.remove(path)
+
+
+def sort_rows(rows, key, budget: int = SORT_BUDGET, tmp_dir: str = None):
+    """
+    Sorts rows by key. A list is already held in memory, so it is sorted there: spilling runs of
+    it would only add the merged copy to the rows held. Any other iterable, e.g. rows read lazily
+    from disk, is sorted with external_sort and the sorted rows are yielded to the consumer.
+
+    >>> sort_rows([[2], [1]], lambda row: row[0])
+    [[1], [2]]
+    >>> list(sort_rows(iter([[2], [1]]), lambda row: row[0], budget=1))
+    [[1], [2]]
+    """
+    if isinstance(rows, list):
+        return sorted(rows, key=key)
+    return external_sort(rows, key, budget, tmp_dir)
+
+
+def sort_by(rel, sort_by_col, budget: int = SORT_BUDGET, tmp_dir: str = None):
+    return sort_rows(rel, lambda row: row[sort_by_col], budget, tmp_dir)
 
 
 def comp_neighs(rel, comp_col):
-    left = [row[comp_col] for row in rel[0:-1]]
-    right = [row[comp_col] for row in rel[1:]]
-    return [[int(l == r)] for l, r in zip(left, right)]
+    keys = [row[comp_col] for row in rel]
+    return [[int(l == r)] for l, r in zip(keys, keys[1:])]
 
 
 def distinct(rel, selected_cols):
-    # TODO: general case
-    assert len(selected_cols) == 1
-    only_selected = project(rel, selected_cols)
-    unwrapped = [row[0] for row in only_selected]
-    return [[key] for key in set(unwrapped)]
+    """
+    Distinct combinations of values of the selected columns, in sorted order.
+
+    >>> distinct([[2, 1, 5], [1, 3, 5], [2, 1, 6]], [0, 1])
+    [[1, 3], [2, 1]]
+    """
+    keys = zip(*[[row[idx] for row in rel] for idx in selected_cols])
+    return [list(key) for key in sorted(set(keys))]
 
 
 def indexes_to_flags(lookup, rel_size):
-    res = [[0] for _ in range(rel_size)]
+    flags = [0] * rel_size
     for idx in lookup:
-        res[idx[0]] = [1]
-    return res
+        flags[idx[0]] = 1
+    return [[flag] for flag in flags]
 
 
 def _aggregate_count_dict(rel, group_by_idx):
@@ -136,16 +565,21 @@ def arrange_by_flags(lookups, indexes_and_flags):
     lookups_counts = _aggregate_count_dict(lookups, 0)
     projected = project_indeces(indexes_and_flags)
     # TODO this might not be safe
+    # dummies are looked up by position, so the sorted entries are held in memory
     in_order = sorted(projected, key=lambda row: (-row[2], row[1]))
-    real_entries = deque(in_order[:len(lookups_counts)])
-    dummy_entries = deque(in_order[len(lookups_counts):])
+    # the first entries are the real ones, dummies are taken from the back
+    num_real = len(lookups_counts)
+    next_dummy = len(in_order)
     res = []
-    for real_entry in real_entries:
-        res.append(real_entry)
+    for real_entry in itertools.islice(in_order, num_real):
+        res.append([real_entry[0]])
         num_dummies = lookups_counts[real_entry[1]] - 1
         for _ in range(num_dummies):
-            res.append(dummy_entries.pop())
-    return project(res, [0])
+            next_dummy -= 1
+            if next_dummy < num_real:
+                raise Exception("Not enough dummy entries")
+            res.append([in_order[next_dummy][0]])
+    return res
 
 
 def cc_filter(cond_lambda, rel):
@@ -153,141 +587,256 @@ def cc_filter(cond_lambda, rel):
 
 
 def distinct_count(rel, selected_col):
-    return [[len(distinct(rel, [selected_col]))]]
+    return [[len({row[selected_col] for row in rel})]]
 
 
-def receive_rel(sock: socket, num_cols: int):
-    num_elements_bytes = sock.recv(INT_SIZE)
-    num_elements = struct.unpack('i', num_elements_bytes)[0]
-    total_size = num_elements * INT_SIZE
-    byte_buf = bytearray(total_size)
-    view = memoryview(byte_buf)
-    while total_size:
-        received = sock.recv_into(view, total_size)
+def recv_into(sock: socket, view: memoryview):
+    """ Fills a writable byte view (e.g. of a preallocated column) with the next bytes received. """
+    size = len(view)
+    while size:
+        received = sock.recv_into(view, size)
+        if not received:
+            raise Exception("Connection closed")
         view = view[received:]
-        total_size -= received
-    element_it = struct.iter_unpack("i", byte_buf)
-
-    rel = []
-    col_idx = 0
-    row = []
-    for el in element_it:
-        row.append(el[0])
-        col_idx += 1
-        if col_idx >= num_cols:
-            rel.append(row)
-            col_idx = 0
-            row = []
-    byte_buf = None
-    return rel
+        size -= received
 
 
-def receive_set(sock: socket):
-    num_elements_bytes = sock.recv(INT_SIZE)
-    num_elements = struct.unpack('i', num_elements_bytes)[0]
-    total_size = num_elements * INT_SIZE
-    byte_buf = bytearray(total_size)
-    view = memoryview(byte_buf)
-    while total_size:
-        received = sock.recv_into(view, total_size)
-        view = view[received:]
-        total_size -= received
-    element_it = struct.iter_unpack("i", byte_buf)
+def _recv_exact(sock: socket, size: int):
+    byte_buf = bytearray(size)
+    recv_into(sock, memoryview(byte_buf))
+    return byte_buf
 
-    rel = set()
-    for el in element_it:
-        rel.add(el[0])
-    byte_buf = None
-    return rel
 
+def infer_col_type(values: list):
+    """
+    Returns the narrowest type code that represents all values exactly.
 
-def send_rel(sock: socket, rel: list):
-    num_elements = len(rel) * (len(rel[0]) if rel else 0)
-    sock.sendall(struct.pack("i", num_elements))
-    as_bytes = bytearray(num_elements * INT_SIZE)
-    idx = 0
-    for row in rel:
-        for el in row:
-            struct.pack_into("i", as_bytes, idx, el)
-            idx += INT_SIZE
-    sock.sendall(as_bytes)
-
-
-def public_join_as_server(host: str, port: int, rel: list, key_col: int):
-    import gc
-    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    server_socket.bind((host, port))
-
-    server_socket.listen(5)
-    print("server started and listening")
-    client_socket, address = server_socket.accept()
-    other_rel = receive_rel(client_socket, 1)
+    >>> infer_col_type([1, -2]), infer_col_type([1, 2 ** 40]), infer_col_type([1, 0.5])
+    ('i', 'q', 'd')
+    """
+    if any(isinstance(val, float) for val in values):
+        return "d"
+    if values and (min(values) < -2 ** 31 or max(values) >= 2 ** 31):
+        return "q"
+    return "i"
+
+
+def send_bytes(sock: socket, data: bytes):
+    """ Sends a message that is not a relation, preceded by its size. """
+    sock.sendall(PAYLOAD_SIZE.pack(len(data)) + data)
+
+
+def receive_bytes(sock: socket):
+    size, = PAYLOAD_SIZE.unpack(_recv_exact(sock, PAYLOAD_SIZE.size))
+    return _recv_exact(sock, size)
+
+
+def receive_header(sock: socket, num_cols: int = None):
+    """
+    Receives the header of a relation sent with send_cols and returns its number of rows, column
+    type codes and column encodings. If num_cols is given, a non-empty relation with a different
+    number of columns is an error.
+    """
+    num_rows, sent_cols = WIRE_HEADER.unpack(_recv_exact(sock, WIRE_HEADER.size))
+    codes = _recv_exact(sock, 2 * sent_cols).decode()
+    col_types = col_type_codes(sent_cols, codes[:sent_cols])
+    if num_cols is not None and num_rows and sent_cols != num_cols:
+        raise Exception("Expected {} columns, received {}".format(num_cols, sent_cols))
+    return num_rows, col_types, codes[sent_cols:]
+
+
+def receive_col(sock: socket, encoding: str, col_type: str, view: memoryview):
+    """ Receives the next column of a frame into view, a byte view of a column of the right size. """
+    if encoding == RAW_ENCODING:
+        recv_into(sock, view)
+        return
+    from conclave.codegen.libs.compression import decode_col
+
+    col = decode_col(receive_bytes(sock), encoding, col_type, len(view) // struct.calcsize(col_type))
+    view[:] = memoryview(col).cast("B")
+
+
+def _receive_cols(sock: socket, num_cols: int = None):
+    num_rows, col_types, encodings = receive_header(sock, num_cols)
+    cols = []
+    for code, encoding in zip(col_types, encodings):
+        # preallocate the column and receive straight into its buffer
+        col = array.array(code, [0]) * num_rows
+        receive_col(sock, encoding, code, memoryview(col).cast("B"))
+        if sys.byteorder != "little":
+            col.byteswap()
+        cols.append(col)
+    return num_rows, cols
+
+
+def receive_rel(sock: socket, num_cols: int):
+    _, cols = _receive_cols(sock, num_cols)
+    return [list(row) for row in zip(*cols)]
+
+
+def receive_set(sock: socket):
+    _, cols = _receive_cols(sock)
+    return set(cols[0]) if cols else set()
+
+
+def send_cols(sock: socket, num_rows: int, col_types: str, cols: list, compress: bool = False):
+    """
+    Sends the wire header followed by each column's little-endian buffer as is, so any contiguous
+    array (array.array or numpy) of the right type goes out without being copied. With compress,
+    each column is sent in the most compact encoding that makes it smaller, if any.
+    """
+    encoded = [(RAW_ENCODING, None)] * len(cols)
+    if compress:
+        from conclave.codegen.libs.compression import encode_col
+
+        encoded = [encode_col(col, code) for code, col in zip(col_types, cols)]
+    encodings = "".join([encoding for encoding, _ in encoded])
+    sock.sendall(WIRE_HEADER.pack(num_rows, len(cols)) + col_types.encode() + encodings.encode())
+    for col, (encoding, payload) in zip(cols, encoded):
+        if payload is None:
+            sock.sendall(memoryview(col).cast("B"))
+        else:
+            send_bytes(sock, payload)
+
+
+def send_rel(sock: socket, rel: list, col_types: str = None, compress: bool = False):
+    """
+    Sends relation column by column. Each column is encoded with its type code from col_types or,
+    if not given, with the narrowest type that holds its values.
+    """
+    num_cols = len(rel[0]) if rel else 0
+    cols = [[row[idx] for row in rel] for idx in range(num_cols)]
+    if col_types is None:
+        col_types = "".join([infer_col_type(col) for col in cols])
+    col_types = col_type_codes(num_cols, col_types)
+    arrays = [array.array(code, col) for code, col in zip(col_types, cols)]
+    if sys.byteorder != "little":
+        for col in arrays:
+            col.byteswap()
+    send_cols(sock, len(rel), col_types, arrays, compress)
+
+
+def chunked(rows, chunk_size: int):
+    """ Groups rows from any iterable into lists of at most chunk_size rows. """
+    rows = iter(rows)
+    while True:
+        chunk = list(itertools.islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def send_rel_chunks(sock: socket, chunks, col_types: str = None, compress: bool = False):
+    """
+    Streams relation as one frame per (non-empty) chunk, followed by an empty end frame, so the
+    receiver can start working on the first chunks while later ones are still being produced.
+    """
+    for chunk in chunks:
+        if chunk:
+            send_rel(sock, chunk, col_types, compress)
+    send_cols(sock, 0, "", [])
+
+
+def receive_rel_chunks(sock: socket, num_cols: int):
+    """ Yields the chunks of a relation sent with send_rel_chunks as they arrive. """
+    while True:
+        num_rows, cols = _receive_cols(sock, num_cols)
+        if not num_rows:
+            return
+        yield [list(row) for row in zip(*cols)]
+
+
+def _send_keys(sock: socket, rels_and_key_cols: list, chunk_size: int, compress: bool):
+    """
+    Streams the key column of each relation in turn from a background thread, so that the caller
+    can receive results while its keys are still being sent (and the other party does not block
+    sending them back).
+    """
+    def send():
+        for rel, key_col in rels_and_key_cols:
+            send_rel_chunks(sock, chunked(([row[key_col]] for row in rel), chunk_size), compress=compress)
+
+    sender = threading.Thread(target=send, daemon=True)
+    sender.start()
+    return sender
+
+
+def _index_arriving_keys(sock: socket, index: dict, owner=None):
+    """
+    Adds the rows of the key relation arriving on sock to index, a map from key to matching rows.
+    Rows are recorded by row index, or as (row index, owner) pairs if owner is given.
+    """
+    num_received = 0
+    for chunk in receive_rel_chunks(sock, 1):
+        for idx, (key,) in enumerate(chunk, num_received):
+            if key not in index:
+                index[key] = []
+            index[key].append(idx if owner is None else (idx, owner))
+        num_received += len(chunk)
+
+
+def open_connection(host: str, port: int, is_server: bool, stream: str = None):
+    """
+    Opens the connection to the other party for one op. The server side listens on host:port and
+    the client side connects to it. With a stream name, the op gets a logical stream on the run's
+    persistent channel to host:port (see channels.py) instead of a fresh socket.
+    """
+    if stream is not None:
+        return channels.open_stream(host, port, is_server, stream)
+    if is_server:
+        server_socket = channels.listen(host, port)
+        print("server started and listening")
+        sock, _ = server_socket.accept()
+        server_socket.close()
+        return sock
+    return channels.connect(host, port)
+
+
+def public_join_as_server(host: str, port: int, rel: list, key_col: int, chunk_size: int = NET_CHUNK_SIZE,
+                          compress: bool = False, stream: str = None):
+    """
+    The client's keys are hashed frame by frame as they arrive. Our rows are then probed in order and
+    the matching client row indexes stream back while probing continues.
+    """
+    sock = open_connection(host, port, True, stream)
+    other_rows = {}
+    _index_arriving_keys(sock, other_rows)
     print("done receive")
-    my_keys = project_indeces(project(rel, [key_col]))
-    print("done project")
-
-    other_keys = project_indeces(other_rel)
-    gc.collect()
-    print("start join")
-    joined = sort_by(join(my_keys, other_keys, 1, 1), 0)
-    other_keys = None
-    my_keys = None
-    print("done join")
-    other_cols = project(joined, [2])
-    print("done other project")
-    send_rel(client_socket, other_cols)
-    other_cols = None
-    print("done send")
     res_rel = []
-    for idx in joined:
-        res_rel.append(rel[idx[1]])
-    server_socket.close()
+
+    def matches():
+        for row in rel:
+            for other_idx in other_rows.get(row[key_col], ()):
+                res_rel.append(row)
+                yield [other_idx]
+
+    send_rel_chunks(sock, chunked(matches(), chunk_size), compress=compress)
+    print("done send")
+    sock.close()
     return res_rel
 
 
-def public_join_as_client(host: str, port: int, rel: list, key_col: int):
-    sock = None
-    connected = False
-    while not connected:
-        try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.connect((host, port))
-            connected = True
-        except Exception as e:
-            print(e)
-            connected = False
-            time.sleep(.042)
-    send_rel(sock, project(rel, [key_col]))
-    rel_back = receive_rel(sock, 1)
+def public_join_as_client(host: str, port: int, rel: list, key_col: int, chunk_size: int = NET_CHUNK_SIZE,
+                          compress: bool = False, stream: str = None):
+    sock = open_connection(host, port, False, stream)
+    send_rel_chunks(sock, chunked(([row[key_col]] for row in rel), chunk_size), compress=compress)
     res_rel = []
-    for idx in rel_back:
-        res_rel.append(rel[idx[0]])
+    for chunk in receive_rel_chunks(sock, 1):
+        res_rel.extend([rel[idx] for (idx,) in chunk])
     sock.close()
-    # num_cols = len(rel[0]) if rel else 0
-    # cols_to_keep = [i for i in range(num_cols) if i != key_col]
     return res_rel
-    # return project(res_rel, cols_to_keep)
 
 
 def key_union(left: list, right: list, l: int, r: int):
-    keys = set()
-    for row in left:
-        keys.add(row[l])
-    for row in right:
-        keys.add(row[r])
-    return keys
+    return to_set(left, l) | to_set(right, r)
 
 
 def key_union_as_rel(left: list, right: list, l: int, r: int):
-    return [[v] for v in key_union(left, right, l, r)]
+    return [[v] for v in sorted(key_union(left, right, l, r))]
 
 
 def to_set(rel: list, key: int):
-    keys = set()
-    for row in rel:
-        keys.add(row[key])
-    return keys
+    return {row[key] for row in rel}
 
 
 def to_rel(rel_set: set):
@@ -333,61 +882,79 @@ def reconstruct(
         me: int,
         num_left_cols: int,
         num_right_cols: int):
-    res_rel = []
-    left_dummy = [1 for _ in range(num_left_cols)]
-    right_dummy = [1 for _ in range(num_right_cols)]
-
-    for left_idx, left_own, right_idx, right_own in idx_rel:
-        left_side = left_rel[left_idx] if left_own == me else left_dummy
-        right_side = right_rel[right_idx] if right_own == me else right_dummy
-        right_key = right_side[right_col]
+    """
+    Builds the joined rows (key, left non-key cols, right non-key cols) of the index rows, with dummy
+    values for the sides owned by the other party.
 
-        from_left = [val for (idx, val) in enumerate(left_side) if idx != left_col]
-        from_right = [val for (idx, val) in enumerate(right_side) if idx != right_col]
+    >>> reconstruct([[1, 10], [2, 20]], [[2, 200]], 0, 0, [[1, 0, 0, 0], [0, 1, 0, 0], [0, 0, 3, 1]], 0, 2, 2)
+    [[2, 20, 200], [2, 1, 200], [1, 10, 1]]
+    """
+    left_dummy = [1] * (num_left_cols - 1)
+    right_dummy = [1] * (num_right_cols - 1)
 
-        joined_row = [right_key] + from_left + from_right
-        res_rel.append(joined_row)
+    res_rel = []
+    for left_idx, left_own, right_idx, right_own in idx_rel:
+        if left_own == me:
+            left_row = left_rel[left_idx]
+            from_left = left_row[:left_col] + left_row[left_col + 1:]
+        else:
+            from_left = left_dummy
+        if right_own == me:
+            right_row = right_rel[right_idx]
+            res_rel.append([right_row[right_col]] + from_left + right_row[:right_col] + right_row[right_col + 1:])
+        else:
+            res_rel.append([1] + from_left + right_dummy)
     return res_rel
 
 
 def pub_intersect_as_server(host: str,
                             port: int,
                             my_rel: list,
-                            my_key_col: int):
-    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    server_socket.bind((host, port))
+                            my_key_col: int,
+                            chunk_size: int = NET_CHUNK_SIZE,
+                            compress: bool = False,
+                            bloom_fp_rate: float = None,
+                            stream: str = None):
+    """
+    With bloom_fp_rate, we first send a Bloom filter of our keys with that false-positive rate,
+    so that the client only sends the keys that may be in the intersection.
+    """
+    sock = open_connection(host, port, True, stream)
+    my_keys = to_set(my_rel, my_key_col)
+    if bloom_fp_rate is not None:
+        from conclave.codegen.libs.bloom import BloomFilter
 
-    server_socket.listen(1)
-    print("server started and listening")
-    client_socket, address = server_socket.accept()
+        send_bytes(sock, BloomFilter.from_keys(list(my_keys), bloom_fp_rate).to_bytes())
 
-    other_keys = receive_set(client_socket)
-    my_keys = to_set(my_rel, my_key_col)
+    other_keys = set()
+    for chunk in receive_rel_chunks(sock, 1):
+        other_keys.update([row[0] for row in chunk])
     print("done receive")
     res = to_rel(my_keys & other_keys)
-    send_rel(client_socket, res)
-    server_socket.close()
+    send_rel_chunks(sock, chunked(res, chunk_size), compress=compress)
+    sock.close()
     return res
 
 
 def pub_intersect_as_client(host: str,
                             port: int,
                             my_rel: list,
-                            my_key_col: int):
-    sock = None
-    connected = False
-    while not connected:
-        try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.connect((host, port))
-            connected = True
-        except Exception as e:
-            print(e)
-            connected = False
-            time.sleep(.042)
-    send_rel(sock, project(my_rel, [my_key_col]))
-    res = receive_rel(sock, 1)
+                            my_key_col: int,
+                            chunk_size: int = NET_CHUNK_SIZE,
+                            compress: bool = False,
+                            bloom_fp_rate: float = None,
+                            stream: str = None):
+    """ bloom_fp_rate must be set if and only if it is set on the server, its value is up to the server. """
+    sock = open_connection(host, port, False, stream)
+    keys = ([row[my_key_col]] for row in my_rel)
+    if bloom_fp_rate is not None:
+        from conclave.codegen.libs.bloom import BloomFilter
+
+        bloom = BloomFilter.from_bytes(receive_bytes(sock))
+        my_keys = list(to_set(my_rel, my_key_col))
+        keys = [[key] for key, hit in zip(my_keys, bloom.contains(my_keys).tolist()) if hit]
+    send_rel_chunks(sock, chunked(keys, chunk_size), compress=compress)
+    res = [row for chunk in receive_rel_chunks(sock, 1) for row in chunk]
     sock.close()
     return res
 
@@ -400,37 +967,51 @@ def public_join_as_server_part(
         left_key_col: int,
         right_key_col: int,
         num_left_cols: int,
-        num_right_cols: int):
-    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    server_socket.bind((host, port))
+        num_right_cols: int,
+        chunk_size: int = NET_CHUNK_SIZE,
+        compress: bool = False,
+        stream: str = None):
+    """
+    Left rows of both parties are hashed (the client's as they arrive), then right rows are probed:
+    ours first, then the client's frame by frame as they arrive. Index rows stream back to the client
+    while the client is still sending right keys.
+    """
+    sock = open_connection(host, port, True, stream)
+
+    left_rows = {}
+    for idx, row in enumerate(my_left_rel):
+        key = row[left_key_col]
+        if key not in left_rows:
+            left_rows[key] = []
+        left_rows[key].append((idx, 0))
+    _index_arriving_keys(sock, left_rows, owner=1)
+    print("done receive")
 
-    server_socket.listen(1)
-    print("server started and listening")
-    client_socket, address = server_socket.accept()
+    def right_keys():
+        for idx, row in enumerate(my_right_rel):
+            yield idx, 0, row[right_key_col]
+        num_received = 0
+        for chunk in receive_rel_chunks(sock, 1):
+            for idx, (key,) in enumerate(chunk, num_received):
+                yield idx, 1, key
+            num_received += len(chunk)
 
-    other_left_keys = receive_rel(client_socket, 1)
-    other_right_keys = receive_rel(client_socket, 1)
-    print("done receive")
+    def index_rows():
+        for right_idx, right_own, key in right_keys():
+            for left_idx, left_own in left_rows.get(key, ()):
+                yield [left_idx, left_own, right_idx, right_own]
 
-    left = construct_index_rel(project(my_left_rel, [left_key_col]), other_left_keys)
-    right = construct_index_rel(project(my_right_rel, [right_key_col]), other_right_keys)
+    res_rel = []
 
-    print("done project")
+    def reconstructed(idx_chunks):
+        for idx_rel in idx_chunks:
+            res_rel.extend(reconstruct(my_left_rel, my_right_rel, left_key_col, right_key_col, idx_rel, 0,
+                                       num_left_cols, num_right_cols))
+            yield idx_rel
 
-    # gc.collect()
-    print("start join")
-    joined = sort_by(join(left, right, 2, 2), 0)
-    print("done join")
-    idx_rel = project(joined, [1, 2, 3, 4])
-    joined = None
-    # gc.collect()
-    print("done other project")
-    send_rel(client_socket, idx_rel)
+    send_rel_chunks(sock, reconstructed(chunked(index_rows(), chunk_size)), compress=compress)
     print("done send")
-    res_rel = reconstruct(my_left_rel, my_right_rel, left_key_col, right_key_col, idx_rel, 0, num_left_cols,
-                          num_right_cols)
-    server_socket.close()
+    sock.close()
     return res_rel
 
 
@@ -442,35 +1023,34 @@ def public_join_as_client_part(
         left_key_col: int,
         right_key_col: int,
         num_left_cols: int,
-        num_right_cols: int):
-    sock = None
-    connected = False
-    while not connected:
-        try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.connect((host, port))
-            connected = True
-        except Exception as e:
-            print(e)
-            connected = False
-            time.sleep(.042)
-    send_rel(sock, project(left_rel, [left_key_col]))
-    send_rel(sock, project(right_rel, [right_key_col]))
-    idx_rel = receive_rel(sock, 4)
+        num_right_cols: int,
+        chunk_size: int = NET_CHUNK_SIZE,
+        compress: bool = False,
+        stream: str = None):
+    sock = open_connection(host, port, False, stream)
+    sender = _send_keys(sock, [(left_rel, left_key_col), (right_rel, right_key_col)], chunk_size, compress)
+    res_rel = []
+    for idx_rel in receive_rel_chunks(sock, 4):
+        res_rel.extend(reconstruct(left_rel, right_rel, left_key_col, right_key_col, idx_rel, 1, num_left_cols,
+                                   num_right_cols))
+    sender.join()
     sock.close()
-    return reconstruct(left_rel, right_rel, left_key_col, right_key_col, idx_rel, 1, num_left_cols, num_right_cols)
+    return res_rel
 
 
-def pub_join(host: str, port: int, is_server: bool, rel: list, key_col: int):
+def pub_join(host: str, port: int, is_server: bool, rel: list, key_col: int, chunk_size: int = NET_CHUNK_SIZE,
+             compress: bool = False, stream: str = None):
     if is_server:
-        return public_join_as_server(host, port, rel, key_col)
+        return public_join_as_server(host, port, rel, key_col, chunk_size, compress, stream)
     else:
-        return public_join_as_client(host, port, rel, key_col)
+        return public_join_as_client(host, port, rel, key_col, chunk_size, compress, stream)
 
 
 def pub_join_part(host: str, port: int, is_server: bool, rel: list, other_rel: list, key_col: int, num_left_cols: int,
-                  num_right_cols: int):
+                  num_right_cols: int, chunk_size: int = NET_CHUNK_SIZE, compress: bool = False, stream: str = None):
     if is_server:
-        return public_join_as_server_part(host, port, rel, other_rel, key_col, key_col, num_left_cols, num_right_cols)
+        return public_join_as_server_part(host, port, rel, other_rel, key_col, key_col, num_left_cols, num_right_cols,
+                                          chunk_size, compress, stream)
     else:
-        return public_join_as_client_part(host, port, rel, other_rel, key_col, key_col, num_left_cols, num_right_cols)
+        return public_join_as_client_part(host, port, rel, other_rel, key_col, key_col, num_left_cols, num_right_cols,
+                                          chunk_size, compress, stream)
@@ -1,12 +1,48 @@
+import itertools
 import os
 
 import pystache
 
 import conclave.dag as ccdag
 from conclave.codegen import CodeGen
+from conclave.codegen.libs.python import COL_TYPE_CODES
 from conclave.job import PythonJob
 from conclave.rel import Column
 
+# runtime library module backing each Python execution engine
+ENGINE_LIBS = {
+    "list": "python",
+    "columnar": "columnar"
+}
+
+# aggregators supported by the group_by runtime function
+GROUP_BY_AGGREGATORS = {"sum", "count", "min", "max", "mean"}
+
+# row-wise operators that can process their input chunk by chunk
+STREAMABLE_OPS = (ccdag.Project, ccdag.Filter, ccdag.Multiply, ccdag.Divide)
+
+
+class Pipeline:
+    """
+    Chain of operators that is executed chunk by chunk, starting at a Create op. The chain ends in a
+    sink that keeps per-group state (an Aggregate) or, if there is no sink, its last op is written
+    out chunk by chunk.
+    """
+
+    def __init__(self, head: ccdag.Create, ops: list, sink: [ccdag.Aggregate, None]):
+        """ Initialize Pipeline object. """
+        self.head = head
+        self.ops = ops
+        self.sink = sink
+
+    def members(self):
+        """ Return all ops that are part of this pipeline. """
+        return [self.head] + self.ops + ([self.sink] if self.sink else [])
+
+    def last(self):
+        """ Return op at which code for the whole pipeline is emitted. """
+        return self.sink if self.sink else self.ops[-1]
+
 
 class PythonCodeGen(CodeGen):
     """ Codegen subclass for generating Python code. """
@@ -18,10 +54,239 @@ class PythonCodeGen(CodeGen):
         self.template_directory = template_directory
         # this belongs inside config
         self.space = space
+        # aggregations already emitted as part of a shared group-by pass
+        self.generated_aggs = set()
+        # ops of the job being generated, computed on first use
+        self.job_ops = None
+        # lookup from op to the streaming pipeline it belongs to
+        self.pipelined = {}
+        # lookup from op to the chain of row-wise ops it is fused into
+        self.fused = {}
+        # lookup from op to its stream on the data channel, and number of streams per channel
+        self.streams = {}
+        self.num_streams = {}
+        # the columnar engine evaluates arithmetic and filters as whole-column expressions
+        self.vectorized = config is not None and config.python_engine == "columnar"
+
+    def _generate(self, job_name: [str, None], output_directory: [str, None]):
+        """ Plan streaming pipelines, then generate code for DAG. """
+        if self.config.use_streaming:
+            self.pipelined = self._find_pipelines()
+        if self._fuses_row_ops():
+            self.fused = self._find_fused_chains()
+        return super(PythonCodeGen, self)._generate(job_name, output_directory)
+
+    def _find_pipelines(self):
+        """
+        Find chains of row-wise ops that start at an input and end in an aggregation or an output.
+        Each op in a chain other than the last must have exactly one child. Joins are included if
+        the chain feeds their right (probe) side, the left side is fully materialized.
+        """
+        pipelined = {}
+        for node in self.dag.top_sort():
+            if not isinstance(node, ccdag.Create) or node.skip:
+                continue
+            if self._reads_binary(node):
+                continue
+            ops = []
+            current = node
+            while len(current.children) == 1:
+                child = next(iter(current.children))
+                if child.skip:
+                    break
+                if type(child) in STREAMABLE_OPS or \
+                        (type(child) is ccdag.Join and child.right_parent is current
+                         and child.left_parent is not current):
+                    ops.append(child)
+                    current = child
+                else:
+                    break
+
+            sink = None
+            if current.children:
+                child = next(iter(current.children))
+                if len(current.children) == 1 and type(child) is ccdag.Aggregate and not child.skip \
+                        and child.aggregator in GROUP_BY_AGGREGATORS and len(self._group_by_siblings(child)) == 1:
+                    sink = child
+                else:
+                    continue
+            elif not ops or self._writes_binary(current):
+                continue
+
+            pipeline = Pipeline(node, ops, sink)
+            for member in pipeline.members():
+                pipelined[member] = pipeline
+        return pipelined
+
+    def _fuses_row_ops(self):
+        """ Vectorized ops already avoid per-row work, so only row-at-a-time code is fused. """
+        return self.config.use_op_fusion and not self.vectorized
+
+    def _is_fusable(self, node: ccdag.OpNode):
+        return type(node) in STREAMABLE_OPS and not node.skip and node not in self.pipelined
+
+    def _find_fused_chains(self):
+        """
+        Find chains of two or more row-wise ops in which every op but the last feeds only the
+        next op of the chain. Each chain is generated as a single pass over its input.
+        """
+        fused = {}
+        for node in self.dag.top_sort():
+            if not self._is_fusable(node) or node in fused:
+                continue
+            chain = [node]
+            while len(chain[-1].children) == 1 and not chain[-1].boundary_children:
+                child = next(iter(chain[-1].children))
+                if not self._is_fusable(child):
+                    break
+                chain.append(child)
+            if len(chain) > 1:
+                for op in chain:
+                    fused[op] = chain
+        return fused
+
+    def _generate_fused_chain(self, node: ccdag.OpNode):
+        """ Generate code for a fused chain once its last op is reached. """
+        chain = self.fused[node]
+        return self._generate_fused(chain) if node is chain[-1] else ""
+
+    def _generate_row_op(self, op: ccdag.OpNode):
+        """ Generate code for a single row-wise op. """
+        if isinstance(op, ccdag.Project):
+            return self._generate_project(op)
+        elif isinstance(op, ccdag.Filter):
+            return self._generate_filter(op)
+        elif isinstance(op, ccdag.Multiply):
+            return self._generate_multiply(op)
+        else:
+            return self._generate_divide(op)
+
+    def _generate_fused(self, chain: list):
+        """
+        Generate code for a chain of row-wise ops as one function that maps an input row to an
+        output row (or to None if a filter drops it), applied in a single pass over the input.
+        """
+        inner = self.space + "    "
+        cols = ["row[{}]".format(idx) for idx in range(len(chain[0].get_in_rel().columns))]
+        body = ""
+        for step, op in enumerate(chain):
+            if isinstance(op, ccdag.Project):
+                cols = [cols[col.idx] for col in op.selected_cols]
+            elif isinstance(op, ccdag.Filter):
+                body += "{}if not ({} {} {}):\n{}    return None\n".format(
+                    inner,
+                    cols[op.filter_col.idx],
+                    op.operator,
+                    op.scalar if op.is_scalar else cols[op.other_col.idx],
+                    inner
+                )
+            else:
+                operands = [cols[col.idx] if isinstance(col, Column) else str(col) for col in op.operands]
+                if isinstance(op, ccdag.Multiply):
+                    expr = " * ".join(operands)
+                elif self._is_float(op.target_col):
+                    expr = " / ".join(operands)
+                else:
+                    expr = "int({})".format(" / ".join(operands))
+                var = "v{}".format(step)
+                body += "{}{} = {}\n".format(inner, var, expr)
+                cols[op.target_col.idx] = var
+
+        fn_name = "{}_row".format(chain[-1].out_rel.name)
+        return "{}def {}(row):\n{}{}return [{}]\n{}{} = map_rows({}, {}, {})\n".format(
+            self.space,
+            fn_name,
+            body,
+            inner,
+            ", ".join(cols),
+            self.space,
+            chain[-1].out_rel.name,
+            chain[0].get_in_rel().name,
+            fn_name,
+            len(cols)
+        )
+
+    def _generate_pipeline(self, node: ccdag.OpNode):
+        """ Generate code for a whole streaming pipeline once its last op is reached. """
+        pipeline = self.pipelined[node]
+        if node is not pipeline.last():
+            return ""
+        head = pipeline.head
+        last = pipeline.ops[-1] if pipeline.ops else head
+        gen_name = "{}_pipeline".format(pipeline.last().out_rel.name)
+
+        # hash tables / sorted indexes over the build side of streamed joins
+        code = ""
+        for op in pipeline.ops:
+            if isinstance(op, ccdag.Join):
+                code += "{}{}_build = {}_build({}, {})\n".format(
+                    self.space,
+                    op.out_rel.name,
+                    "sort_join" if self.config.join_algorithm == "sort" else "join",
+                    op.get_left_in_rel().name,
+                    op.left_join_cols[0].idx
+                )
+
+        code += "{}def {}():\n".format(self.space, gen_name)
+        delimiter = self.config.delimiter if self._reads_input(head) else ","
+        code += "{}for {} in read_rel_chunks('{}', {}, delimiter={!r}{}):\n".format(
+            self.space * 2,
+            head.out_rel.name,
+            self.config.input_path + "/" + head.out_rel.name + ".csv",
+            self.config.stream_chunk_size,
+            delimiter,
+            self._col_types_arg(head.out_rel)
+        )
+        # generate op code in loop body
+        pipelined, space = self.pipelined, self.space
+        self.pipelined, self.space = {}, self.space * 3
+        for is_join, ops in itertools.groupby(pipeline.ops, lambda op: isinstance(op, ccdag.Join)):
+            ops = list(ops)
+            if is_join:
+                for op in ops:
+                    code += "{}{} = {}_probe({}_build, {}, {})\n".format(
+                        self.space,
+                        op.out_rel.name,
+                        "sort_join" if self.config.join_algorithm == "sort" else "join",
+                        op.out_rel.name,
+                        op.get_right_in_rel().name,
+                        op.right_join_cols[0].idx
+                    )
+            elif len(ops) > 1 and self._fuses_row_ops():
+                code += self._generate_fused(ops)
+            else:
+                for op in ops:
+                    code += self._generate_row_op(op)
+        code += "{}yield {}\n".format(self.space, last.out_rel.name)
+        self.pipelined, self.space = pipelined, space
+
+        if pipeline.sink:
+            sink = pipeline.sink
+            aggs = "({}, '{}')".format(sink.agg_col.idx if sink.aggregator != "count" else None, sink.aggregator)
+            return code + "{}{} = stream_group_by({}(), {}, [{}])\n".format(
+                self.space,
+                sink.out_rel.name,
+                gen_name,
+                [col.idx for col in sink.group_cols],
+                aggs
+            )
+        schema_header = ",".join(['"' + col.name + '"' for col in last.out_rel.columns])
+        return code + "{}write_rel_chunks('{}', '{}.csv', {}(), '{}')\n".format(
+            self.space,
+            self.config.output_path,
+            last.out_rel.name,
+            gen_name,
+            schema_header
+        )
 
     def _generate_outputs(self, op_code: str):
         """ Generate code to save outputs to file. """
-        leaf_nodes = [node for node in self.dag.top_sort() if node.is_leaf()]
+        # Persist ops write their outputs themselves, as do streaming pipelines without a sink,
+        # and inputs read by later jobs are left in place for them
+        leaf_nodes = [node for node in self.dag.top_sort() if node.is_leaf()
+                      and not isinstance(node, ccdag.Persist)
+                      and not (isinstance(node, ccdag.Create) and node.boundary_children)
+                      and not (node in self.pipelined and self.pipelined[node].sink is None)]
         for leaf in leaf_nodes:
             op_code += self._generate_output(leaf)
         return op_code
@@ -32,6 +297,8 @@ class PythonCodeGen(CodeGen):
         template = open("{}/top_level.tmpl"
                         .format(self.template_directory), 'r').read()
         data = {
+            'LIB': ENGINE_LIBS[self.config.python_engine],
+            'PARALLEL': self.config.workers > 1,
             'OP_CODE': op_code
         }
 
@@ -48,39 +315,104 @@ class PythonCodeGen(CodeGen):
             in_rel_str
         )
 
+    def _group_by_siblings(self, agg_op: ccdag.Aggregate):
+        """
+        Return all plain Aggregate ops (including agg_op) of this job that read the same input and group
+        by the same columns as agg_op. These can be computed together in a single group-by pass.
+        """
+        if self.job_ops is None:
+            self.job_ops = self.dag.get_all_nodes()
+        group_idxs = [col.idx for col in agg_op.group_cols]
+        siblings = [child for child in agg_op.parent.children
+                    if child in self.job_ops and type(child) is ccdag.Aggregate and not child.skip
+                    and child.aggregator in GROUP_BY_AGGREGATORS
+                    and [col.idx for col in child.group_cols] == group_idxs]
+        return sorted(siblings, key=lambda op: op.out_rel.name)
+
     def _generate_aggregate(self, agg_op: ccdag.Aggregate):
         """ Generate code for Aggregate operations. """
-        # TODO handle multi-column case
-        if agg_op.aggregator == "sum":
-            return "{}{} = aggregate({}, {}, {}, '{}')\n".format(
+        if agg_op in self.pipelined:
+            return self._generate_pipeline(agg_op)
+        if agg_op.aggregator not in GROUP_BY_AGGREGATORS:
+            raise Exception("Unknown aggregator {}".format(agg_op.aggregator))
+        if agg_op.out_rel.name in self.generated_aggs:
+            # already computed as part of a shared group-by pass
+            return ""
+        siblings = self._group_by_siblings(agg_op)
+        group_idxs = [col.idx for col in agg_op.group_cols]
+
+        if len(siblings) == 1 and len(group_idxs) == 1 and agg_op.aggregator == "sum":
+            fn_name, workers = self._parallel("aggregate")
+            return "{}{} = {}({}, {}, {}, '{}'{})\n".format(
                 self.space,
                 agg_op.out_rel.name,
+                fn_name,
                 agg_op.get_in_rel().name,
-                agg_op.group_cols[0].idx,
+                group_idxs[0],
                 agg_op.agg_col.idx,
-                agg_op.aggregator
+                agg_op.aggregator,
+                workers
             )
-        elif agg_op.aggregator == "count":
-            return "{}{} = aggregate_count({}, {})\n".format(
+        elif len(siblings) == 1 and len(group_idxs) == 1 and agg_op.aggregator == "count":
+            fn_name, workers = self._parallel("aggregate_count")
+            return "{}{} = {}({}, {}{})\n".format(
                 self.space,
                 agg_op.out_rel.name,
+                fn_name,
                 agg_op.get_in_rel().name,
-                agg_op.group_cols[0].idx
+                group_idxs[0],
+                workers
             )
-        else:
-            raise Exception("Unknown aggregator {}".format(agg_op.aggregator))
 
-    @staticmethod
-    def _col_or_scalar(col):
-        return "row[{}]".format(col.idx) if isinstance(col, Column) else str(col)
+        aggs = ", ".join(["({}, '{}')".format(
+            sibling.agg_col.idx if sibling.aggregator != "count" else None,
+            sibling.aggregator
+        ) for sibling in siblings])
+        if len(siblings) == 1:
+            return "{}{} = group_by({}, {}, [{}])\n".format(
+                self.space,
+                agg_op.out_rel.name,
+                agg_op.get_in_rel().name,
+                group_idxs,
+                aggs
+            )
+
+        # compute all sibling aggregates in one pass and split the result
+        grouped_name = "{}_grouped".format(siblings[0].out_rel.name)
+        code = "{}{} = group_by({}, {}, [{}])\n".format(
+            self.space,
+            grouped_name,
+            agg_op.get_in_rel().name,
+            group_idxs,
+            aggs
+        )
+        for agg_idx, sibling in enumerate(siblings):
+            code += "{}{} = project({}, {})\n".format(
+                self.space,
+                sibling.out_rel.name,
+                grouped_name,
+                list(range(len(group_idxs))) + [len(group_idxs) + agg_idx]
+            )
+            self.generated_aggs.add(sibling.out_rel.name)
+        return code
+
+    def _col_or_scalar(self, col):
+        if isinstance(col, Column):
+            return "{}[{}]".format("cols" if self.vectorized else "row", col.idx)
+        return str(col)
 
     def _generate_multiply(self, mult_op: ccdag.Multiply):
         """ Generate code for Multiply operations. """
+        if mult_op in self.pipelined:
+            return self._generate_pipeline(mult_op)
+        if mult_op in self.fused:
+            return self._generate_fused_chain(mult_op)
         operands = [self._col_or_scalar(col) for col in mult_op.operands]
-        lambda_expr = "lambda row : " + " * ".join([op for op in operands])
-        return "{}{} = arithmetic_project({}, {}, {})\n".format(
+        lambda_expr = "lambda {} : ".format("cols" if self.vectorized else "row") + " * ".join(operands)
+        return "{}{} = {}({}, {}, {})\n".format(
             self.space,
             mult_op.out_rel.name,
+            "arithmetic_columns" if self.vectorized else "arithmetic_project",
             mult_op.get_in_rel().name,
             mult_op.target_col.idx,
             lambda_expr
@@ -98,44 +430,123 @@ class PythonCodeGen(CodeGen):
         >>> PythonCodeGen(None, Dag({}), "")._generate_divide(div)
         'div = arithmetic_project(left, 0, lambda row : int(row[0] / 1 / row[1]))\\n'
         """
+        if div_op in self.pipelined:
+            return self._generate_pipeline(div_op)
+        if div_op in self.fused:
+            return self._generate_fused_chain(div_op)
         operands = [self._col_or_scalar(col) for col in div_op.operands]
-        lambda_expr = "lambda row : int({})".format(" / ".join([op for op in operands]))
-        return "{}{} = arithmetic_project({}, {}, {})\n".format(
+        if self._is_float(div_op.target_col):
+            # float columns keep the exact quotient
+            lambda_expr = "lambda {} : {}".format("cols" if self.vectorized else "row", " / ".join(operands))
+        elif self.vectorized:
+            lambda_expr = "lambda cols : int_div({})".format(", ".join(operands))
+        else:
+            lambda_expr = "lambda row : int({})".format(" / ".join(operands))
+        return "{}{} = {}({}, {}, {})\n".format(
             self.space,
             div_op.out_rel.name,
+            "arithmetic_columns" if self.vectorized else "arithmetic_project",
             div_op.get_in_rel().name,
             div_op.target_col.idx,
             lambda_expr
         )
 
-    def _generate_output(self, leaf: ccdag.OpNode):
-        """ Generate code for storing a single output. """
-        schema_header = ",".join(['"' + col.name + '"' for col in leaf.out_rel.columns])
+    def _is_float(self, col: Column):
+        return self.config is not None and (self.config.use_floats or col.type_str == "FLOAT")
+
+    def _col_types_arg(self, rel):
+        """ Trailing column type argument for reading or writing rel, unless all columns are 64-bit integers. """
+        codes = "".join(["d" if self._is_float(col) else COL_TYPE_CODES[col.type_str] for col in rel.columns])
+        return "" if set(codes) <= {"q"} else ", col_types={!r}".format(codes)
+
+    def _writes_binary(self, node: ccdag.OpNode):
+        """
+        Returns whether the output of node is written in binary format. Relations handed to other
+        jobs of the workflow follow the intermediate format, as long as all consumers are local
+        jobs, and workflow outputs follow the output format.
+        """
+        if node.boundary_children:
+            return self.config.intermediate_format == "binary" and node.is_local_handoff()
+        return self.config.output_format == "binary"
+
+    def _reads_binary(self, create_op: ccdag.Create):
+        """ Returns whether the relation loaded by create_op is stored in binary format. """
+        if self._reads_input(create_op):
+            return self.config.input_format == "binary"
+        return self.config.intermediate_format == "binary" and create_op.reads_local_handoff()
+
+    @staticmethod
+    def _reads_input(create_op: ccdag.Create):
+        """
+        Returns whether create_op loads a workflow input rather than the output of an earlier job. Inputs
+        also read by earlier jobs are never rewritten by them.
+        """
+        return create_op.boundary_parent is None or isinstance(create_op.boundary_parent, ccdag.Create)
+
+    def _generate_write(self, node: ccdag.OpNode):
+        """ Generate code for writing the output relation of node to file. """
+        if self._writes_binary(node):
+            return "{}write_rel_bin('{}', '{}.bin', {}, {}{})\n".format(
+                self.space,
+                self.config.output_path,
+                node.out_rel.name,
+                node.out_rel.name,
+                len(node.out_rel.columns),
+                self._col_types_arg(node.out_rel)
+            )
+        schema_header = ",".join(['"' + col.name + '"' for col in node.out_rel.columns])
         return "{}write_rel('{}', '{}.csv', {}, '{}')\n".format(
             self.space,
             self.config.output_path,
-            leaf.out_rel.name,
-            leaf.out_rel.name,
+            node.out_rel.name,
+            node.out_rel.name,
             schema_header
         )
 
+    def _generate_output(self, leaf: ccdag.OpNode):
+        """ Generate code for storing a single output. """
+        if isinstance(leaf, ccdag.SortBy) and self._streams_sort(leaf):
+            schema_header = ",".join(['"' + col.name + '"' for col in leaf.out_rel.columns])
+            return "{}write_rel_chunks('{}', '{}.csv', chunked({}, {}), '{}')\n".format(
+                self.space,
+                self.config.output_path,
+                leaf.out_rel.name,
+                leaf.out_rel.name,
+                self.config.stream_chunk_size,
+                schema_header
+            )
+        return self._generate_write(leaf)
+
     def _generate_persist(self, leaf: ccdag.Persist):
         """ Generate code for storing a single output via a Persist op. """
-        schema_header = ",".join(['"' + col.name + '"' for col in leaf.out_rel.columns])
-        return "{}write_rel('{}', '{}.csv', {}, '{}')\n".format(
+        return "{}{} = {}\n".format(
             self.space,
-            self.config.output_path,
             leaf.out_rel.name,
-            leaf.out_rel.name,
-            schema_header
-        )
+            leaf.get_in_rel().name
+        ) + self._generate_write(leaf)
 
     def _generate_create(self, create_op: ccdag.Create):
         """ Generate code for loading input data. """
-        return "{}{} = read_rel('{}')\n".format(
+        if create_op in self.pipelined:
+            return self._generate_pipeline(create_op)
+        if self._reads_binary(create_op):
+            return "{}{} = read_rel_bin('{}')\n".format(
+                self.space,
+                create_op.out_rel.name,
+                self.config.input_path + "/" + create_op.out_rel.name + ".bin"
+            )
+        # the configured delimiter applies to workflow inputs, intermediate
+        # relations are always written with commas
+        delimiter = self.config.delimiter if self._reads_input(create_op) else ","
+        streams = len(create_op.children) == 1 and isinstance(next(iter(create_op.children)), ccdag.SortBy) \
+            and self._streams_sort(next(iter(create_op.children)))
+        return "{}{} = {}('{}', delimiter={!r}{})\n".format(
             self.space,
             create_op.out_rel.name,
-            self.config.input_path + "/" + create_op.out_rel.name + ".csv"
+            "read_rel_rows" if streams else "read_rel",
+            self.config.input_path + "/" + create_op.out_rel.name + ".csv",
+            delimiter,
+            self._col_types_arg(create_op.out_rel)
         )
 
     def _generate_join_flags(self, join_flags_op: ccdag.JoinFlags):
@@ -151,17 +562,26 @@ class PythonCodeGen(CodeGen):
 
     def _generate_join(self, join_op: ccdag.Join):
         """ Generate code for Join operations. """
-        return "{}{}  = join({}, {}, {}, {})\n".format(
+        if join_op in self.pipelined:
+            return self._generate_pipeline(join_op)
+        fn_name, workers = self._parallel("sort_join" if self.config.join_algorithm == "sort" else "join")
+        return "{}{}  = {}({}, {}, {}, {}{})\n".format(
             self.space,
             join_op.out_rel.name,
+            fn_name,
             join_op.get_left_in_rel().name,
             join_op.get_right_in_rel().name,
             join_op.left_join_cols[0].idx,
-            join_op.right_join_cols[0].idx
+            join_op.right_join_cols[0].idx,
+            workers
         )
 
     def _generate_project(self, project_op: ccdag.Project):
         """ Generate code for Project operations. """
+        if project_op in self.pipelined:
+            return self._generate_pipeline(project_op)
+        if project_op in self.fused:
+            return self._generate_fused_chain(project_op)
         selected_cols = [col.idx for col in project_op.selected_cols]
         return "{}{} = project({}, {})\n".format(
             self.space,
@@ -172,14 +592,20 @@ class PythonCodeGen(CodeGen):
 
     def _generate_filter(self, filter_op: ccdag.Filter):
         """ Generate code for Filter operations. """
-        cond_lambda = "lambda row : row[{}] {} {}".format(
-            filter_op.filter_col.idx,
+        if filter_op in self.pipelined:
+            return self._generate_pipeline(filter_op)
+        if filter_op in self.fused:
+            return self._generate_fused_chain(filter_op)
+        cond_lambda = "lambda {} : {} {} {}".format(
+            "cols" if self.vectorized else "row",
+            self._col_or_scalar(filter_op.filter_col),
             filter_op.operator,
-            filter_op.scalar if filter_op.is_scalar else "row[{}]".format(filter_op.other_col.idx)
+            filter_op.scalar if filter_op.is_scalar else self._col_or_scalar(filter_op.other_col)
         )
-        return "{}{} = cc_filter({}, {})\n".format(
+        return "{}{} = {}({}, {})\n".format(
             self.space,
             filter_op.out_rel.name,
+            "mask_filter" if self.vectorized else "cc_filter",
             cond_lambda,
             filter_op.get_in_rel().name
         )
@@ -206,59 +632,124 @@ class PythonCodeGen(CodeGen):
     def _generate_pub_join(self, pub_join_op: ccdag.PubJoin):
         """ Generate code for Pub Join operations. """
         if pub_join_op.right_parent is None:
-            return "{}{} = pub_join(\"{}\", {}, {}, {}, {})\n".format(
+            return "{}{} = pub_join(\"{}\", {}, {}, {}, {}{})\n".format(
                 self.space,
                 pub_join_op.out_rel.name,
                 pub_join_op.host,
-                pub_join_op.port,
+                self._net_port(pub_join_op),
                 "True" if pub_join_op.is_server else "False",
                 pub_join_op.get_left_in_rel().name,
-                pub_join_op.key_col.idx
+                pub_join_op.key_col.idx,
+                self._net_args(pub_join_op)
             )
         else:
-            return "{}{} = pub_join_part(\"{}\", {}, {}, {}, {}, {}, {}, {})\n".format(
+            return "{}{} = pub_join_part(\"{}\", {}, {}, {}, {}, {}, {}, {}{})\n".format(
                 self.space,
                 pub_join_op.out_rel.name,
                 pub_join_op.host,
-                pub_join_op.port,
+                self._net_port(pub_join_op),
                 "True" if pub_join_op.is_server else "False",
                 pub_join_op.get_left_in_rel().name,
                 pub_join_op.get_right_in_rel().name,
                 pub_join_op.key_col.idx,
                 len(pub_join_op.get_left_in_rel().columns),
-                len(pub_join_op.get_right_in_rel().columns)
+                len(pub_join_op.get_right_in_rel().columns),
+                self._net_args(pub_join_op)
             )
 
     def _generate_pub_intersect(self, pub_intersect_op: ccdag.PubIntersect):
         """ Generate code for PubIntersect operations. """
-        return "{}{} = pub_intersect_{}(\"{}\", {}, {}, {})\n".format(
+        fp_rate = self.config.intersect_fp_rate
+        return "{}{} = pub_intersect_{}(\"{}\", {}, {}, {}{}{})\n".format(
             self.space,
             pub_intersect_op.out_rel.name,
             "as_server" if pub_intersect_op.is_server else "as_client",
             pub_intersect_op.host,
-            pub_intersect_op.port,
+            self._net_port(pub_intersect_op),
             pub_intersect_op.get_in_rel().name,
-            pub_intersect_op.col.idx
+            pub_intersect_op.col.idx,
+            self._net_args(pub_intersect_op),
+            "" if fp_rate is None else ", bloom_fp_rate={!r}".format(fp_rate)
         )
 
+    def _net_port(self, op: ccdag.OpNode):
+        return op.port if self.config.data_channel_port is None else self.config.data_channel_port
+
+    def _net_args(self, op: ccdag.OpNode):
+        """ Trailing arguments for runtime functions that exchange relations with other parties. """
+        args = ", compress=True" if self.config.use_wire_compression else ""
+        if self.config.data_channel_port is not None:
+            args += ", stream={!r}".format(self._stream_name(op))
+        return args
+
+    def _stream_name(self, op: ccdag.OpNode):
+        """
+        Name of op's stream on the data channel. The parties name their halves of an exchange
+        differently, but both run their exchanges over a channel in the same order, so a stream is
+        named by its channel and the number of streams opened on the channel before it.
+        """
+        if op not in self.streams:
+            channel = "{}:{}".format(op.host, self._net_port(op))
+            ordinal = self.num_streams.get(channel, 0)
+            self.num_streams[channel] = ordinal + 1
+            self.streams[op] = "{}#{}".format(channel, ordinal)
+        return self.streams[op]
+
+    def _parallel(self, fn_name: str):
+        """
+        Name of the runtime function to call for fn_name and trailing worker count argument. The
+        partitioned versions are used when more than one worker is configured.
+        """
+        if self.config.workers <= 1:
+            return fn_name, ""
+        # partitions are joined on sorted keys regardless of the configured join algorithm
+        fn_name = "join" if fn_name == "sort_join" else fn_name
+        return "par_{}".format(fn_name), ", {}".format(self.config.workers)
+
+    def _sort_args(self, sort_by_op: ccdag.SortBy):
+        """ Trailing memory budget arguments of sort_by, if it streams its rows. """
+        if not self._streams_sort(sort_by_op):
+            return ""
+        tmp_dir = self.config.sort_tmp_dir if self.config.sort_tmp_dir is not None else self.config.code_path
+        return ", {}, {!r}".format(self.config.sort_budget, tmp_dir)
+
+    def _streams_sort(self, sort_by_op: ccdag.SortBy):
+        """
+        Returns whether sort_by_op sorts its rows as they are read from its input and writes them
+        out as they are merged, so that the budget bounds the rows held in memory. This is the case
+        if a sort budget is configured, the input is a CSV file only read by the sort and the sort's
+        output is only written to file. All other sorts get relations already held in memory and sort
+        them there, whatever the budget.
+        """
+        if self.vectorized or self.config.sort_budget is None or sort_by_op.skip:
+            return False
+        in_op = next(iter(sort_by_op.parents))
+        return isinstance(in_op, ccdag.Create) and not in_op.skip and not self._reads_binary(in_op) \
+            and in_op.children == {sort_by_op} and not in_op.boundary_children \
+            and sort_by_op.is_leaf() and not self._writes_binary(sort_by_op)
+
     def _generate_sort_by(self, sort_by_op: ccdag.SortBy):
         """ Generate code for SortBy operations. """
-        return "{}{} = sort_by({}, {})\n".format(
+        return "{}{} = sort_by({}, {}{})\n".format(
             self.space,
             sort_by_op.out_rel.name,
             sort_by_op.get_in_rel().name,
-            sort_by_op.sort_by_col.idx
+            sort_by_op.sort_by_col.idx,
+            self._sort_args(sort_by_op)
         )
 
     def _generate_filter_by(self, filter_by_op: ccdag.FilterBy):
         """ Generate code for FilterBy operations. """
-        return "{}{} = filter_by({}, {}, {}, {})\n".format(
+        fn_name, workers = self._parallel("filter_by")
+        return "{}{} = {}({}, {}, {}, {}{})\n".format(
             self.space,
             filter_by_op.out_rel.name,
+            fn_name,
             filter_by_op.get_left_in_rel().name,
             filter_by_op.get_right_in_rel().name,
             filter_by_op.filter_col.idx,
             "True" if filter_by_op.use_not_in else "False",
+            workers
         )
 
     def _generate_indexes_to_flags(self, indexes_to_flags_op: ccdag.IndexesToFlags):
@@ -283,7 +774,7 @@ class PythonCodeGen(CodeGen):
 
     def _generate_num_rows(self, num_rows_op: ccdag.NumRows):
         """ Generate code for NumRows operations. """
-        return "{}{} = [[len({})]]\n".format(
+        return "{}{} = num_rows({})\n".format(
             self.space,
             num_rows_op.out_rel.name,
             num_rows_op.get_in_rel().name
@@ -318,8 +809,10 @@ class PythonCodeGen(CodeGen):
         )
 
     def _generate_index_aggregate(self, index_agg_op: ccdag.IndexAggregate):
-        # TODO: generalize
-        return "{}{} = index_agg({}, {}, {}, {}, lambda x, y: x {} y)\n".format(
+        """ Generate code for IndexAggregate operations. """
+        if index_agg_op.aggregator not in {"sum", "count"}:
+            raise Exception("Unknown aggregator {}".format(index_agg_op.aggregator))
+        return "{}{} = index_agg({}, {}, {}, {}, '{}')\n".format(
             self.space,
             index_agg_op.out_rel.name,
             index_agg_op.get_in_rel().name,
@@ -275,6 +275,9 @@ class SharemindCodeGen(CodeGen):
     def _generate_aggregate(self, agg_op: Aggregate):
         """ Generate code for Aggregate operations. """
 
+        if agg_op.aggregator in {"min", "max"}:
+            raise Exception("Aggregator {} not supported by the Sharemind backend".format(agg_op.aggregator))
+
         template = open(
             "{0}/aggregate_sum.tmpl".format(self.template_directory), 'r').read()
 
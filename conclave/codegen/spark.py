@@ -121,11 +121,11 @@ class SparkCodeGen(CodeGen):
     def _generate_aggregate(self, agg_op: saldag.Aggregate):
         """ Generate code for Aggregate operations. """
 
-        if agg_op.aggregator == '+':
-            aggregator = 'sum'
-        else:
-            # e.g. - 'max', 'min', 'avg', 'count', 'sum'
-            aggregator = agg_op.aggregator
+        # pyspark names its aggregate functions, and the columns they output, slightly differently
+        spark_aggregators = {'+': 'sum', 'sum': 'sum', 'min': 'min', 'max': 'max', 'mean': 'avg'}
+        if agg_op.aggregator not in spark_aggregators:
+            raise Exception("Aggregator {} not supported by the Spark backend".format(agg_op.aggregator))
+        aggregator = spark_aggregators[agg_op.aggregator]
 
         store_code = self._generate_store(agg_op)
 
@@ -7,6 +7,7 @@ import warnings
 import conclave.config as cc_conf
 import conclave.dag as ccdag
 import conclave.lang as cc
+import conclave.placement as placement
 import conclave.utils as utils
 from conclave.utils import defCol
 
@@ -365,7 +366,8 @@ class MPCPushDown(DagRewriter):
         parent = next(iter(node.parents))
         if parent.is_mpc:
             if isinstance(parent, ccdag.Concat) and parent.is_boundary():
-                if node.aggregator != "mean" and node.aggregator != "std_dev":
+                # only sums and counts split into local pre-aggregates summed under MPC
+                if node.aggregator in {"sum", "count"}:
                     split_agg(node)
                     push_op_node_down(parent, node)
                     parent.update_out_rel_cols()
@@ -581,7 +583,7 @@ class TrustSetPropDown(DagRewriter):
         in_group_cols_ts = utils.trust_set_from_columns(in_group_cols)
         for i in range(len(out_group_cols)):
             out_group_cols[i].trust_set = copy.copy(in_group_cols_ts)
-        if node.aggregator == "sum" or node.aggregator == "mean" or node.aggregator == "std_dev":
+        if node.aggregator in {"sum", "mean", "std_dev", "min", "max"}:
             in_agg_col_ts = copy.copy(node.agg_col.trust_set)
         elif node.aggregator == "count":
             # in case of a count, result over col has same trust set as group by cols
@@ -813,8 +815,8 @@ class HybridOperatorOpt(DagRewriter):
             trust_set = out_rel.columns[group_col_idx].trust_set
             if trust_set:
                 # hybrid agg possible
-                # oversimplifying here. what if there are multiple STPs?
-                STP = sorted(trust_set)[0]
+                # of several possible STPs, pick the one the other parties reach the fastest
+                STP = placement.pick_party(self.conclave_config, trust_set)
                 hybrid_agg_op = ccdag.HybridAggregate.from_aggregate(node, STP)
                 parents = hybrid_agg_op.parents
                 for par in parents:
@@ -855,8 +857,8 @@ class HybridOperatorOpt(DagRewriter):
                             par.skip = True
                 else:
                     # hybrid join possible
-                    # oversimplifying here. what if there are multiple STPs?
-                    STP = sorted(trust_set)[0]
+                    # of several possible STPs, pick the one the other parties reach the fastest
+                    STP = placement.pick_party(self.conclave_config, trust_set)
                     hybrid_join_op = ccdag.HybridJoin.from_join(node, STP)
                     parents = hybrid_join_op.parents
                     for par in parents:
@@ -1321,13 +1323,15 @@ class ExpandCompositeOps(DagRewriter):
         else:
             raise Exception("Not supported for now")
 
-        op_host = self.conclave_config.network_config["parties"][1]["host"]
-        op_port = self.conclave_config.network_config["parties"][1]["port"]
+        # the client sends its keys to the server, so the server is the party that the other reaches the fastest
+        server = placement.pick_party(self.conclave_config, {1, 2}, [1, 2])
+        op_host = self.conclave_config.network_config["parties"][server]["host"]
+        op_port = self.conclave_config.network_config["parties"][server]["port"]
 
         left_join = \
-            cc._pub_join(left_one, "left_join" + suffix, node.left_join_cols[0].name,
+            cc._pub_join(left_one, "left_join" + suffix, node.left_join_cols[0].name, is_server=server == 1,
                          other_op_node=right_one, host=op_host, port=op_port)
-        right_join = cc._pub_join(left_two, "right_join" + suffix, node.left_join_cols[0].name, is_server=False,
+        right_join = cc._pub_join(left_two, "right_join" + suffix, node.left_join_cols[0].name, is_server=server == 2,
                                   other_op_node=right_two, host=op_host, port=op_port)
 
         node.left_parent.children.remove(node)
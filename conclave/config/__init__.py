@@ -6,13 +6,15 @@ import tempfile
 class NetworkConfig:
     """ Config object for network module. """
 
-    def __init__(self, parties: list, pid: int = 1):
+    def __init__(self, parties: list, pid: int = 1, probe_links: bool = False):
         self.inited = True
         self.pid = pid
         # List of HDFS master nodes. Mapping between party running the computation
         # and their own master node / port is indicated in network_config['parties'],
         # where the PID corresponds to each tuple.
         self.parties = parties
+        # measure the links between parties once connected, to place parties with special roles by
+        self.probe_links = probe_links
 
     def set_network_config(self):
         """ Return network configuration dict. """
@@ -20,7 +22,7 @@ class NetworkConfig:
         network_config = dict()
         network_config['pid'] = self.pid
         network_config["parties"] = {}
-        network_config = {'pid': self.pid, "parties": {}}
+        network_config = {'pid': self.pid, "parties": {}, "probe_links": self.probe_links}
         for i in range(len(self.parties)):
             network_config["parties"][i + 1] = {}
             network_config["parties"][i + 1]["host"] = self.parties[i]["host"]
@@ -94,6 +96,43 @@ class CodeGenConfig:
             self.name = os.path.basename(self.code_path)
         self.use_leaky_ops = False
         self.data_backend = "local"
+        # execution engine for generated Python jobs ("list" or "columnar")
+        self.python_engine = "list"
+        # join algorithm for generated Python jobs ("hash" or "sort")
+        self.join_algorithm = "hash"
+        # on-disk format of relations handed between local jobs ("csv" or "binary")
+        self.intermediate_format = "csv"
+        # on-disk format of workflow inputs and outputs ("csv" or "binary"), binary is meant
+        # for relations exchanged with other Conclave workflows rather than read by people
+        self.input_format = "csv"
+        self.output_format = "csv"
+        # stream row-wise op chains in chunks of stream_chunk_size rows
+        self.use_streaming = False
+        self.stream_chunk_size = 65536
+        # maximum number of rows a generated Python job holds when sorting a CSV input straight
+        # into an output file, larger inputs are sorted in runs spilled to sort_tmp_dir (None
+        # means such sorts run in memory, as all other sorts do)
+        self.sort_budget = None
+        self.sort_tmp_dir = None
+        # fuse chains of row-wise ops in generated Python jobs into a single pass
+        self.use_op_fusion = False
+        # number of worker processes for partitioned aggregations, joins and filters
+        self.workers = 1
+        # send keys and indexes of public joins and intersections in compact encodings, which
+        # trades CPU time for bandwidth between parties
+        self.use_wire_compression = False
+        # false-positive rate of the Bloom filter that public intersections prefilter the client's
+        # keys with (None sends all of the client's keys)
+        self.intersect_fp_rate = None
+        # port of the persistent channel that public ops share, each as a stream named after the op
+        # (None opens a fresh connection on the op's own port for every op)
+        self.data_channel_port = None
+        # run generated Python jobs inside the dispatching interpreter rather than in a new one,
+        # as a long-running daemon does to keep its libraries loaded across runs
+        self.python_in_process = False
+        # measured links between parties that roles such as STPs and public join servers are placed
+        # by (see placement.py), None picks the lowest pid
+        self.link_matrix = None
         self.use_swift = False
         self.input_path = '/tmp'
         self.output_path = '/tmp'
@@ -150,6 +189,173 @@ class CodeGenConfig:
 
         return self
 
+    def with_python_engine(self, engine: str):
+        """ Set execution engine for generated Python jobs (default is 'list'). """
+
+        if not self.inited:
+            self.__init__()
+
+        if engine not in {"list", "columnar"}:
+            raise Exception("Unknown Python engine {}".format(engine))
+        self.python_engine = engine
+
+        return self
+
+    def with_join_algorithm(self, algorithm: str):
+        """ Set join algorithm for generated Python jobs (default is 'hash'). """
+
+        if not self.inited:
+            self.__init__()
+
+        if algorithm not in {"hash", "sort"}:
+            raise Exception("Unknown join algorithm {}".format(algorithm))
+        self.join_algorithm = algorithm
+
+        return self
+
+    def with_intermediate_format(self, fmt: str):
+        """ Set on-disk format of relations passed between local jobs (default is 'csv'). """
+
+        if not self.inited:
+            self.__init__()
+
+        if fmt not in {"csv", "binary"}:
+            raise Exception("Unknown intermediate format {}".format(fmt))
+        self.intermediate_format = fmt
+
+        return self
+
+    def with_input_format(self, fmt: str):
+        """ Set on-disk format of workflow inputs read by generated Python jobs (default is 'csv'). """
+
+        if not self.inited:
+            self.__init__()
+
+        if fmt not in {"csv", "binary"}:
+            raise Exception("Unknown input format {}".format(fmt))
+        self.input_format = fmt
+
+        return self
+
+    def with_output_format(self, fmt: str):
+        """ Set on-disk format of workflow outputs written by generated Python jobs (default is 'csv'). """
+
+        if not self.inited:
+            self.__init__()
+
+        if fmt not in {"csv", "binary"}:
+            raise Exception("Unknown output format {}".format(fmt))
+        self.output_format = fmt
+
+        return self
+
+    def with_streaming(self, chunk_size: int = 65536):
+        """ Enable chunked streaming execution of generated Python jobs. """
+
+        if not self.inited:
+            self.__init__()
+
+        self.use_streaming = True
+        self.stream_chunk_size = chunk_size
+
+        return self
+
+    def with_sort_budget(self, budget: int, tmp_dir: [str, None] = None):
+        """
+        Set maximum number of rows held when sorting a CSV input straight into an output file, spilling
+        runs to tmp_dir (default is code_path). Sorts of relations already held in memory are unaffected.
+        """
+
+        if not self.inited:
+            self.__init__()
+
+        if budget < 1:
+            raise Exception("Invalid sort budget {}".format(budget))
+        self.sort_budget = budget
+        self.sort_tmp_dir = tmp_dir
+
+        return self
+
+    def with_op_fusion(self, use_op_fusion: bool):
+        """ Enable or disable fusion of row-wise op chains in generated Python jobs (default is disabled). """
+
+        if not self.inited:
+            self.__init__()
+
+        self.use_op_fusion = use_op_fusion
+
+        return self
+
+    def with_workers(self, workers: int):
+        """ Set number of worker processes for generated Python jobs (default is 1, i.e. serial). """
+
+        if not self.inited:
+            self.__init__()
+
+        if workers < 1:
+            raise Exception("Invalid number of workers {}".format(workers))
+        self.workers = workers
+
+        return self
+
+    def with_wire_compression(self, compress: bool = True):
+        """ Compress relations exchanged by public joins and intersections of generated Python jobs. """
+
+        if not self.inited:
+            self.__init__()
+
+        self.use_wire_compression = compress
+
+        return self
+
+    def with_bloom_intersect(self, fp_rate: float = 0.01):
+        """
+        Make public intersections of generated Python jobs send a Bloom filter of the server's keys
+        first, so the client only sends keys that pass it.
+        """
+
+        if not self.inited:
+            self.__init__()
+
+        if not 0 < fp_rate < 1:
+            raise Exception("Invalid false-positive rate {}".format(fp_rate))
+        self.intersect_fp_rate = fp_rate
+
+        return self
+
+    def with_data_channel(self, port: int):
+        """
+        Make public ops of generated Python jobs exchange data over one persistent connection per
+        party pair on port, instead of a connection per op on the op's own port.
+        """
+
+        if not self.inited:
+            self.__init__()
+
+        self.data_channel_port = port
+
+        return self
+
+    def with_in_process_python(self, in_process: bool = True):
+        """ Run generated Python jobs in the dispatching interpreter instead of a subprocess. """
+
+        if not self.inited:
+            self.__init__()
+
+        self.python_in_process = in_process
+
+        return self
+
+    def with_link_matrix(self, link_matrix):
+        """ Place STPs and public join servers by the link measurements in link_matrix (a placement.LinkMatrix). """
+
+        if not self.inited:
+            self.__init__()
+
+        self.link_matrix = link_matrix
+
+        return self
+
     def with_sharemind_config(self, cfg: SharemindCodeGenConfig):
         """ Add SharemindCodeGenConfig object to this object. """
 
@@ -0,0 +1,234 @@
+"""
+Long-running Conclave peer for repeated workflow runs.
+
+A daemon connects to the daemons of the other parties once and then runs the workflows submitted
+to it over a local Unix socket, one at a time. Every run reuses the same peer connections and
+interpreter, and generated Python jobs run inside the daemon, so their libraries are imported once.
+
+Each party starts a daemon with its workflow configuration (the dict workflow.setup expects, as JSON):
+
+    python -m conclave.daemon serve conf.json
+
+and then submits the same workflow to its own daemon for every run:
+
+    python -m conclave.daemon submit conf.json workload.py --mpc sharemind --local python
+
+Submissions must be for the party and party mesh the daemon was started with. Roles such as STPs
+are placed by link measurements, which the daemons take when they connect if the configuration's
+"net" section sets "probe_links", and again on demand, e.g. when network conditions changed:
+
+    python -m conclave.daemon probe conf.json
+
+Submissions run arbitrary code, so only the user running a daemon may submit to it: its socket is
+kept in a directory only that user can access, and connections of other users are refused.
+"""
+import argparse
+import asyncio
+import json
+import os
+import runpy
+import socket
+import stat
+import struct
+import tempfile
+import time
+
+from conclave import generate_and_dispatch
+from conclave import workflow
+from conclave.net import PROBE_TIMEOUT, coroutine, setup_peer
+
+# pid, uid and gid of the process on the other end of a Unix socket
+PEER_CREDENTIALS = struct.Struct("3i")
+
+
+def socket_dir():
+    """ Directory of the current user's daemon sockets, which only that user can access. """
+
+    path = os.path.join(tempfile.gettempdir(), "conclave-{}".format(os.getuid()))
+    try:
+        os.mkdir(path, 0o700)
+    except FileExistsError:
+        pass
+    info = os.lstat(path)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o077:
+        raise Exception("{} must be a directory that only the current user can access".format(path))
+    return path
+
+
+def default_socket_path(pid: int):
+    """ Default path of the socket of party pid's daemon. """
+
+    return os.path.join(socket_dir(), "party-{}.sock".format(pid))
+
+
+def _peer_uid(sock: socket.socket):
+    """ User id of the process connected to sock, None if the platform does not tell. """
+
+    if not hasattr(socket, "SO_PEERCRED"):
+        return None
+    credentials = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, PEER_CREDENTIALS.size)
+    _, uid, _ = PEER_CREDENTIALS.unpack(credentials)
+    return uid
+
+
+class ConclaveDaemon:
+    """ Runs submitted workflows of one party with a peer that stays connected across runs. """
+
+    def __init__(self, conf: dict, socket_path: [str, None] = None):
+
+        self.conclave_config = workflow.setup(conf)
+        self.pid = self.conclave_config.pid
+        self.network_config = self.conclave_config.network_config
+        self.socket_path = socket_path or default_socket_path(self.pid)
+        # only processes of this user may submit workflows
+        self.uid = os.getuid()
+        self.peer = None
+        # a single party has no one to connect to
+        if len(self.conclave_config.all_pids) > 1:
+            self.peer = setup_peer(self.network_config)
+        # submissions run one at a time, in the order they arrived
+        self.loop = self.peer.loop if self.peer is not None else asyncio.get_event_loop()
+        self.requests = asyncio.Queue()
+
+    def run(self, request: dict):
+        """ Runs one submitted workflow. Returns the response to send back to the submitter. """
+
+        conclave_config = workflow.setup(request["conf"]).with_in_process_python()
+        if conclave_config.pid != self.pid or conclave_config.network_config != self.network_config:
+            return {"ok": False, "error": "Workflow is for a different party or party mesh than this daemon"}
+
+        start_time = time.time()
+        try:
+            protocol = runpy.run_path(request["protocol_path"])[request.get("protocol_name", "protocol")]
+            generate_and_dispatch(
+                protocol, conclave_config, [request["mpc_framework"]], [request["local_framework"]],
+                apply_optimizations=request.get("apply_optimizations", False), networked_peer=self.peer
+            )
+        except Exception as e:
+            return {"ok": False, "error": str(e)}
+        elapsed_time = time.time() - start_time
+        print("TIMED", conclave_config.name, round(elapsed_time, 3))
+
+        return {"ok": True, "elapsed": elapsed_time}
+
+    def probe(self, timeout: float = PROBE_TIMEOUT):
+        """
+        Measures the links between parties again, later runs are placed by the new measurements.
+        If the other daemons do not probe within timeout seconds, the earlier measurements are kept.
+        """
+
+        if self.peer is None:
+            return {"ok": True, "links": []}
+        link_matrix = self.peer.probe_links(timeout)
+        return {"ok": True, "links": link_matrix.to_list() if link_matrix is not None else []}
+
+    @coroutine
+    def _queue_request(self, reader, writer):
+
+        line = yield from reader.readline()
+        uid = _peer_uid(writer.get_extra_info("socket"))
+        if uid is not None and uid != self.uid:
+            print("refusing submission of user {}".format(uid))
+            writer.write(_encode({"ok": False, "error": "Daemon only accepts submissions of its own user"}))
+            writer.close()
+            return
+        yield from self.requests.put((json.loads(line.decode()), writer))
+
+    def _respond(self, writer, response: dict):
+
+        writer.write(_encode(response))
+        self.loop.run_until_complete(writer.drain())
+        writer.close()
+
+    def serve(self):
+        """
+        Accepts submissions until one asks the daemon to stop. Submissions are accepted on the
+        peer's event loop, so that the peer keeps handling messages of the other daemons (such as
+        their link probes) while this one is idle.
+        """
+
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        # the socket is only accessible to us before it accepts connections
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(self.socket_path)
+        os.chmod(self.socket_path, 0o600)
+        server = self.loop.run_until_complete(asyncio.start_unix_server(self._queue_request, sock=sock))
+        print("daemon for party {} listening on {}".format(self.pid, self.socket_path))
+
+        try:
+            while True:
+                # workflows run the loop themselves, so they are run outside of it, one at a time
+                request, writer = self.loop.run_until_complete(self.requests.get())
+                if request.get("stop"):
+                    self._respond(writer, {"ok": True})
+                    return
+                if request.get("probe"):
+                    self._respond(writer, self.probe())
+                    continue
+                self._respond(writer, self.run(request))
+        finally:
+            server.close()
+            self.loop.run_until_complete(server.wait_closed())
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+
+
+def _encode(msg: dict):
+    return (json.dumps(msg) + "\n").encode()
+
+
+def submit(request: dict, socket_path: str):
+    """ Sends a request to the daemon listening on socket_path and returns its response. """
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        sock.sendall(_encode(request))
+        return json.loads(sock.makefile("r").readline())
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("command", choices=["serve", "submit", "probe", "stop"])
+    parser.add_argument("conf", type=str, help="workflow configuration (JSON)")
+    parser.add_argument("protocol_path", type=str, nargs="?",
+                        help="file defining the workflow's protocol function (submit only)")
+    parser.add_argument("--protocol_name", type=str, default="protocol",
+                        help="name of the protocol function")
+    parser.add_argument("--mpc", type=str, default="obliv-c", help="mpc framework")
+    parser.add_argument("--local", type=str, default="python", help="local framework")
+    parser.add_argument("--optimize", action="store_true", help="apply optimization rewrite passes")
+    parser.add_argument("--socket", type=str, default=None, help="path of the daemon's socket")
+
+    args = parser.parse_args()
+
+    with open(args.conf) as f:
+        conf = json.load(f)
+    socket_path = args.socket or default_socket_path(int(conf["user_config"]["pid"]))
+
+    if args.command == "serve":
+        ConclaveDaemon(conf, socket_path).serve()
+        return
+    if args.command == "stop":
+        request = {"stop": True}
+    elif args.command == "probe":
+        request = {"probe": True}
+    else:
+        if args.protocol_path is None:
+            parser.error("submit needs the path of the protocol file")
+        request = {
+            "conf": conf,
+            "protocol_path": os.path.abspath(args.protocol_path),
+            "protocol_name": args.protocol_name,
+            "mpc_framework": args.mpc,
+            "local_framework": args.local,
+            "apply_optimizations": args.optimize
+        }
+    response = submit(request, socket_path)
+    print(response)
+    if not response["ok"]:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
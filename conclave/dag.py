@@ -51,6 +51,9 @@ class OpNode(Node):
         self.is_local = False
         self.is_mpc = False
         self.skip = False
+        # Create ops in later jobs that read this node's output,
+        # filled in by the partitioner
+        self.boundary_children = set()
 
     def is_boundary(self):
         """ Returns whether this node is at an MPC boundary. """
@@ -82,6 +85,14 @@ class OpNode(Node):
         """ All operations require MPC by default. """
         return True
 
+    def is_local_handoff(self):
+        """
+        Returns whether this node is a local op whose output is only read by
+        local ops in later jobs of the same workflow.
+        """
+        return bool(self.boundary_children) and not self.is_mpc and \
+            all(not child.is_mpc for create_op in self.boundary_children for child in create_op.children)
+
     def update_op_specific_cols(self):
         """ Overridden in subclasses. """
         return
@@ -256,6 +267,16 @@ class Create(UnaryOpNode):
         super(Create, self).__init__("create", out_rel, None)
         # Input can be done by parties locally
         self.is_local = True
+        # node in an earlier job that produces this input, None
+        # for workflow inputs
+        self.boundary_parent = None
+
+    def reads_local_handoff(self):
+        """
+        Returns whether this input is produced by a local op in an earlier job and
+        only read by local ops, i.e., whether it never leaves the local backend.
+        """
+        return self.boundary_parent is not None and self.boundary_parent.is_local_handoff()
 
     def requires_mpc(self):
         """ Create operations are always done locally and will never require MPC. """
@@ -415,7 +436,7 @@ class Aggregate(UnaryOpNode):
     def __init__(self, out_rel: rel.Relation, parent: OpNode,
                  group_cols: list, agg_col: [rel.Column, None], aggregator: str):
         """ Initialize Aggregate object. """
-        if aggregator not in {"sum", "count", "mean", "std_dev"}:
+        if aggregator not in {"sum", "count", "mean", "std_dev", "min", "max"}:
             raise Exception("Unsupported aggregator {}".format(aggregator))
         super(Aggregate, self).__init__("aggregation", out_rel, parent)
         self.group_cols = group_cols
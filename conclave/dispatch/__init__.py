@@ -24,7 +24,7 @@ def dispatch_all(conclave_config, networked_peer, job_queue: list):
             spark.SparkDispatcher(
                 conclave_config.system_configs["spark"].spark_master_url)
             if "spark" in conclave_config.system_configs else None,
-        conclave.job.PythonJob: python.PythonDispatcher(),
+        conclave.job.PythonJob: python.PythonDispatcher(conclave_config.python_in_process),
         conclave.job.OblivCJob: oblivc.OblivCDispatcher(
             networked_peer, conclave_config) if networked_peer else None,
         conclave.job.SinglePartyJob: single_party.SinglePartyDispatcher(networked_peer) if networked_peer else None,
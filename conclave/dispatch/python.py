@@ -1,9 +1,17 @@
+import runpy
 from subprocess import call
 
+from conclave.codegen.libs import channels
+
 
 class PythonDispatcher:
     """ Dispatches Python jobs. """
 
+    def __init__(self, in_process: bool = False):
+
+        # running jobs in this interpreter skips interpreter startup and library imports
+        self.in_process = in_process
+
     def dispatch(self, job):
 
         cmd = "{}/workflow.py".format(job.code_dir)
@@ -12,6 +20,14 @@ class PythonDispatcher:
               .format(job.name, job.code_dir))
 
         try:
-            call(["python", cmd])
+            if self.in_process:
+                try:
+                    runpy.run_path(cmd, run_name="__main__")
+                finally:
+                    # a job process closes its data channels when it exits, a job run in process
+                    # closes them when it returns, so that the next run starts with fresh ones
+                    channels.close_all()
+            else:
+                call(["python", cmd])
         except Exception as e:
             print(e)
@@ -1,14 +1,65 @@
 import asyncio
 import functools
-import pickle
+import io
+import itertools
+import struct
+import time
+import types
+
+from conclave.net.framing import FrameParser, pack_frame
+from conclave.placement import LinkMatrix
+
+# asyncio.async was renamed in Python 3.4.4 and is a syntax error from 3.7 on, asyncio.coroutine
+# was removed in 3.11
+ensure_future = getattr(asyncio, "ensure_future", None) or getattr(asyncio, "async")
+coroutine = getattr(asyncio, "coroutine", types.coroutine)
+
+# pid of the sending peer, in front of every message payload
+PID = struct.Struct("<q")
+# length of the relation name, in front of the name and data of relation chunks
+REL_NAME_SIZE = struct.Struct("<H")
+# number of bytes granted, in front of the relation name of credit messages
+CREDIT = struct.Struct("<q")
+# relations are streamed in chunks of this many bytes, and a receiver lets at most
+# REL_WINDOW bytes be in flight that it has not written out yet
+REL_CHUNK_SIZE = 2 ** 18
+REL_WINDOW = 2 ** 22
+# probe id and whether the probe is a reply, in front of the probe's padding
+PROBE = struct.Struct("<qB")
+# probing round, in front of the links of link stats messages
+PROBE_ROUND = struct.Struct("<q")
+# other pid, round-trip time and bandwidth of a link
+LINK = struct.Struct("<qdd")
+# number of the agreement, in front of the links of link matrix messages
+AGREEMENT = struct.Struct("<q")
+# sending pid, receiving pid, round-trip time and bandwidth of a link
+MATRIX_LINK = struct.Struct("<qqdd")
+# round-trip times are the best of PROBE_ROUNDS empty probes, bandwidths are measured with a
+# probe of PROBE_SIZE bytes
+PROBE_ROUNDS = 3
+PROBE_SIZE = 2 ** 20
+# lower bound on the measured transfer time of a probe, in seconds, against division by zero
+MIN_PROBE_TIME = 1e-6
+# seconds a probing round may take, including waiting for the other peers' measurements
+PROBE_TIMEOUT = 30
 
 
 class IAMMsg:
     """ Message identifying peer. """
 
+    msg_type = 1
+
     def __init__(self, pid: int):
         self.pid = pid
 
+    def encode(self):
+        return PID.pack(self.pid)
+
+    @classmethod
+    def decode(cls, payload: bytes):
+        pid, = PID.unpack(payload)
+        return cls(pid)
+
     def __str__(self):
         return "IAMMsg({})".format(self.pid)
 
@@ -16,14 +67,151 @@ class IAMMsg:
 class DoneMsg:
     """ Message signifying that peer has finished a task. """
 
+    msg_type = 2
+
     def __init__(self, pid: int, task_name: str):
         self.pid = pid
         self.task_name = task_name
 
+    def encode(self):
+        return PID.pack(self.pid) + self.task_name.encode()
+
+    @classmethod
+    def decode(cls, payload: bytes):
+        pid, = PID.unpack_from(payload)
+        return cls(pid, payload[PID.size:].decode())
+
     def __str__(self):
         return "DoneMsg({})".format(self.pid)
 
 
+class RelChunkMsg:
+    """ Chunk of a relation streamed to another peer. An empty chunk ends the relation. """
+
+    msg_type = 3
+
+    def __init__(self, pid: int, rel_name: str, data: bytes):
+        self.pid = pid
+        self.rel_name = rel_name
+        self.data = data
+
+    def encode(self):
+        name = self.rel_name.encode()
+        return PID.pack(self.pid) + REL_NAME_SIZE.pack(len(name)) + name + self.data
+
+    @classmethod
+    def decode(cls, payload: bytes):
+        pid, = PID.unpack_from(payload)
+        name_size, = REL_NAME_SIZE.unpack_from(payload, PID.size)
+        start = PID.size + REL_NAME_SIZE.size
+        return cls(pid, payload[start:start + name_size].decode(), payload[start + name_size:])
+
+    def __str__(self):
+        return "RelChunkMsg({}, {}, {} bytes)".format(self.pid, self.rel_name, len(self.data))
+
+
+class RelCreditMsg:
+    """
+    Grants the sender of a relation credit for that many more bytes. Zero credit acknowledges
+    that the relation was received in full.
+    """
+
+    msg_type = 4
+
+    def __init__(self, pid: int, rel_name: str, credit: int):
+        self.pid = pid
+        self.rel_name = rel_name
+        self.credit = credit
+
+    def encode(self):
+        return PID.pack(self.pid) + CREDIT.pack(self.credit) + self.rel_name.encode()
+
+    @classmethod
+    def decode(cls, payload: bytes):
+        pid, = PID.unpack_from(payload)
+        credit, = CREDIT.unpack_from(payload, PID.size)
+        return cls(pid, payload[PID.size + CREDIT.size:].decode(), credit)
+
+    def __str__(self):
+        return "RelCreditMsg({}, {}, {})".format(self.pid, self.rel_name, self.credit)
+
+
+class ProbeMsg:
+    """ Link probe. Peers echo probes back as replies without their padding. """
+
+    msg_type = 5
+
+    def __init__(self, pid: int, probe_id: int, is_reply: bool, padding: bytes = b""):
+        self.pid = pid
+        self.probe_id = probe_id
+        self.is_reply = is_reply
+        self.padding = padding
+
+    def encode(self):
+        return PID.pack(self.pid) + PROBE.pack(self.probe_id, self.is_reply) + self.padding
+
+    @classmethod
+    def decode(cls, payload: bytes):
+        pid, = PID.unpack_from(payload)
+        probe_id, is_reply = PROBE.unpack_from(payload, PID.size)
+        return cls(pid, probe_id, bool(is_reply), payload[PID.size + PROBE.size:])
+
+    def __str__(self):
+        return "ProbeMsg({}, {})".format(self.pid, self.probe_id)
+
+
+class LinkStatsMsg:
+    """ A peer's measurements of its links to the other peers, as (rtt, bandwidth) by other pid. """
+
+    msg_type = 6
+
+    def __init__(self, pid: int, probe_round: int, links: dict):
+        self.pid = pid
+        self.probe_round = probe_round
+        self.links = links
+
+    def encode(self):
+        return PID.pack(self.pid) + PROBE_ROUND.pack(self.probe_round) + b"".join(
+            [LINK.pack(other_pid, rtt, bandwidth) for other_pid, (rtt, bandwidth) in self.links.items()])
+
+    @classmethod
+    def decode(cls, payload: bytes):
+        pid, = PID.unpack_from(payload)
+        probe_round, = PROBE_ROUND.unpack_from(payload, PID.size)
+        links = {other_pid: (rtt, bandwidth) for other_pid, rtt, bandwidth
+                 in LINK.iter_unpack(payload[PID.size + PROBE_ROUND.size:])}
+        return cls(pid, probe_round, links)
+
+    def __str__(self):
+        return "LinkStatsMsg({}, {})".format(self.pid, self.probe_round)
+
+
+class LinkMatrixMsg:
+    """ The link matrix that all peers place parties by, sent by the peer with the lowest pid. """
+
+    msg_type = 7
+
+    def __init__(self, pid: int, agreement: int, links: list):
+        self.pid = pid
+        self.agreement = agreement
+        # [sender, receiver, rtt, bandwidth] entries, none if placement is by pid
+        self.links = links
+
+    def encode(self):
+        return PID.pack(self.pid) + AGREEMENT.pack(self.agreement) + b"".join(
+            [MATRIX_LINK.pack(*link) for link in self.links])
+
+    @classmethod
+    def decode(cls, payload: bytes):
+        pid, = PID.unpack_from(payload)
+        agreement, = AGREEMENT.unpack_from(payload, PID.size)
+        links = [list(link) for link in MATRIX_LINK.iter_unpack(payload[PID.size + AGREEMENT.size:])]
+        return cls(pid, agreement, links)
+
+    def __str__(self):
+        return "LinkMatrixMsg({}, {})".format(self.pid, self.agreement)
+
+
 class FailMsg:
     """ Message signifying that peer failed to complete a task. """
 
@@ -31,6 +219,55 @@ class FailMsg:
     pass
 
 
+# message classes by type code, messages need an encode method and a decode classmethod
+MSG_TYPES = {msg_cls.msg_type: msg_cls for msg_cls in [IAMMsg, DoneMsg, RelChunkMsg, RelCreditMsg, ProbeMsg,
+                                                       LinkStatsMsg, LinkMatrixMsg]}
+
+
+def encode_msg(msg):
+    """
+    Frames msg for sending to another peer.
+
+    >>> decode_msg(*FrameParser().feed(encode_msg(DoneMsg(2, "job.input")))[0]).task_name
+    'job.input'
+    >>> chunk = decode_msg(*FrameParser().feed(encode_msg(RelChunkMsg(1, "rel", b"1,2")))[0])
+    >>> chunk.rel_name, chunk.data
+    ('rel', b'1,2')
+    """
+    return pack_frame(msg.msg_type, msg.encode())
+
+
+def decode_msg(msg_type: int, payload: bytes):
+    if msg_type not in MSG_TYPES:
+        raise Exception("Unknown message type: " + str(msg_type))
+    return MSG_TYPES[msg_type].decode(payload)
+
+
+class _RelTransfer:
+    """ Flow control state of one relation streamed between two peers, on either side. """
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.credit = 0
+        self.waiter = None
+        # file-like object the receiving side writes arriving chunks to
+        self.out = None
+        self.done = asyncio.Future(loop=loop)
+
+    def add_credit(self, credit: int):
+        self.credit += credit
+        if self.waiter is not None and not self.waiter.done():
+            self.waiter.set_result(None)
+
+    @coroutine
+    def wait_for_credit(self, size: int):
+        # even the empty last chunk needs some credit, so nothing is sent before the receiver is ready
+        while self.credit < max(size, 1):
+            self.waiter = asyncio.Future(loop=self.loop)
+            yield from self.waiter
+        self.credit -= size
+
+
 class SalmonProtocol(asyncio.Protocol):
     """
     The Salmon network protocol defines what messages salmon
@@ -41,26 +278,36 @@ class SalmonProtocol(asyncio.Protocol):
         """ Initialize SalmonProtocol object. """
 
         self.peer = peer
-        self.buffer = b""
+        self.parser = FrameParser()
         self.transport = None
+        # set while the transport's write buffer is above its high-water mark
+        self.write_paused = None
 
     def connection_made(self, transport):
 
         self.transport = transport
 
-    def data_received(self, data):
+    def pause_writing(self):
 
-        self.buffer += data
-        self.handle_lines()
+        self.write_paused = asyncio.Future(loop=self.peer.loop)
 
-    def parse_line(self, line):
+    def resume_writing(self):
 
-        msg = None
-        try:
-            msg = pickle.loads(line)
-        except Exception as e:
-            print(e)
-        return msg
+        if self.write_paused is not None and not self.write_paused.done():
+            self.write_paused.set_result(None)
+        self.write_paused = None
+
+    @coroutine
+    def drain(self):
+        """ Waits until the transport can take more data. """
+
+        if self.write_paused is not None:
+            yield from self.write_paused
+
+    def data_received(self, data):
+
+        for msg_type, payload in self.parser.feed(data):
+            self.handle_msg(decode_msg(msg_type, payload))
 
     def _handle_iam_msg(self, iam_msg):
 
@@ -83,27 +330,69 @@ class SalmonProtocol(asyncio.Protocol):
         else:
             self.peer.msg_buffer.append(done_msg)
 
+    def _handle_rel_chunk_msg(self, chunk_msg):
+
+        transfer = self.peer.rel_receivers.get((chunk_msg.pid, chunk_msg.rel_name))
+        if transfer is None or transfer.out is None:
+            raise Exception("Unexpected relation data: " + str(chunk_msg))
+        if chunk_msg.data:
+            transfer.out.write(chunk_msg.data)
+            # the chunk is written out, so its bytes no longer count against the window
+            self.transport.write(encode_msg(RelCreditMsg(self.peer.pid, chunk_msg.rel_name, len(chunk_msg.data))))
+        else:
+            self.transport.write(encode_msg(RelCreditMsg(self.peer.pid, chunk_msg.rel_name, 0)))
+            self.peer.rel_transfer_done(self.peer.rel_receivers, chunk_msg.pid, chunk_msg.rel_name)
+
+    def _handle_rel_credit_msg(self, credit_msg):
+
+        # the receiver may grant credit before we start sending
+        transfer = self.peer.rel_transfer(self.peer.rel_senders, credit_msg.pid, credit_msg.rel_name)
+        if credit_msg.credit:
+            transfer.add_credit(credit_msg.credit)
+        else:
+            self.peer.rel_transfer_done(self.peer.rel_senders, credit_msg.pid, credit_msg.rel_name)
+
+    def _handle_probe_msg(self, probe_msg):
+
+        if probe_msg.is_reply:
+            # replies to probes of a round that timed out are no longer waited for
+            waiter = self.peer.probe_waiters.pop(probe_msg.probe_id, None)
+            if waiter is not None and not waiter.done():
+                waiter.set_result(None)
+        else:
+            self.transport.write(encode_msg(ProbeMsg(self.peer.pid, probe_msg.probe_id, True)))
+
+    def _handle_link_stats_msg(self, link_stats_msg):
+
+        self.peer.link_stats[link_stats_msg.pid] = (link_stats_msg.probe_round, link_stats_msg.links)
+        if self.peer.link_stats_waiter is not None and not self.peer.link_stats_waiter.done():
+            self.peer.link_stats_waiter.set_result(None)
+
+    def _handle_link_matrix_msg(self, link_matrix_msg):
+
+        self.peer.agreed_links[link_matrix_msg.agreement] = link_matrix_msg.links
+        if self.peer.agreement_waiter is not None and not self.peer.agreement_waiter.done():
+            self.peer.agreement_waiter.set_result(None)
+
     def handle_msg(self, msg):
 
         if isinstance(msg, IAMMsg):
             self._handle_iam_msg(msg)
         elif isinstance(msg, DoneMsg):
             self._handle_done_msg(msg)
+        elif isinstance(msg, RelChunkMsg):
+            self._handle_rel_chunk_msg(msg)
+        elif isinstance(msg, RelCreditMsg):
+            self._handle_rel_credit_msg(msg)
+        elif isinstance(msg, ProbeMsg):
+            self._handle_probe_msg(msg)
+        elif isinstance(msg, LinkStatsMsg):
+            self._handle_link_stats_msg(msg)
+        elif isinstance(msg, LinkMatrixMsg):
+            self._handle_link_matrix_msg(msg)
         else:
             raise Exception("Weird message: " + str(msg))
 
-    def handle_lines(self):
-
-        # using delimiters for now
-        # TODO: switch to sending length flags
-        while b"\n\n\n" in self.buffer:
-            line, self.buffer = self.buffer.split(b"\n\n\n", 1)
-            parsed = self.parse_line(line)
-            if parsed:
-                self.handle_msg(parsed)
-            else:
-                print("failed to parse line:", line)
-
 
 class SalmonPeer:
     """
@@ -118,6 +407,23 @@ class SalmonPeer:
         self.host = self.parties[self.pid]["host"]
         self.port = self.parties[self.pid]["port"]
         self.peer_connections = {}
+        self.peer_protocols = {}
+        # relations being streamed, by (other pid, relation name)
+        self.rel_senders = {}
+        self.rel_receivers = {}
+        # link probing state, and the latest (round, links) measured by each peer, ourselves included
+        self.probe_waiters = {}
+        self.next_probe_id = 0
+        self.probe_round = 0
+        self.link_stats = {}
+        self.link_stats_waiter = None
+        # latest round that completed and the links of all peers measured in it
+        self.complete_round = 0
+        self.complete_link_stats = None
+        # link matrices announced by the lowest pid, by number of the agreement
+        self.agreement = 0
+        self.agreed_links = {}
+        self.agreement_waiter = None
         self.dispatcher = None
         self.msg_buffer = []
         self.server = loop.create_server(
@@ -141,7 +447,7 @@ class SalmonPeer:
 
     def connect_to_others(self):
 
-        @asyncio.coroutine
+        @coroutine
         def _create_connection_retry(f, other_host, other_port):
             while True:
                 conn = None
@@ -156,9 +462,8 @@ class SalmonPeer:
         def _send_IAM(pid, conn):
 
             msg = IAMMsg(pid)
-            formatted = pickle.dumps(msg) + b"\n\n\n"
             transport, protocol = conn.result()
-            transport.write(formatted)
+            transport.write(encode_msg(msg))
 
         to_wait_on = []
         for other_pid in self.parties.keys():
@@ -169,8 +474,7 @@ class SalmonPeer:
                     other_pid, other_host, other_port))
 
                 # create connection
-                # using deprecated asyncio.async for 3.4.3 support
-                conn = asyncio.async(_create_connection_retry(
+                conn = ensure_future(_create_connection_retry(
                     lambda: SalmonProtocol(self), other_host, other_port))
 
                 self.peer_connections[other_pid] = conn
@@ -195,14 +499,13 @@ class SalmonPeer:
         for pid in self.peer_connections:
             completed_future = self.peer_connections[pid]
             # the result is a (transport, protocol) tuple
-            # we only want the transport
-            self.peer_connections[pid] = completed_future.result()[0]
+            # the protocol is only needed for flow control
+            self.peer_connections[pid], self.peer_protocols[pid] = completed_future.result()
 
     def _send_msg(self, receiver, msg):
 
-        # sends formatted message
-        formatted = pickle.dumps(msg) + b"\n\n\n"
-        self.peer_connections[receiver].write(formatted)
+        # sends framed message
+        self.peer_connections[receiver].write(encode_msg(msg))
 
     def send_done_msg(self, receiver, task_name):
 
@@ -210,10 +513,193 @@ class SalmonPeer:
         done_msg = DoneMsg(self.pid, task_name)
         self._send_msg(receiver, done_msg)
 
+    def rel_transfer(self, transfers: dict, other_pid: int, rel_name: str):
+
+        key = (other_pid, rel_name)
+        if key not in transfers:
+            transfers[key] = _RelTransfer(self.loop)
+        return transfers[key]
+
+    def rel_transfer_done(self, transfers: dict, other_pid: int, rel_name: str):
+
+        # removed right away, so that messages of a later transfer of the same relation
+        # that arrive in the same packet don't end up here
+        transfers.pop((other_pid, rel_name)).done.set_result(None)
+
+    def _drop_rel_transfer(self, transfers: dict, other_pid: int, rel_name: str, transfer):
+
+        if transfers.get((other_pid, rel_name)) is transfer:
+            del transfers[(other_pid, rel_name)]
+
+    @coroutine
+    def _send_rel(self, receiver, rel_name, chunks):
+
+        transfer = self.rel_transfer(self.rel_senders, receiver, rel_name)
+        protocol = self.peer_protocols[receiver]
+        try:
+            for data in itertools.chain(chunks, [b""]):
+                yield from transfer.wait_for_credit(len(data))
+                yield from protocol.drain()
+                self._send_msg(receiver, RelChunkMsg(self.pid, rel_name, data))
+            # wait for the receiver to acknowledge the last chunk
+            yield from transfer.done
+        finally:
+            self._drop_rel_transfer(self.rel_senders, receiver, rel_name, transfer)
+
+    @coroutine
+    def _receive_rel(self, sender, rel_name, out):
+
+        transfer = self.rel_transfer(self.rel_receivers, sender, rel_name)
+        transfer.out = out
+        self._send_msg(sender, RelCreditMsg(self.pid, rel_name, REL_WINDOW))
+        try:
+            yield from transfer.done
+        finally:
+            self._drop_rel_transfer(self.rel_receivers, sender, rel_name, transfer)
+
+    def send_rel_file(self, receiver, rel_name, path):
+        """
+        Streams the relation file at path to receiver, which has to call receive_rel_file or
+        receive_rel_data for rel_name. Blocks until the receiver has all of it.
+        """
+
+        with open(path, "rb") as f:
+            chunks = iter(functools.partial(f.read, REL_CHUNK_SIZE), b"")
+            self.loop.run_until_complete(self._send_rel(receiver, rel_name, chunks))
+
+    def send_rel_data(self, receiver, rel_name, data):
+        """ Same as send_rel_file, for a relation held in a buffer. """
+
+        view = memoryview(data).cast("B")
+        chunks = (bytes(view[start:start + REL_CHUNK_SIZE]) for start in range(0, len(view), REL_CHUNK_SIZE))
+        self.loop.run_until_complete(self._send_rel(receiver, rel_name, chunks))
+
+    def receive_rel_file(self, sender, rel_name, path):
+        """ Receives the relation rel_name streamed by sender into the file at path. """
+
+        with open(path, "wb") as f:
+            self.loop.run_until_complete(self._receive_rel(sender, rel_name, f))
+
+    def receive_rel_data(self, sender, rel_name):
+        """ Receives the relation rel_name streamed by sender and returns its bytes. """
+
+        out = io.BytesIO()
+        self.loop.run_until_complete(self._receive_rel(sender, rel_name, out))
+        return out.getvalue()
+
+    @coroutine
+    def _probe(self, other_pid, size):
+
+        probe_id = self.next_probe_id
+        self.next_probe_id += 1
+        reply = asyncio.Future(loop=self.loop)
+        self.probe_waiters[probe_id] = reply
+        start_time = time.perf_counter()
+        self._send_msg(other_pid, ProbeMsg(self.pid, probe_id, False, bytes(size)))
+        yield from reply
+        return time.perf_counter() - start_time
+
+    @coroutine
+    def _measure_link(self, other_pid):
+
+        rtt = None
+        for _ in range(PROBE_ROUNDS):
+            elapsed = yield from self._probe(other_pid, 0)
+            rtt = elapsed if rtt is None else min(rtt, elapsed)
+        # a large probe takes a round trip plus the time its padding takes to cross the link
+        elapsed = yield from self._probe(other_pid, PROBE_SIZE)
+        return rtt, PROBE_SIZE / max(elapsed - rtt, MIN_PROBE_TIME)
+
+    @coroutine
+    def _wait_for_link_stats(self):
+
+        while any(self.link_stats.get(pid, (0, None))[0] < self.probe_round for pid in self.parties):
+            self.link_stats_waiter = asyncio.Future(loop=self.loop)
+            yield from self.link_stats_waiter
+
+    @coroutine
+    def _probe_round(self):
+
+        if self.link_stats.get(self.pid, (0, None))[0] == self.probe_round:
+            # the round is resumed, the other peers may hold our measurements of it already
+            yield from self._wait_for_link_stats()
+            return
+        links = {}
+        for other_pid in sorted(self.peer_connections):
+            links[other_pid] = yield from self._measure_link(other_pid)
+        self.link_stats[self.pid] = (self.probe_round, links)
+        for other_pid in self.peer_connections:
+            self._send_msg(other_pid, LinkStatsMsg(self.pid, self.probe_round, links))
+        yield from self._wait_for_link_stats()
+
+    def probe_links(self, timeout: float = PROBE_TIMEOUT):
+        """
+        Measures round-trip time and bandwidth of our links to all other peers and exchanges the
+        measurements with them. Every peer has to call this at the same point of a run, setup_peer
+        calls it once connected if the network config asks for it.
+
+        If the round takes longer than timeout seconds, the measurements of the previous round are
+        kept, and if there are none, link_matrix returns None and parties are placed by pid. The
+        next call then resumes the round that timed out, if our measurements were sent out already.
+        """
+
+        if self.complete_round == self.probe_round:
+            self.probe_round += 1
+        try:
+            self.loop.run_until_complete(asyncio.wait_for(self._probe_round(), timeout))
+        except asyncio.TimeoutError:
+            print("Probing round {} timed out, keeping earlier link measurements".format(self.probe_round))
+            self.probe_waiters.clear()
+            self.link_stats_waiter = None
+            if self.link_stats.get(self.pid, (0, None))[0] < self.probe_round:
+                # no other peer heard of this round, so the next one takes its number
+                self.probe_round -= 1
+        else:
+            self.complete_round = self.probe_round
+            self.complete_link_stats = {pid: links for pid, (_, links) in self.link_stats.items()}
+        return self.link_matrix()
+
+    def link_matrix(self):
+        """
+        Link measurements of all peers from the latest complete probing round, for placing parties
+        with special roles, or None if no round completed.
+        """
+
+        if self.complete_link_stats is None:
+            return None
+        return LinkMatrix.from_link_stats(self.complete_link_stats)
+
+    @coroutine
+    def _wait_for_agreed_links(self, agreement):
+
+        while agreement not in self.agreed_links:
+            self.agreement_waiter = asyncio.Future(loop=self.loop)
+            yield from self.agreement_waiter
+        return self.agreed_links.pop(agreement)
+
+    def agree_link_matrix(self):
+        """
+        Link matrix that all peers place parties by. A probing round can time out on some peers and
+        complete on others, leaving them with different measurements, so the peer with the lowest
+        pid sends its link matrix to the others, which adopt it. Every peer has to call this at the
+        same point of a run, before compiling a workflow.
+        """
+
+        self.agreement += 1
+        if self.pid == min(self.parties):
+            link_matrix = self.link_matrix()
+            links = link_matrix.to_list() if link_matrix is not None else []
+            for other_pid in self.peer_connections:
+                self._send_msg(other_pid, LinkMatrixMsg(self.pid, self.agreement, links))
+        else:
+            links = self.loop.run_until_complete(self._wait_for_agreed_links(self.agreement))
+        return LinkMatrix.from_list(links) if links else None
+
 
 def setup_peer(config):
     """
-    Creates a peer and connects peer to all other peers. Blocks until connection succeeds.
+    Creates a peer and connects peer to all other peers. Blocks until connection succeeds. If the
+    config's "probe_links" is set, the links to the other peers are measured too.
     :param config: network configuration
     :return: connected peer
     """
@@ -221,4 +707,6 @@ def setup_peer(config):
     peer = SalmonPeer(loop, config)
     peer.server = loop.run_until_complete(peer.server)
     peer.connect_to_others()
+    if config.get("probe_links"):
+        peer.probe_links()
     return peer
@@ -0,0 +1,57 @@
+"""
+Length-prefixed binary framing for messages between salmon peers.
+
+Every frame is a fixed-size header (payload length, message type, protocol version) followed by
+the payload, so payloads may hold any bytes. FrameParser parses frames incrementally as data
+arrives: each received byte is appended once and each header is looked at once, however large a
+message is and however it is split into packets.
+"""
+import struct
+
+# payload length, message type and protocol version
+FRAME_HEADER = struct.Struct("<IBB")
+PROTOCOL_VERSION = 1
+MAX_PAYLOAD_SIZE = 2 ** 32 - 1
+
+
+def pack_header(msg_type: int, payload_size: int):
+    """ Header of a frame, for payloads that are written to the transport separately. """
+    if payload_size > MAX_PAYLOAD_SIZE:
+        raise Exception("Payload of {} bytes exceeds frame limit".format(payload_size))
+    return FRAME_HEADER.pack(payload_size, msg_type, PROTOCOL_VERSION)
+
+
+def pack_frame(msg_type: int, payload: bytes = b""):
+    return pack_header(msg_type, len(payload)) + payload
+
+
+class FrameParser:
+    """
+    Splits a byte stream into (message type, payload) frames.
+
+    >>> parser = FrameParser()
+    >>> frame = pack_frame(1, b"\\n\\n\\nab")
+    >>> parser.feed(frame[:3]), parser.feed(frame[3:] + pack_frame(2))
+    ([], [(1, b'\\n\\n\\nab'), (2, b'')])
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def feed(self, data: bytes):
+        """ Adds received data and returns the frames it completes, in order. """
+        self.buffer += data
+        frames = []
+        offset = 0
+        while len(self.buffer) - offset >= FRAME_HEADER.size:
+            payload_size, msg_type, version = FRAME_HEADER.unpack_from(self.buffer, offset)
+            if version != PROTOCOL_VERSION:
+                raise Exception("Unsupported protocol version {}".format(version))
+            end = offset + FRAME_HEADER.size + payload_size
+            if len(self.buffer) < end:
+                break
+            frames.append((msg_type, bytes(self.buffer[offset + FRAME_HEADER.size:end])))
+            offset = end
+        # drop parsed frames in one go rather than once per frame
+        del self.buffer[:offset]
+        return frames
@@ -60,6 +60,9 @@ def heupart(dag: Dag, mpc_frameworks: list, local_frameworks: list):
                         create_op = Create(deepcopy(parent.out_rel))
                         # create op is in same mode as root
                         create_op.is_mpc = root.is_mpc
+                        # remember where the data is handed off between jobs
+                        create_op.boundary_parent = parent
+                        parent.boundary_children.add(create_op)
                         previous_parents.add(parent)
                         create_op_lookup[parent.out_rel.name] = create_op
                     else:
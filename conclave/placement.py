@@ -0,0 +1,83 @@
+"""
+Placement of parties with special roles (servers of public joins, STPs of hybrid ops) based on
+measured link quality.
+
+Peers measure the round-trip time and bandwidth of their links on request (see
+SalmonPeer.probe_links) and exchange the measurements. Before a workflow is compiled, the peers
+agree on one LinkMatrix (see SalmonPeer.agree_link_matrix), so every party compiles the same
+placement. Without measurements, the lowest pid is picked, as before.
+"""
+
+# amount of data assumed to be sent to a party in a role, when comparing candidates
+DEFAULT_TRANSFER_SIZE = 2 ** 20
+
+
+class LinkMatrix:
+    """
+    Round-trip times (in seconds) and bandwidths (in bytes per second) of the links between parties,
+    by (sending pid, receiving pid).
+
+    >>> links = LinkMatrix.from_link_stats({1: {2: (0.01, 1e8)}, 2: {1: (0.01, 1e6)}})
+    >>> round(links.transfer_time(1, 2, 10 ** 6), 3), round(links.transfer_time(2, 1, 10 ** 6), 3)
+    (0.015, 1.005)
+    >>> links.pick({1, 2}, [1, 2])
+    2
+    """
+
+    def __init__(self, rtts: dict, bandwidths: dict):
+        self.rtts = rtts
+        self.bandwidths = bandwidths
+
+    @classmethod
+    def from_link_stats(cls, link_stats: dict):
+        """ Builds the matrix from each party's (rtt, bandwidth) measurements by other pid. """
+        rtts, bandwidths = {}, {}
+        for pid, links in link_stats.items():
+            for other_pid, (rtt, bandwidth) in links.items():
+                rtts[(pid, other_pid)] = rtt
+                bandwidths[(pid, other_pid)] = bandwidth
+        return cls(rtts, bandwidths)
+
+    @classmethod
+    def from_list(cls, links: list):
+        """ Builds the matrix from [sender, receiver, rtt, bandwidth] entries, see to_list. """
+        rtts, bandwidths = {}, {}
+        for sender, receiver, rtt, bandwidth in links:
+            rtts[(sender, receiver)] = rtt
+            bandwidths[(sender, receiver)] = bandwidth
+        return cls(rtts, bandwidths)
+
+    def _link(self, sender: int, receiver: int):
+        # fall back to the measurement of the other direction if only that one is known
+        if (sender, receiver) in self.rtts:
+            return self.rtts[(sender, receiver)], self.bandwidths[(sender, receiver)]
+        if (receiver, sender) in self.rtts:
+            return self.rtts[(receiver, sender)], self.bandwidths[(receiver, sender)]
+        raise Exception("No measurements for link between {} and {}".format(sender, receiver))
+
+    def transfer_time(self, sender: int, receiver: int, num_bytes: int):
+        """ Estimated time to send num_bytes from sender to receiver, half a round trip plus the transfer. """
+        if sender == receiver:
+            return 0.0
+        rtt, bandwidth = self._link(sender, receiver)
+        return rtt / 2 + num_bytes / bandwidth
+
+    def pick(self, candidates, parties, num_bytes: int = DEFAULT_TRANSFER_SIZE):
+        """ Candidate the other parties can send num_bytes each to the fastest, the lowest pid on ties. """
+        return min(sorted(candidates),
+                   key=lambda candidate: sum([self.transfer_time(pid, candidate, num_bytes) for pid in parties]))
+
+    def to_list(self):
+        """ Measurements as [sender, receiver, rtt, bandwidth] entries, e.g. for reporting them as JSON. """
+        return [[sender, receiver, self.rtts[(sender, receiver)], self.bandwidths[(sender, receiver)]]
+                for sender, receiver in sorted(self.rtts)]
+
+
+def pick_party(conclave_config, candidates, parties: [list, None] = None):
+    """
+    Picks the party for a role among candidates, the one that all parties (all_pids by default) can
+    send data to the fastest according to the config's link matrix.
+    """
+    if conclave_config.link_matrix is None:
+        return sorted(candidates)[0]
+    return conclave_config.link_matrix.pick(candidates, parties or conclave_config.all_pids)
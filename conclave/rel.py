@@ -16,10 +16,10 @@ class Column:
         :param rel_name: name of corresponding relation
         :param name: name of column
         :param idx: integer index of the column in the relation
-        :param type_str: describes type of values in column (currently only "INTEGER" supported)
+        :param type_str: describes type of values in column ("INTEGER", "INT32" or "FLOAT")
         :param trust_set: parties trusted to learn this column in the clear
         """
-        if type_str not in {"INTEGER"}:
+        if type_str not in {"INTEGER", "INT32", "FLOAT"}:
             raise Exception("Type not supported {}".format(type_str))
         self.rel_name = rel_name
         self.name = name
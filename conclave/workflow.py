@@ -53,7 +53,7 @@ def setup(conf: dict):
 
     # NET
     hosts = conf["net"]["parties"]
-    net_config = NetworkConfig(hosts, pid)
+    net_config = NetworkConfig(hosts, pid, conf["net"].get("probe_links", False))
     conclave_config.with_network_config(net_config)
 
     conclave_config.pid = pid
@@ -0,0 +1,139 @@
+"""
+Tests of the multiplexed data channels between parties (conclave.codegen.libs.channels) and of the
+arguments, such as stream names, the Python code generator gives the parties' halves of each exchange.
+"""
+import re
+import socket
+import threading
+import time
+import unittest
+
+import conclave.codegen.libs.channels as channels
+import conclave.lang as cc
+from conclave.codegen.python import PythonCodeGen
+from conclave.config import CodeGenConfig
+from conclave.dag import OpDag
+from conclave.utils import defCol
+
+HOST = "127.0.0.1"
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind((HOST, 0))
+        return sock.getsockname()[1]
+
+
+def recv_all(stream, size: int):
+    data = bytearray()
+    view = memoryview(bytearray(4096))
+    while len(data) < size:
+        received = stream.recv_into(view)
+        if not received:
+            break
+        data += view[:received]
+    return bytes(data)
+
+
+class TestStreams(unittest.TestCase):
+
+    def setUp(self):
+        self.port = free_port()
+        self.window = channels.STREAM_WINDOW
+
+    def tearDown(self):
+        channels.STREAM_WINDOW = self.window
+        channels.close_all()
+
+    def in_thread(self, fn, *args):
+        result = {}
+        thread = threading.Thread(target=lambda: result.setdefault("value", fn(*args)), daemon=True)
+        thread.start()
+        return thread, result
+
+    def test_server_sends_first(self):
+        data = bytes(range(256)) * 50
+
+        def server():
+            stream = channels.open_stream(HOST, self.port, True, "s")
+            stream.sendall(data)
+            return recv_all(stream, 3)
+
+        thread, result = self.in_thread(server)
+        stream = channels.open_stream(HOST, self.port, False, "s")
+        self.assertEqual(recv_all(stream, len(data)), data)
+        stream.sendall(b"ack")
+        thread.join(10)
+        self.assertEqual(result["value"], b"ack")
+
+    def test_streams_interleave_on_one_connection(self):
+        names = ["s{}".format(i) for i in range(4)]
+
+        def server():
+            streams = [channels.open_stream(HOST, self.port, True, name) for name in reversed(names)]
+            return {stream.name: recv_all(stream, 2 * channels.MAX_FRAME_SIZE) for stream in streams}
+
+        thread, result = self.in_thread(server)
+        for name in names:
+            channels.open_stream(HOST, self.port, False, name).sendall(name.encode() * channels.MAX_FRAME_SIZE)
+        thread.join(10)
+        self.assertEqual(result["value"], {name: name.encode() * channels.MAX_FRAME_SIZE for name in names})
+        self.assertEqual(len(channels._endpoints[(HOST, self.port, True)].connections), 1)
+
+    def test_sender_waits_for_credit(self):
+        channels.STREAM_WINDOW = 1000
+        data = bytes(range(256)) * 20
+        thread, _ = self.in_thread(lambda: channels.open_stream(HOST, self.port, True, "s").sendall(data))
+        stream = channels.open_stream(HOST, self.port, False, "s")
+        time.sleep(0.2)
+        self.assertEqual(len(stream.buffer), 1000)
+        self.assertEqual(recv_all(stream, len(data)), data)
+        thread.join(10)
+        self.assertFalse(thread.is_alive())
+
+    def test_frames_of_closed_streams_are_dropped(self):
+        thread, result = self.in_thread(channels.open_stream, HOST, self.port, True, "s")
+        stream = channels.open_stream(HOST, self.port, False, "s")
+        thread.join(10)
+        stream.close()
+        result["value"].sendall(b"late")
+        time.sleep(0.2)
+        self.assertNotIn("s", channels._endpoints[(HOST, self.port, False)].streams)
+
+    def test_unopened_stream_times_out(self):
+        server = channels._ServerEndpoint(HOST, self.port)
+        try:
+            with self.assertRaises(Exception):
+                server.bound_stream("other", timeout=0.1)
+        finally:
+            server.close()
+
+
+def exchanges(pid: int):
+    """ Public intersection then public join between parties 1 and 2, as seen by party pid. """
+    side = "left" if pid == 1 else "right"
+    cols = [defCol("a", "INTEGER", [1, 2]), defCol("b", "INTEGER", pid)]
+    keys = cc.create("{}_keys".format(side), cols, {pid})
+    other = cc.create("{}_other".format(side), [defCol("a", "INTEGER", [1, 2])], {pid})
+    shared = cc._pub_intersect(keys, "a_{}_shared".format(side), "a", host=HOST, is_server=pid == 1)
+    cc._persist(shared, "a_{}_shared".format(side))
+    joined = cc._pub_join(keys, "{}_join".format(side), "a", host=HOST, is_server=pid == 1, other_op_node=other)
+    cc._persist(joined, "{}_join".format(side))
+    return {keys, other}
+
+
+class TestExchangeArgs(unittest.TestCase):
+
+    def test_parties_name_streams_alike(self):
+        names = {}
+        for pid in (1, 2):
+            config = CodeGenConfig("streams", pid).with_data_channel(9000)
+            _, code = PythonCodeGen(config, OpDag(exchanges(pid)))._generate("job", None)
+            names[pid] = re.findall(r"stream='([^']*)'", code)
+        self.assertEqual(names[1], ["{}:9000#0".format(HOST), "{}:9000#1".format(HOST)])
+        self.assertEqual(names[1], names[2])
+
+    def test_compression(self):
+        config = CodeGenConfig("streams", 1).with_wire_compression()
+        _, code = PythonCodeGen(config, OpDag(exchanges(1)))._generate("job", None)
+        self.assertEqual(len(re.findall(r"pub_\w+\(.*, compress=True\)", code)), 2)
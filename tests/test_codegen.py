@@ -0,0 +1,338 @@
+"""
+Tests of the code the backends generate for a compiled workflow, and of the compiler passes that
+decide what each backend gets to see.
+"""
+import copy
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import conclave.codegen.libs.python as rowlib
+import conclave.comp as comp
+import conclave.dag as ccdag
+import conclave.lang as cc
+from conclave.codegen.oblivc import OblivcCodeGen
+from conclave.codegen.python import PythonCodeGen
+from conclave.codegen.sharemind import SharemindCodeGen
+from conclave.codegen.spark import SparkCodeGen
+from conclave.config import CodeGenConfig, OblivcConfig, SharemindCodeGenConfig
+from conclave.utils import defCol
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def config(pid: int = 1):
+    conclave_config = CodeGenConfig("codegen", pid)
+    conclave_config.all_pids = [1, 2]
+    return conclave_config
+
+
+def shared_group_by(aggregators: list):
+    """ One input of party 1, aggregated once per aggregator over the same group column. """
+    in_op = cc.create("in", [defCol("a", "INTEGER", 1), defCol("b", "INTEGER", 1)], {1})
+    aggs = [cc.aggregate(in_op, "agg_{}".format(aggregator), ["a"], "b", aggregator, aggregator)
+            for aggregator in aggregators]
+    for agg in aggs:
+        cc.collect(agg, 1)
+    return in_op, aggs
+
+
+def mpc_aggregate(aggregator: str):
+    """ Inputs of parties 1 and 2, concatenated then aggregated under MPC. """
+    in1 = cc.create("in1", [defCol("a", "INTEGER", 1), defCol("b", "INTEGER", 1)], {1})
+    in2 = cc.create("in2", [defCol("a", "INTEGER", 2), defCol("b", "INTEGER", 2)], {2})
+    agg = cc.aggregate(cc.concat([in1, in2], "rel"), "agg", ["a"], "b", aggregator, "out")
+    cc.collect(agg, 1)
+    return {in1, in2}, agg
+
+
+def write_inputs(job_dir: str, inputs: dict, seed: int = 0):
+    """ Writes a CSV file of random rows for each input relation, given as name -> (num_rows, num_cols). """
+    rand = random.Random(seed)
+    for name, (num_rows, num_cols) in sorted(inputs.items()):
+        with open("{}/{}.csv".format(job_dir, name), "w") as f:
+            f.write(",".join('"c{}"'.format(idx) for idx in range(num_cols)) + "\n")
+            for _ in range(num_rows):
+                f.write(",".join(str(rand.randint(1, 9)) for _ in range(num_cols)) + "\n")
+
+
+def run_workflow(protocol, conclave_config: CodeGenConfig, inputs: dict):
+    """
+    Generates the Python job of a single-party protocol, runs it on random inputs and returns its code
+    and the contents of its output files.
+    """
+    job_dir = tempfile.mkdtemp()
+    try:
+        write_inputs(job_dir, inputs)
+        conclave_config.input_path = conclave_config.output_path = conclave_config.code_path = job_dir
+        _, code = PythonCodeGen(conclave_config, ccdag.OpDag(protocol()))._generate("job", job_dir)
+        with open("{}/workflow.py".format(job_dir), "w") as f:
+            f.write(code)
+        subprocess.check_call([sys.executable, "{}/workflow.py".format(job_dir)],
+                              env=dict(os.environ, PYTHONPATH=REPO_DIR), stdout=subprocess.DEVNULL)
+        outputs = {}
+        for name in sorted(os.listdir(job_dir)):
+            if name.endswith(".bin"):
+                outputs[name] = rowlib.read_rel_bin("{}/{}".format(job_dir, name))
+            elif name.endswith(".csv") and name[:-len(".csv")] not in inputs:
+                with open("{}/{}".format(job_dir, name)) as f:
+                    outputs[name] = f.read()
+        return code, outputs
+    finally:
+        shutil.rmtree(job_dir)
+
+
+def handed_off(parent: ccdag.OpNode):
+    """ Input of a later job reading the output of parent, as the partitioner inserts it. """
+    create_op = ccdag.Create(copy.deepcopy(parent.out_rel))
+    create_op.boundary_parent = parent
+    parent.boundary_children.add(create_op)
+    return create_op
+
+
+class TestGroupBy(unittest.TestCase):
+
+    def test_siblings_share_one_pass(self):
+        in_op, aggs = shared_group_by(["max", "sum"])
+        codegen = PythonCodeGen(config(), ccdag.OpDag({in_op}))
+        self.assertEqual(codegen._group_by_siblings(aggs[0]), aggs)
+        _, code = codegen._generate("job", None)
+        self.assertEqual(code.count("group_by("), 1)
+
+    def test_siblings_outside_job_are_not_merged(self):
+        in_op, aggs = shared_group_by(["max", "sum"])
+        # a job starting below the shared input holds only the first aggregation
+        codegen = PythonCodeGen(config(), ccdag.OpDag({aggs[0]}))
+        self.assertEqual(codegen._group_by_siblings(aggs[0]), aggs[:1])
+
+
+class TestMinMax(unittest.TestCase):
+
+    def test_trust_sets(self):
+        _, aggs = shared_group_by(["min", "max"])
+        for agg in aggs:
+            comp.TrustSetPropDown(config())._rewrite_aggregate(agg)
+            self.assertEqual(agg.out_rel.columns[-1].trust_set, {1})
+
+    def test_kept_under_mpc(self):
+        roots, agg = mpc_aggregate("max")
+        dag = comp.rewrite_dag(ccdag.OpDag(roots), config())
+        names = [node.out_rel.name for node in dag.top_sort()]
+        self.assertIn("agg", names)
+        self.assertNotIn("agg_obl", names)
+        self.assertTrue(agg.is_mpc)
+
+    def test_rejected_by_mpc_backends(self):
+        conclave_config = config()
+        conclave_config.with_sharemind_config(SharemindCodeGenConfig())
+        conclave_config.with_oc_config(OblivcConfig("/tmp/obliv-c", "127.0.0.1:9000"))
+        for aggregator in ("min", "max"):
+            _, agg = mpc_aggregate(aggregator)
+            with self.assertRaises(Exception):
+                SharemindCodeGen(conclave_config, ccdag.OpDag(set()), 1)._generate_aggregate(agg)
+            with self.assertRaises(Exception):
+                OblivcCodeGen(conclave_config, ccdag.OpDag(set()), 1)._generate_aggregate(agg)
+
+    def test_spark(self):
+        _, aggs = shared_group_by(["min", "max", "mean", "std_dev"])
+        codegen = SparkCodeGen(config(), ccdag.OpDag(set()))
+        self.assertIn(".agg({'b':'min'})", codegen._generate_aggregate(aggs[0]))
+        self.assertIn(".withColumnRenamed('max(b)', 'max')", codegen._generate_aggregate(aggs[1]))
+        self.assertIn(".withColumnRenamed('avg(b)', 'mean')", codegen._generate_aggregate(aggs[2]))
+        with self.assertRaises(Exception):
+            codegen._generate_aggregate(aggs[3])
+
+
+class TestBinaryHandoff(unittest.TestCase):
+
+    def generate(self, roots: set, name: str):
+        conclave_config = config().with_intermediate_format("binary")
+        return PythonCodeGen(conclave_config, ccdag.OpDag(roots))._generate(name, None)[1]
+
+    def test_local_jobs_hand_off_binary(self):
+        in_op = cc.create("in", [defCol("a", "INTEGER", 1), defCol("b", "INTEGER", 1)], {1})
+        local = cc.project(in_op, "local", ["a", "b"])
+        later = [handed_off(local), handed_off(in_op)]
+        cc.collect(cc.join(later[0], later[1], "joined", ["a"], ["a"]), 1)
+        first, second = self.generate({in_op}, "first"), self.generate(set(later), "second")
+        self.assertIn("write_rel_bin('/tmp', 'local.bin', local, 2)", first)
+        self.assertIn("local = read_rel_bin('/tmp/local.bin')", second)
+        # workflow inputs and outputs stay csv
+        self.assertIn("in = read_rel('/tmp/in.csv'", first)
+        self.assertIn("in = read_rel('/tmp/in.csv'", second)
+        self.assertIn("write_rel('/tmp', 'joined.csv'", second)
+
+    def test_mpc_consumers_read_csv(self):
+        in_op = cc.create("in", [defCol("a", "INTEGER", 1), defCol("b", "INTEGER", 1)], {1})
+        local = cc.project(in_op, "local", ["a", "b"])
+        cc.project(handed_off(local), "secret", ["a"]).is_mpc = True
+        self.assertIn("write_rel('/tmp', 'local.csv'", self.generate({in_op}, "first"))
+
+
+class TestCsvInput(unittest.TestCase):
+
+    def generate(self, roots: set, name: str):
+        conclave_config = config().with_delimiter(";")
+        return PythonCodeGen(conclave_config, ccdag.OpDag(roots))._generate(name, None)[1]
+
+    def test_delimiter_applies_to_inputs_only(self):
+        in_op = cc.create("in", [defCol("a", "INTEGER", 1), defCol("b", "INTEGER", 1)], {1})
+        local = cc.project(in_op, "local", ["a", "b"])
+        later = [handed_off(local), handed_off(in_op)]
+        cc.collect(cc.join(later[0], later[1], "joined", ["a"], ["a"]), 1)
+        self.assertIn("in = read_rel('/tmp/in.csv', delimiter=';')", self.generate({in_op}, "first"))
+        second = self.generate(set(later), "second")
+        self.assertIn("local = read_rel('/tmp/local.csv', delimiter=',')", second)
+        self.assertIn("in = read_rel('/tmp/in.csv', delimiter=';')", second)
+
+    def test_inputs_read_later_are_not_rewritten(self):
+        in_op = cc.create("in", [defCol("a", "INTEGER", 1), defCol("b", "INTEGER", 1)], {1})
+        cc.collect(cc.project(handed_off(in_op), "out", ["a"]), 1)
+        self.assertNotIn("write_rel", self.generate({in_op}, "first"))
+
+
+def row_chains():
+    """ Chains of row-wise ops into an aggregation, a join and a file of party 1. """
+    in1 = cc.create("in1", [defCol(name, "INTEGER", 1) for name in "abc"], {1})
+    in2 = cc.create("in2", [defCol(name, "INTEGER", 1) for name in "ad"], {1})
+    in3 = cc.create("in3", [defCol(name, "INTEGER", 1) for name in "abc"], {1})
+    filtered = cc.cc_filter(in1, "filtered", "b", "<", scalar=7)
+    multiplied = cc.multiply(filtered, "multiplied", "c", ["c", "b"])
+    agg = cc.aggregate(multiplied, "agg", ["a"], "c", "sum", "total")
+    joined = cc.join(agg, cc.project(in2, "projected", ["d", "a"]), "joined", ["a"], ["a"])
+    cc.divide(joined, "divided", "total", ["total", "d"])
+    cc.aggregate(cc.multiply(in3, "tripled", "c", ["c", 3]), "mean", ["a", "b"], "c", "mean", "avg")
+    return {in1, in2, in3}
+
+
+class TestStreaming(unittest.TestCase):
+
+    inputs = {"in1": (1000, 3), "in2": (300, 2), "in3": (1000, 3)}
+
+    def test_streamed_equals_materialized(self):
+        _, expected = run_workflow(row_chains, config(), self.inputs)
+        self.assertEqual(sorted(expected), ["divided.csv", "mean.csv"])
+        for engine in ("list", "columnar"):
+            for algorithm in ("hash", "sort"):
+                conclave_config = config().with_python_engine(engine).with_join_algorithm(algorithm)
+                code, actual = run_workflow(row_chains, conclave_config.with_streaming(37), self.inputs)
+                self.assertIn("read_rel_chunks(", code)
+                self.assertEqual(actual, expected, (engine, algorithm))
+
+
+def sorted_input():
+    in_op = cc.create("rows", [defCol("a", "INTEGER", 1), defCol("b", "INTEGER", 1)], {1})
+    cc.sort_by(in_op, "sorted", "a")
+    return {in_op}
+
+
+class TestSortBudget(unittest.TestCase):
+
+    def test_sorts_streamed_input_within_budget(self):
+        inputs = {"rows": (2000, 2)}
+        code, actual = run_workflow(sorted_input, config().with_sort_budget(100), inputs)
+        self.assertIn("rows = read_rel_rows(", code)
+        self.assertIn(", 100, ", code)
+        self.assertEqual(actual, run_workflow(sorted_input, config(), inputs)[1])
+
+    def test_budget_only_passed_to_streamed_sorts(self):
+        in_op = cc.create("rows", [defCol("a", "INTEGER", 1), defCol("b", "INTEGER", 1)], {1})
+        lookups = cc.create("lookups", [defCol("a", "INTEGER", 1)], {1})
+        cc.collect(cc.project(cc.sort_by(in_op, "sorted", "a"), "projected", ["b"]), 1)
+        cc._indexes_to_flags(in_op, lookups, "arranged", stage=1)
+        conclave_config = config().with_sort_budget(100)
+        _, code = PythonCodeGen(conclave_config, ccdag.OpDag({in_op, lookups}))._generate("job", None)
+        self.assertIn("sorted = sort_by(rows, 0)\n", code)
+        self.assertIn("arranged = arrange_by_flags(rows, lookups)\n", code)
+
+
+def row_chain():
+    rows = cc.create("rows", [defCol(name, "INTEGER", 1) for name in "abc"], {1})
+    filtered = cc.cc_filter(rows, "filtered", "b", "<", scalar=7)
+    multiplied = cc.multiply(filtered, "multiplied", "c", ["c", "b"])
+    cc.collect(cc.project(multiplied, "projected", ["c", "a"]), 1)
+    return {rows}
+
+
+class TestOpFusion(unittest.TestCase):
+
+    fused = (
+        "    def projected_row(row):\n"
+        "        if not (row[1] < 7):\n"
+        "            return None\n"
+        "        v1 = row[2] * row[1]\n"
+        "        return [v1, row[0]]\n"
+        "    projected = map_rows(rows, projected_row, 2)\n"
+    )
+
+    def generate(self, conclave_config: CodeGenConfig):
+        return PythonCodeGen(conclave_config, ccdag.OpDag(row_chain()))._generate("job", None)[1]
+
+    def test_disabled_by_default(self):
+        code = self.generate(config())
+        self.assertNotIn("map_rows(", code)
+        self.assertIn("filtered = cc_filter(lambda row : row[1] < 7, rows)\n", code)
+
+    def test_fused_chain(self):
+        self.assertIn(self.fused, self.generate(config().with_op_fusion(True)))
+
+    def test_not_fused_for_columnar_engine(self):
+        self.assertNotIn("map_rows(", self.generate(config().with_op_fusion(True).with_python_engine("columnar")))
+
+    def test_fused_equals_unfused(self):
+        inputs = {"rows": (500, 3)}
+        _, expected = run_workflow(row_chain, config(), inputs)
+        for conclave_config in [config().with_op_fusion(True), config().with_op_fusion(True).with_streaming(37)]:
+            code, actual = run_workflow(row_chain, conclave_config, inputs)
+            self.assertIn("map_rows(", code)
+            self.assertEqual(actual, expected)
+        # every workflow of the streaming test, fused
+        _, expected = run_workflow(row_chains, config(), TestStreaming.inputs)
+        code, actual = run_workflow(row_chains, config().with_op_fusion(True), TestStreaming.inputs)
+        self.assertIn("map_rows(", code)
+        self.assertEqual(actual, expected)
+
+
+class TestColumnExpressions(unittest.TestCase):
+
+    def test_compiled_for_columnar_engine(self):
+        conclave_config = config().with_python_engine("columnar")
+        _, code = PythonCodeGen(conclave_config, ccdag.OpDag(row_chains()))._generate("job", None)
+        self.assertIn("filtered = mask_filter(lambda cols : cols[1] < 7, in1)\n", code)
+        self.assertIn("multiplied = arithmetic_columns(filtered, 2, lambda cols : cols[2] * cols[1])\n", code)
+        self.assertIn("divided = arithmetic_columns(joined, 1, lambda cols : int_div(cols[1], cols[2]))\n", code)
+
+    def test_compiled_equals_row_engine(self):
+        _, expected = run_workflow(row_chains, config(), TestStreaming.inputs)
+        _, actual = run_workflow(row_chains, config().with_python_engine("columnar"), TestStreaming.inputs)
+        self.assertEqual(actual, expected)
+
+
+def typed_chain():
+    rows = cc.create("rows", [defCol("a", "INT32", 1), defCol("b", "FLOAT", 1), defCol("c", "INTEGER", 1)], {1})
+    divided = cc.divide(rows, "divided", "b", ["b", 4])
+    cc.collect(cc.sort_by(cc.aggregate(divided, "total", ["a"], "b", "sum", "b"), "ordered", "a"), 1)
+    cc.collect(cc.aggregate(divided, "mean", ["a"], "c", "mean", "c"), 1)
+    return {rows}
+
+
+class TestColumnTypes(unittest.TestCase):
+
+    def test_typed_reads_and_writes(self):
+        _, code = PythonCodeGen(config(), ccdag.OpDag(typed_chain()))._generate("job", None)
+        self.assertIn("rows = read_rel('/tmp/rows.csv', delimiter=',', col_types='idq')\n", code)
+        conclave_config = config().with_output_format("binary")
+        _, code = PythonCodeGen(conclave_config, ccdag.OpDag(typed_chain()))._generate("job", None)
+        self.assertIn("write_rel_bin('/tmp', 'ordered.bin', ordered, 2, col_types='id')\n", code)
+
+    def test_engines_agree(self):
+        inputs = {"rows": (300, 3)}
+        for output_format in ("csv", "binary"):
+            _, expected = run_workflow(typed_chain, config().with_output_format(output_format), inputs)
+            self.assertEqual(len(expected), 2)
+            conclave_config = config().with_output_format(output_format).with_python_engine("columnar")
+            self.assertEqual(run_workflow(typed_chain, conclave_config, inputs)[1], expected)
@@ -0,0 +1,434 @@
+"""
+Differential tests of the columnar engine (conclave.codegen.libs.columnar) against the row
+engine (conclave.codegen.libs.python): both must compute the same relations.
+"""
+import os
+import random
+import shutil
+import socket
+import tempfile
+import threading
+import unittest
+
+import conclave.codegen.libs.columnar as collib
+import conclave.codegen.libs.python as rowlib
+
+MIXED = [[1, 3, 2.5], [2, 5, 0.5], [3, -4, 1.0]]
+
+def as_rows(rel):
+    """ Result of either engine as a list of rows. """
+    if isinstance(rel, collib.ColumnarRel):
+        return rel.to_rows()
+    return [list(row) for row in rel]
+
+
+def random_rel(num_rows: int, num_cols: int, max_value: int = 9, seed: int = 0):
+    rand = random.Random(seed)
+    return [[rand.randint(0, max_value) for _ in range(num_cols)] for _ in range(num_rows)]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class TestOps(unittest.TestCase):
+    """ Every op of the columnar engine against the row engine, on the same inputs. """
+
+    rel = random_rel(200, 3, seed=1)
+    other = random_rel(150, 2, max_value=12, seed=2)
+
+    def check_same(self, op_name, *args, ordered=True):
+        expected = as_rows(getattr(rowlib, op_name)(*args))
+        actual = as_rows(getattr(collib, op_name)(*args))
+        if not ordered:
+            expected, actual = sorted(expected), sorted(actual)
+        self.assertEqual(actual, expected)
+        # an empty first input
+        expected = as_rows(getattr(rowlib, op_name)([], *args[1:]))
+        self.assertEqual(as_rows(getattr(collib, op_name)([], *args[1:])), expected)
+
+    def test_num_rows(self):
+        self.check_same("num_rows", self.rel)
+
+    def test_project(self):
+        self.check_same("project", self.rel, [2, 0])
+
+    def test_aggregate(self):
+        self.check_same("aggregate", self.rel, 0, 1, "sum", ordered=False)
+
+    def test_aggregate_count(self):
+        self.check_same("aggregate_count", self.rel, 1, ordered=False)
+
+    def test_group_by(self):
+        aggs = [(2, "sum"), (None, "count"), (2, "min"), (1, "max"), (2, "mean")]
+        self.check_same("group_by", self.rel, [0, 1], aggs, ordered=False)
+
+    def test_stream_group_by(self):
+        chunks = [self.rel[:70], self.rel[70:]]
+        aggs = [(2, "sum"), (0, "mean")]
+        expected = rowlib.stream_group_by(chunks, [1], aggs)
+        self.assertEqual(sorted(expected), sorted(rowlib.group_by(self.rel, [1], aggs)))
+        actual = collib.stream_group_by([collib.as_rel(chunk) for chunk in chunks], [1], aggs)
+        self.assertEqual(sorted(as_rows(actual)), sorted(expected))
+
+    def test_map_rows(self):
+        def row_fn(row):
+            if not (row[0] < 5):
+                return None
+            return [row[1] * 2, row[2]]
+        self.check_same("map_rows", self.rel, row_fn, 2)
+        self.check_same("map_rows", self.rel, lambda row: [row[2] - row[1], row[0] * 3], 2)
+
+    def test_project_indeces(self):
+        self.check_same("project_indeces", self.rel)
+
+    def test_join_flags(self):
+        self.check_same("join_flags", self.rel[:30], self.other[:20], 0, 1)
+
+    def test_join(self):
+        self.check_same("join", self.rel, self.other, 0, 1)
+
+    def test_sort_join(self):
+        self.check_same("sort_join", self.rel, self.other, 0, 1)
+        self.check_same("sort_join", self.rel, self.rel, 2, 2)
+
+    def test_join_build_probe(self):
+        expected = rowlib.join_probe(rowlib.join_build(self.rel, 1), self.other, 0)
+        self.assertEqual(expected, rowlib.join(self.rel, self.other, 1, 0))
+        actual = collib.join_probe(collib.join_build(self.rel, 1), self.other, 0)
+        self.assertEqual(as_rows(actual), expected)
+
+    def test_index_agg(self):
+        keys = [[key] for key in range(10)]
+        indeces = [[idx, row[0]] for idx, row in enumerate(self.rel)]
+        for aggregator in ["sum", "count", lambda acc, value: max(acc, value)]:
+            expected = rowlib.index_agg(self.rel, 2, keys, indeces, aggregator)
+            self.assertEqual(as_rows(collib.index_agg(self.rel, 2, keys, indeces, aggregator)), expected)
+
+    def test_sort_by(self):
+        self.check_same("sort_by", self.rel, 1)
+
+    def test_sort_by_spilled(self):
+        self.check_same("sort_by", self.rel, 1, 16)
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            spilled = rowlib.sort_by(iter(self.rel), 1, 16, tmp_dir)
+            self.assertEqual(next(spilled), rowlib.sort_by(self.rel, 1)[0])
+            self.assertTrue(os.listdir(tmp_dir))
+            self.assertEqual(list(spilled), rowlib.sort_by(self.rel, 1)[1:])
+            self.assertFalse(os.listdir(tmp_dir))
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_comp_neighs(self):
+        self.check_same("comp_neighs", rowlib.sort_by(self.rel, 0), 0)
+
+    def test_distinct(self):
+        self.check_same("distinct", self.rel, [1, 0])
+
+    def test_distinct_count(self):
+        self.check_same("distinct_count", self.rel, 2)
+
+    def test_indexes_to_flags(self):
+        self.check_same("indexes_to_flags", [[3], [0], [7]], 9)
+
+    def test_arrange_by_flags(self):
+        lookups = [[2], [5], [2], [2], [7]]
+        indexes_and_flags = [[7, 1], [4, 0], [2, 1], [9, 0], [5, 1], [1, 0]]
+        self.check_same("arrange_by_flags", lookups, indexes_and_flags)
+
+    def test_cc_filter(self):
+        for cond in [lambda row: row[0] < row[1], lambda row: row[2] == 3, lambda row: row[0] > 2 and row[1] > 2]:
+            self.assertEqual(as_rows(collib.cc_filter(cond, self.rel)), rowlib.cc_filter(cond, self.rel))
+            self.assertEqual(as_rows(collib.cc_filter(cond, [])), [])
+
+    def test_key_union(self):
+        self.assertEqual(collib.key_union(self.rel, self.other, 0, 1), rowlib.key_union(self.rel, self.other, 0, 1))
+
+    def test_key_union_as_rel(self):
+        self.check_same("key_union_as_rel", self.rel, self.other, 0, 1)
+
+    def test_to_set_and_rel(self):
+        self.assertEqual(collib.to_set(self.rel, 1), rowlib.to_set(self.rel, 1))
+        keys = rowlib.to_set(self.rel, 1)
+        self.assertEqual(sorted(as_rows(collib.to_rel(keys))), sorted(rowlib.to_rel(keys)))
+
+    def test_filter_by(self):
+        key_rel = [[1], [4], [8]]
+        self.check_same("filter_by", self.rel, key_rel, 0)
+        self.check_same("filter_by", self.rel, key_rel, 0, True)
+
+    def test_reconstruct(self):
+        left, right = self.rel[:20], self.other[:20]
+        rand = random.Random(3)
+        idx_rel = [[rand.randrange(20), rand.randint(0, 1), rand.randrange(20), rand.randint(0, 1)] for _ in range(50)]
+        for me in [0, 1]:
+            expected = rowlib.reconstruct(left, right, 0, 1, idx_rel, me, 3, 2)
+            self.assertEqual(len(expected), len(idx_rel))
+            actual = collib.reconstruct(collib.as_rel(left), collib.as_rel(right), 0, 1, idx_rel, me, 3, 2)
+            self.assertEqual(as_rows(actual), expected)
+        self.assertEqual(as_rows(collib.reconstruct(collib.as_rel(left), collib.as_rel(right), 0, 1, [], 0, 3, 2)),
+                         rowlib.reconstruct(left, right, 0, 1, [], 0, 3, 2))
+
+class TestRowFunctions(unittest.TestCase):
+    """ Functions of a row, which the columnar engine evaluates over whole columns where it can. """
+
+    rel = [[2 ** 40, 2 ** 40, 3], [3, -4, 0], [-2 ** 35, 2 ** 30, 1]]
+
+    def check_same(self, row_fn):
+        expected = rowlib.arithmetic_project([list(row) for row in self.rel], 2, row_fn)
+        self.assertEqual(collib.arithmetic_project(self.rel, 2, row_fn).to_rows(), expected)
+        self.assertEqual(as_rows(collib.cc_filter(lambda row: row_fn(row) > 0, self.rel)),
+                         rowlib.cc_filter(lambda row: row_fn(row) > 0, self.rel))
+        # fused chains, with and without a filter
+        for fused in [lambda row: [row[2], row_fn(row)], lambda row: [row_fn(row)] if row_fn(row) > 0 else None]:
+            self.assertEqual(as_rows(collib.map_rows(self.rel, fused, len(fused(self.rel[0])))),
+                             rowlib.map_rows(self.rel, fused, len(fused(self.rel[0]))))
+
+    def test_no_overflow(self):
+        self.check_same(lambda row: row[0] + row[1] * 2 - row[2])
+
+    def test_overflowing_intermediate(self):
+        self.check_same(lambda row: row[0] * row[1] // 2 ** 40)
+        self.check_same(lambda row: row[0] * row[1] * row[1] - row[0] * row[1] * row[1] + row[2])
+
+    def test_overflowing_result(self):
+        self.assertEqual(as_rows(collib.cc_filter(lambda row: row[0] * row[1] > 0, self.rel)), self.rel[:1])
+        # the columnar engine holds 64 bit integers, so results beyond them raise instead of wrapping
+        with self.assertRaises(OverflowError):
+            collib.arithmetic_project(self.rel, 2, lambda row: row[0] * row[1])
+
+    def test_division_by_zero(self):
+        with self.assertRaises(ZeroDivisionError):
+            collib.arithmetic_project(self.rel, 2, lambda row: row[0] // row[2])
+
+    def test_compiled_overflowing_intermediate(self):
+        expected = rowlib.arithmetic_project([list(row) for row in self.rel], 2, lambda row: row[0] * row[1] // 2 ** 40)
+        actual = collib.arithmetic_columns(self.rel, 2, lambda cols: cols[0] * cols[1] // 2 ** 40)
+        self.assertEqual(actual.to_rows(), expected)
+        self.assertEqual(as_rows(collib.mask_filter(lambda cols: cols[0] * cols[1] > 0, self.rel)),
+                         rowlib.cc_filter(lambda row: row[0] * row[1] > 0, self.rel))
+
+    def test_compiled_overflowing_result(self):
+        with self.assertRaises(OverflowError):
+            collib.arithmetic_columns(self.rel, 2, lambda cols: cols[0] * cols[1])
+
+
+class TestArithmetic(unittest.TestCase):
+    """ Arithmetic compiled to whole-column expressions against the same arithmetic over rows. """
+
+    def check_same(self, rel, target_col_idx, row_f, cols_f):
+        expected = rowlib.arithmetic_project([list(row) for row in rel], target_col_idx, row_f)
+        self.assertEqual(collib.arithmetic_project(rel, target_col_idx, row_f).to_rows(), expected)
+        self.assertEqual(collib.arithmetic_columns(rel, target_col_idx, cols_f).to_rows(), expected)
+
+    def test_int_times_float_scalar(self):
+        self.check_same(MIXED, 1, lambda row: row[1] * 1.5, lambda cols: cols[1] * 1.5)
+
+    def test_int_times_float_col(self):
+        self.check_same(MIXED, 0, lambda row: row[0] * row[2], lambda cols: cols[0] * cols[2])
+
+    def test_int_times_int(self):
+        self.check_same(MIXED, 0, lambda row: row[0] * row[1] * 2, lambda cols: cols[0] * cols[1] * 2)
+
+    def test_float_div(self):
+        self.check_same(MIXED, 2, lambda row: row[1] / row[2], lambda cols: cols[1] / cols[2])
+
+    def test_int_div(self):
+        self.check_same(MIXED, 1, lambda row: int(row[1] / 2 / row[0]), lambda cols: collib.int_div(cols[1], 2, cols[0]))
+
+    def test_mask_filter(self):
+        for row_f, cols_f in [(lambda row: row[1] < row[2] * 4, lambda cols: cols[1] < cols[2] * 4),
+                              (lambda row: row[0] == 2, lambda cols: cols[0] == 2)]:
+            self.assertEqual(as_rows(collib.mask_filter(cols_f, MIXED)), rowlib.cc_filter(row_f, MIXED))
+
+
+class TestNetworkOps(unittest.TestCase):
+    """ Ops between parties, with either engine on either side. """
+
+    left = random_rel(300, 2, max_value=40, seed=4)
+    right = random_rel(200, 2, max_value=40, seed=5)
+
+    def run_parties(self, server_fn, client_fn):
+        out = {}
+        server = threading.Thread(target=lambda: out.update(server=as_rows(server_fn())))
+        server.start()
+        out["client"] = as_rows(client_fn())
+        server.join()
+        return out["server"], out["client"]
+
+    def check_pub_join(self, chunk_size: int, compress: bool = False):
+        results = []
+        for server_lib, client_lib in [(rowlib, rowlib), (collib, collib), (rowlib, collib)]:
+            port = free_port()
+            results.append(self.run_parties(
+                lambda: server_lib.pub_join("127.0.0.1", port, True, self.left, 0, chunk_size, compress),
+                lambda: client_lib.pub_join("127.0.0.1", port, False, self.right, 0, chunk_size, compress)
+            ))
+        self.assertEqual(results[1], results[0])
+        self.assertEqual(results[2], results[0])
+        return results[0]
+
+    def check_pub_intersect(self, chunk_size: int, compress: bool = False):
+        expected = sorted([key] for key in rowlib.to_set(self.left, 0) & rowlib.to_set(self.right, 0))
+        for server_lib, client_lib in [(rowlib, rowlib), (collib, collib), (collib, rowlib)]:
+            port = free_port()
+            server_res, client_res = self.run_parties(
+                lambda: server_lib.pub_intersect_as_server("127.0.0.1", port, self.left, 0, chunk_size, compress),
+                lambda: client_lib.pub_intersect_as_client("127.0.0.1", port, self.right, 0, chunk_size, compress)
+            )
+            self.assertEqual(sorted(server_res), expected)
+            self.assertEqual(sorted(client_res), expected)
+
+    def check_pub_join_part(self, chunk_size: int):
+        results = []
+        for server_lib, client_lib in [(rowlib, rowlib), (collib, collib)]:
+            port = free_port()
+            results.append(self.run_parties(
+                lambda: server_lib.pub_join_part("127.0.0.1", port, True, self.left, self.right, 0, 2, 2, chunk_size),
+                lambda: client_lib.pub_join_part("127.0.0.1", port, False, self.right, self.left, 0, 2, 2, chunk_size)
+            ))
+        self.assertEqual(results[1], results[0])
+        return results[0]
+
+    def test_pub_join(self):
+        self.check_pub_join(rowlib.NET_CHUNK_SIZE)
+
+    def test_pub_intersect(self):
+        self.check_pub_intersect(rowlib.NET_CHUNK_SIZE)
+
+    def test_pub_join_part(self):
+        self.check_pub_join_part(rowlib.NET_CHUNK_SIZE)
+
+    def test_small_chunks(self):
+        # many frames per relation instead of one
+        self.assertEqual(self.check_pub_join(64), self.check_pub_join(rowlib.NET_CHUNK_SIZE))
+        self.check_pub_intersect(64)
+        self.assertEqual(self.check_pub_join_part(64), self.check_pub_join_part(rowlib.NET_CHUNK_SIZE))
+
+    def test_compressed(self):
+        self.assertEqual(self.check_pub_join(64, True), self.check_pub_join(64))
+        self.check_pub_intersect(64, True)
+
+    def test_compressed_rel(self):
+        rel = [[key, key % 3, 2 ** 40 + key] for key in range(0, 3000, 3)]
+        for lib in [rowlib, collib]:
+            sender, receiver = socket.socketpair()
+            thread = threading.Thread(target=lib.send_rel, args=(sender, rel), kwargs={"compress": True})
+            thread.start()
+            received = as_rows(lib.receive_rel(receiver, 3))
+            thread.join()
+            sender.close()
+            receiver.close()
+            self.assertEqual(received, rel)
+        self.assertLess(len(self.sent_bytes(rel, True)), len(self.sent_bytes(rel, False)) // 2)
+
+    @staticmethod
+    def sent_bytes(rel, compress: bool):
+        sender, receiver = socket.socketpair()
+        with sender, receiver:
+            thread = threading.Thread(target=lambda: (rowlib.send_rel(sender, rel, compress=compress),
+                                                      sender.shutdown(socket.SHUT_WR)))
+            thread.start()
+            data = b"".join(iter(lambda: receiver.recv(65536), b""))
+            thread.join()
+        return data
+
+    def test_chunks_arrive_as_sent(self):
+        for lib in [rowlib, collib]:
+            sender, receiver = socket.socketpair()
+            rel = collib.as_rel(self.left) if lib is collib else self.left
+            thread = threading.Thread(target=lib.send_rel_chunks, args=(sender, lib.chunked(rel, 64)))
+            thread.start()
+            chunks = [as_rows(chunk) for chunk in lib.receive_rel_chunks(receiver, 2)]
+            thread.join()
+            sender.close()
+            receiver.close()
+            self.assertEqual([len(chunk) for chunk in chunks], [64, 64, 64, 64, 44])
+            self.assertEqual([row for chunk in chunks for row in chunk], self.left)
+
+
+class TestBinaryFormat(unittest.TestCase):
+
+    def setUp(self):
+        self.job_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.job_dir)
+
+    def check_round_trip(self, rows, num_cols, col_types=None):
+        for lib in [rowlib, collib]:
+            lib.write_rel_bin(self.job_dir, "rel.bin", rows, num_cols, col_types)
+            path = "{}/rel.bin".format(self.job_dir)
+            self.assertEqual(rowlib.read_rel_bin(path), rows)
+            self.assertEqual(collib.read_rel_bin(path).to_rows(), rows)
+            self.assertEqual(len(collib.read_rel_bin(path).cols), num_cols)
+
+    def test_empty(self):
+        self.check_round_trip([], 2)
+
+    def test_empty_with_types(self):
+        self.check_round_trip([], 3, "qid")
+
+    def test_typed(self):
+        self.check_round_trip([[2 ** 40, -3, 0.25], [-1, 2 ** 31 - 1, -1e300]], 3, "qid")
+
+    def test_many_rows(self):
+        self.check_round_trip(random_rel(1001, 3, max_value=2 ** 50), 3)
+
+
+class TestCsvFormat(unittest.TestCase):
+
+    def setUp(self):
+        self.job_dir = tempfile.mkdtemp()
+        self.path = "{}/rel.csv".format(self.job_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.job_dir)
+
+    def test_read_chunks(self):
+        rows = random_rel(250, 2)
+        rowlib.write_rel(self.job_dir, "rel.csv", rows, '"a","b"')
+        chunks = list(rowlib.read_rel_chunks(self.path, 64))
+        self.assertEqual([len(chunk) for chunk in chunks], [64, 64, 64, 58])
+        self.assertEqual([row for chunk in chunks for row in chunk], rows)
+        self.assertEqual([row for chunk in collib.read_rel_chunks(self.path, 64) for row in as_rows(chunk)], rows)
+        self.assertEqual(rowlib.read_rel(self.path), rows)
+        self.assertEqual(as_rows(collib.read_rel(self.path)), rows)
+
+    def test_read_rows(self):
+        rows = random_rel(250, 2)
+        rowlib.write_rel(self.job_dir, "rel.csv", rows, '"a","b"')
+        self.assertEqual(list(rowlib.read_rel_rows(self.path, 64)), rows)
+
+    def test_delimiter_without_header(self):
+        with open(self.path, "w") as f:
+            f.write("1;2\n3;-4\n")
+        for lib in [rowlib, collib]:
+            self.assertEqual(as_rows(lib.read_rel(self.path, delimiter=";")), [[1, 2], [3, -4]])
+
+    def test_typed_round_trip(self):
+        rows = [[1, 2.5, -7], [3, -0.125, 9]]
+        for lib in [rowlib, collib]:
+            lib.write_rel(self.job_dir, "rel.csv", rows, '"a","b","c"')
+            self.assertEqual(rowlib.read_rel(self.path, col_types="qdq"), rows)
+            self.assertEqual(as_rows(collib.read_rel(self.path, col_types="qdq")), rows)
+            self.assertEqual([col.dtype.kind for col in collib.read_rel(self.path, col_types="qdq").cols], ["i", "f", "i"])
+
+    def test_write_chunks(self):
+        rows = random_rel(250, 2)
+        for lib in [rowlib, collib]:
+            lib.write_rel_chunks(self.job_dir, "rel.csv", lib.chunked(lib.as_rel(rows) if lib is collib else rows, 64),
+                                 '"a","b"')
+            self.assertEqual(rowlib.read_rel(self.path), rows)
+
+    def test_empty(self):
+        rowlib.write_rel(self.job_dir, "rel.csv", [], '"a","b"')
+        self.assertEqual(list(rowlib.read_rel_chunks(self.path)), [])
+        self.assertEqual(as_rows(collib.read_rel(self.path)), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
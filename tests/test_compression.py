@@ -0,0 +1,54 @@
+"""
+Round trips of the column encodings used on the wire (conclave.codegen.libs.compression).
+"""
+import unittest
+
+import numpy as np
+
+from conclave.codegen.libs import compression
+
+
+class TestEncodings(unittest.TestCase):
+
+    def check_round_trip(self, col: np.ndarray, type_code: str, encoding: str = None):
+        col = col.astype(compression._TYPE_DTYPES[type_code])
+        used, payload = compression.encode_col(col.tobytes(), type_code)
+        if encoding is not None:
+            self.assertEqual(used, encoding)
+        if used == compression.RAW:
+            self.assertIsNone(payload)
+            return
+        decoded = compression.decode_col(payload, used, type_code, len(col))
+        self.assertEqual(decoded.tobytes(), col.tobytes())
+
+    def test_delta_varint(self):
+        self.check_round_trip(np.arange(-500, 5000, 3), "q", compression.DELTA_VARINT)
+        self.check_round_trip(np.sort(np.random.RandomState(0).randint(-2 ** 62, 2 ** 62, 1000)), "q")
+
+    def test_bitpack(self):
+        self.check_round_trip(np.array([7, -3, 5, 4] * 300), "q", compression.BITPACK)
+        self.check_round_trip(np.array([1, 0] * 500), "i", compression.BITPACK)
+
+    def test_zlib(self):
+        self.check_round_trip(np.tile(np.array([0.5, -1e10, 3.25]), 400), "d", compression.ZLIB)
+        self.check_round_trip(np.tile(np.array([2 ** 62, -2 ** 62, 5]), 400), "q", compression.ZLIB)
+
+    def test_raw(self):
+        rand = np.random.RandomState(0)
+        full_range = rand.randint(np.iinfo(np.int64).min, np.iinfo(np.int64).max, 100, dtype=np.int64)
+        self.check_round_trip(full_range, "q", compression.RAW)
+        self.assertEqual(compression.encode_col(b"", "q"), (compression.RAW, None))
+
+    def test_varints(self):
+        values = np.array([0, 1, 127, 128, 2 ** 63 - 1, 2 ** 64 - 1], dtype=np.uint64)
+        payload = compression.varint_encode(values)
+        self.assertEqual(compression.varint_decode(payload, len(values)).tolist(), values.tolist())
+
+    def test_wrong_length(self):
+        encoding, payload = compression.encode_col(np.arange(100, dtype=np.int64).tobytes(), "q")
+        with self.assertRaises(Exception):
+            compression.decode_col(payload, encoding, "q", 99)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,109 @@
+"""
+Tests of the peer daemon (conclave.daemon): access to its socket and runs of submitted workflows.
+"""
+import asyncio
+import os
+import shutil
+import stat
+import tempfile
+import threading
+import time
+import unittest
+
+from conclave import daemon
+
+PROTOCOL = '''
+import conclave.lang as cc
+from conclave.utils import defCol
+
+
+def protocol():
+    in1 = cc.create("in1", [defCol("a", "INTEGER", [1]), defCol("b", "INTEGER", [1])], {1})
+    agg = cc.aggregate(in1, "agg", ["a"], "b", "sum", "tot")
+    cc.collect(agg, 1)
+    return {in1}
+'''
+
+
+def workflow_conf(pid: int, path: str):
+    return {
+        "user_config": {
+            "pid": pid, "workflow_name": "daemon", "all_pids": [1], "leaky_ops": False, "use_floats": False,
+            "paths": {"input_path": path}
+        },
+        "backends": {},
+        "net": {"parties": [{"host": "127.0.0.1", "port": 9001}]}
+    }
+
+
+class TestDaemon(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        with open(os.path.join(self.path, "in1.csv"), "w") as f:
+            f.write('"a","b"\n' + "".join("{},{}\n".format(i % 3, i) for i in range(10)))
+        self.protocol_path = os.path.join(self.path, "protocol.py")
+        with open(self.protocol_path, "w") as f:
+            f.write(PROTOCOL)
+        self.socket_path = os.path.join(self.path, "daemon.sock")
+        self.daemon = None
+
+    def tearDown(self):
+        if self.daemon is not None:
+            daemon.submit({"stop": True}, self.socket_path)
+            self.thread.join(10)
+        shutil.rmtree(self.path)
+
+    def start(self, uid: [int, None] = None):
+        started = threading.Event()
+
+        def serve():
+            asyncio.set_event_loop(asyncio.new_event_loop())
+            self.daemon = daemon.ConclaveDaemon(workflow_conf(1, self.path), self.socket_path)
+            if uid is not None:
+                self.daemon.uid = uid
+            started.set()
+            self.daemon.serve()
+
+        self.thread = threading.Thread(target=serve, daemon=True)
+        self.thread.start()
+        started.wait(10)
+        while not os.path.exists(self.socket_path):
+            time.sleep(0.01)
+
+    def submission(self, pid: int = 1):
+        return {
+            "conf": workflow_conf(pid, self.path),
+            "protocol_path": self.protocol_path,
+            "mpc_framework": "obliv-c",
+            "local_framework": "python"
+        }
+
+    def test_socket_dir_is_private(self):
+        mode = os.stat(daemon.socket_dir()).st_mode
+        self.assertTrue(stat.S_ISDIR(mode))
+        self.assertEqual(stat.S_IMODE(mode), 0o700)
+        self.assertEqual(os.path.dirname(daemon.default_socket_path(2)), daemon.socket_dir())
+
+    def test_socket_is_private(self):
+        self.start()
+        self.assertEqual(stat.S_IMODE(os.stat(self.socket_path).st_mode), 0o600)
+
+    def test_runs_submissions(self):
+        self.start()
+        for _ in range(2):
+            self.assertTrue(daemon.submit(self.submission(), self.socket_path)["ok"])
+        with open(os.path.join(self.path, "agg.csv")) as f:
+            self.assertEqual(f.read().split(), ['"a","tot"', "0,18", "1,12", "2,15"])
+
+    def test_refuses_other_party(self):
+        self.start()
+        self.assertFalse(daemon.submit(self.submission(2), self.socket_path)["ok"])
+
+    @unittest.skipUnless(hasattr(daemon.socket, "SO_PEERCRED"), "peer credentials are not available")
+    def test_refuses_other_users(self):
+        self.start(uid=os.getuid() + 1)
+        response = daemon.submit(self.submission(), self.socket_path)
+        self.assertFalse(response["ok"])
+        self.assertFalse(os.path.exists(os.path.join(self.path, "agg.csv")))
+        self.daemon.uid = os.getuid()
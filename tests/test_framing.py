@@ -0,0 +1,73 @@
+"""
+Round trips of the framing (conclave.net.framing) and of the messages between salmon peers.
+"""
+import unittest
+
+from conclave.net import DoneMsg, IAMMsg, LinkMatrixMsg, LinkStatsMsg, ProbeMsg, RelChunkMsg, RelCreditMsg, decode_msg, \
+    encode_msg
+from conclave.net.framing import FRAME_HEADER, FrameParser, pack_frame, pack_header
+
+
+class TestFrameParser(unittest.TestCase):
+
+    def test_split_anywhere(self):
+        frames = [(1, b""), (2, b"abc"), (3, bytes(range(256)) * 40), (4, b"\n")]
+        data = b"".join([pack_frame(msg_type, payload) for msg_type, payload in frames])
+        for step in [1, 2, 7, FRAME_HEADER.size, 1000, len(data)]:
+            parser = FrameParser()
+            parsed = []
+            for start in range(0, len(data), step):
+                parsed.extend(parser.feed(data[start:start + step]))
+            self.assertEqual(parsed, frames)
+            self.assertFalse(parser.buffer)
+
+    def test_header_with_separate_payload(self):
+        payload = b"x" * 100
+        self.assertEqual(FrameParser().feed(pack_header(5, len(payload)) + payload), [(5, payload)])
+
+    def test_unsupported_version(self):
+        frame = bytearray(pack_frame(1, b"a"))
+        frame[FRAME_HEADER.size - 1] += 1
+        with self.assertRaises(Exception):
+            FrameParser().feed(bytes(frame))
+
+
+class TestMessages(unittest.TestCase):
+
+    def round_trip(self, msg):
+        (msg_type, payload), = FrameParser().feed(encode_msg(msg))
+        decoded = decode_msg(msg_type, payload)
+        self.assertIs(type(decoded), type(msg))
+        self.assertEqual(vars(decoded), vars(msg))
+
+    def test_unknown_type(self):
+        with self.assertRaises(Exception):
+            decode_msg(99, b"")
+
+    def test_iam(self):
+        self.round_trip(IAMMsg(3))
+
+    def test_done(self):
+        self.round_trip(DoneMsg(2, "job-0 ünïcode"))
+
+    def test_rel_chunk(self):
+        self.round_trip(RelChunkMsg(1, "rel", bytes(range(256)) * 4))
+        self.round_trip(RelChunkMsg(1, "rel", b""))
+
+    def test_rel_credit(self):
+        self.round_trip(RelCreditMsg(2, "rel", 2 ** 22))
+
+    def test_probe(self):
+        self.round_trip(ProbeMsg(1, 7, False, bytes(1000)))
+        self.round_trip(ProbeMsg(2, 7, True))
+
+    def test_link_stats(self):
+        self.round_trip(LinkStatsMsg(1, 4, {2: (0.001, 1e8), 3: (0.25, 12345.5)}))
+
+    def test_link_matrix(self):
+        self.round_trip(LinkMatrixMsg(1, 2, [[1, 2, 0.001, 1e8], [2, 1, 0.002, 1e6]]))
+        self.round_trip(LinkMatrixMsg(1, 3, []))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,60 @@
+"""
+Tests of the multi-core primitives (conclave.codegen.libs.parallel) against the serial ones, on
+inputs large enough to be partitioned across worker processes.
+"""
+import random
+import unittest
+
+import conclave.codegen.libs.columnar as collib
+import conclave.codegen.libs.parallel as parlib
+import conclave.codegen.libs.python as rowlib
+
+WORKERS = 3
+
+
+def random_rel(num_rows: int, num_cols: int, max_value: int, seed: int):
+    rand = random.Random(seed)
+    return [[rand.randint(0, max_value) for _ in range(num_cols)] for _ in range(num_rows)]
+
+
+class TestParallel(unittest.TestCase):
+
+    rel = random_rel(parlib.PARALLEL_MIN_ROWS + 1000, 3, 5000, seed=1)
+    other = random_rel(parlib.PARALLEL_MIN_ROWS // 2, 2, 20000, seed=2)
+
+    def check_same(self, expected, actual, ordered=True):
+        if isinstance(actual, collib.ColumnarRel):
+            actual = actual.to_rows()
+        if not ordered:
+            expected, actual = sorted(expected), sorted(actual)
+        self.assertEqual(actual, expected)
+
+    def test_aggregate(self):
+        expected = rowlib.aggregate(self.rel, 0, 1, "sum")
+        self.check_same(expected, parlib.par_aggregate(self.rel, 0, 1, "sum", WORKERS))
+        self.check_same(expected, parlib.par_aggregate(collib.as_rel(self.rel), 0, 1, "sum", WORKERS))
+
+    def test_aggregate_count(self):
+        expected = rowlib.aggregate_count(self.rel, 2)
+        self.check_same(expected, parlib.par_aggregate_count(self.rel, 2, WORKERS))
+
+    def test_join(self):
+        expected = rowlib.join(self.rel, self.other, 0, 1)
+        self.assertTrue(expected)
+        self.check_same(expected, parlib.par_join(self.rel, self.other, 0, 1, WORKERS), ordered=False)
+        actual = parlib.par_join(collib.as_rel(self.rel), collib.as_rel(self.other), 0, 1, WORKERS)
+        self.check_same(expected, actual, ordered=False)
+
+    def test_filter_by(self):
+        keys = [[row[0]] for row in self.other[:500]]
+        for use_not_in in (False, True):
+            expected = rowlib.filter_by(self.rel, keys, 0, use_not_in)
+            self.check_same(expected, parlib.par_filter_by(self.rel, keys, 0, use_not_in, WORKERS))
+
+    def test_pools_are_reused_and_shut_down(self):
+        parlib.par_aggregate_count(self.rel, 0, WORKERS)
+        pool = parlib._pools[WORKERS]
+        parlib.par_aggregate_count(self.rel, 1, WORKERS)
+        self.assertIs(parlib._pools[WORKERS], pool)
+        parlib.shutdown_pools()
+        self.assertFalse(parlib._pools)
@@ -0,0 +1,119 @@
+"""
+Tests of the placement of parties with special roles by link measurements (conclave.placement) and
+of the agreement of connected peers on the measurements to place by.
+"""
+import asyncio
+import socket
+import threading
+import unittest
+
+import conclave.comp as comp
+import conclave.dag as ccdag
+import conclave.lang as cc
+from conclave.config import CodeGenConfig
+from conclave.net import LinkMatrixMsg, decode_msg, encode_msg, setup_peer
+from conclave.net.framing import FrameParser
+from conclave.placement import LinkMatrix, pick_party
+from conclave.utils import defCol
+
+# party 2 receives fast from party 1, party 1 receives slowly from party 2
+TO_TWO_FAST = {1: {2: (0.01, 1e8)}, 2: {1: (0.01, 1e6)}}
+TO_ONE_FAST = {1: {2: (0.01, 1e6)}, 2: {1: (0.01, 1e8)}}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def config(pids: list, link_stats: [dict, None] = None):
+    conclave_config = CodeGenConfig("placement")
+    conclave_config.all_pids = pids
+    conclave_config.use_leaky_ops = True
+    if link_stats is not None:
+        conclave_config.with_link_matrix(LinkMatrix.from_link_stats(link_stats))
+    return conclave_config
+
+
+class TestLinkMatrix(unittest.TestCase):
+
+    def test_picks_fastest_receiver(self):
+        self.assertEqual(LinkMatrix.from_link_stats(TO_TWO_FAST).pick({1, 2}, [1, 2]), 2)
+        self.assertEqual(LinkMatrix.from_link_stats(TO_ONE_FAST).pick({1, 2}, [1, 2]), 1)
+
+    def test_lowest_pid_on_ties(self):
+        links = LinkMatrix.from_link_stats({1: {2: (0.01, 1e6)}, 2: {1: (0.01, 1e6)}})
+        self.assertEqual(links.pick({2, 1}, [1, 2]), 1)
+
+    def test_falls_back_to_other_direction(self):
+        links = LinkMatrix.from_link_stats({1: {2: (0.02, 1e6)}})
+        self.assertEqual(links.transfer_time(2, 1, 10 ** 6), links.transfer_time(1, 2, 10 ** 6))
+        with self.assertRaises(Exception):
+            links.transfer_time(1, 3, 10 ** 6)
+
+    def test_list_round_trip(self):
+        links = LinkMatrix.from_link_stats(TO_TWO_FAST)
+        self.assertEqual(LinkMatrix.from_list(links.to_list()).to_list(), links.to_list())
+
+    def test_pick_party_without_measurements(self):
+        self.assertEqual(pick_party(config([1, 2, 3]), {3, 2}), 2)
+
+    def test_pick_party_with_measurements(self):
+        self.assertEqual(pick_party(config([1, 2], TO_TWO_FAST), {1, 2}), 2)
+
+
+def public_join():
+    a1 = cc.create("a1", [defCol("k", "INTEGER", 1, 2), defCol("x", "INTEGER", 1)], {1})
+    a2 = cc.create("a2", [defCol("k", "INTEGER", 1, 2), defCol("x", "INTEGER", 2)], {2})
+    b1 = cc.create("b1", [defCol("k", "INTEGER", 1, 2), defCol("y", "INTEGER", 1)], {1})
+    b2 = cc.create("b2", [defCol("k", "INTEGER", 1, 2), defCol("y", "INTEGER", 2)], {2})
+    joined = cc.join(cc.concat([a1, a2], "a"), cc.concat([b1, b2], "b"), "joined", ["k"], ["k"])
+    cc.collect(joined, 1)
+    return {a1, a2, b1, b2}
+
+
+class TestPublicJoinPlacement(unittest.TestCase):
+
+    def servers(self, conclave_config):
+        dag = comp.rewrite_dag(ccdag.OpDag(public_join()), conclave_config)
+        pub_joins = [node for node in dag.top_sort() if isinstance(node, ccdag.PubJoin)]
+        self.assertEqual(len(pub_joins), 2)
+        return {next(iter(node.out_rel.stored_with)) for node in pub_joins if node.is_server}
+
+    def test_server_by_pid(self):
+        self.assertEqual(self.servers(config([1, 2])), {1})
+
+    def test_server_by_links(self):
+        self.assertEqual(self.servers(config([1, 2], TO_TWO_FAST)), {2})
+        self.assertEqual(self.servers(config([1, 2], TO_ONE_FAST)), {1})
+
+
+class TestAgreement(unittest.TestCase):
+
+    def test_message_round_trip(self):
+        links = LinkMatrix.from_link_stats(TO_TWO_FAST).to_list()
+        msg = decode_msg(*FrameParser().feed(encode_msg(LinkMatrixMsg(1, 3, links)))[0])
+        self.assertEqual((msg.pid, msg.agreement, msg.links), (1, 3, links))
+
+    def test_peers_adopt_lowest_pid_matrix(self):
+        parties = {pid: {"host": "127.0.0.1", "port": free_port()} for pid in (1, 2)}
+        # measurements that diverged, e.g. because a probing round timed out on one peer only
+        link_stats = {1: TO_TWO_FAST, 2: TO_ONE_FAST}
+        agreed = {}
+
+        def run(pid):
+            asyncio.set_event_loop(asyncio.new_event_loop())
+            peer = setup_peer({"pid": pid, "parties": parties})
+            peer.complete_link_stats = link_stats[pid]
+            agreed[pid] = [peer.agree_link_matrix().to_list()]
+            peer.complete_link_stats = None
+            agreed[pid].append(peer.agree_link_matrix())
+
+        threads = [threading.Thread(target=run, args=(pid,), daemon=True) for pid in (2, 1)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(30)
+        expected = LinkMatrix.from_link_stats(TO_TWO_FAST).to_list()
+        self.assertEqual(agreed, {1: [expected, None], 2: [expected, None]})
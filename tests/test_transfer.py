@@ -0,0 +1,94 @@
+"""
+Loopback tests of streaming relations between two connected salmon peers (conclave.net.SalmonPeer),
+from files and buffers, with the receiver's credit bounding the data in flight.
+"""
+import asyncio
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import unittest
+
+import conclave.net as net
+from conclave.net import setup_peer
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class TestRelTransfer(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.window = net.REL_WINDOW
+
+    def tearDown(self):
+        net.REL_WINDOW = self.window
+        shutil.rmtree(self.tmp_dir)
+
+    def run_peers(self, parties: dict):
+        """ Runs parties[pid](peer) for each pid on its own connected peer, and returns their results. """
+        addresses = {pid: {"host": "127.0.0.1", "port": free_port()} for pid in parties}
+        results = {}
+
+        def run(pid):
+            asyncio.set_event_loop(asyncio.new_event_loop())
+            peer = setup_peer({"pid": pid, "parties": addresses})
+            try:
+                results[pid] = parties[pid](peer)
+            finally:
+                for protocol in peer.peer_protocols.values():
+                    protocol.transport.close()
+                peer.loop.run_until_complete(asyncio.sleep(0))
+                peer.loop.close()
+
+        threads = [threading.Thread(target=run, args=(pid,), daemon=True) for pid in sorted(parties, reverse=True)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(60)
+            self.assertFalse(thread.is_alive())
+        return results
+
+    def test_file_to_file(self):
+        # more than a window, and not a whole number of chunks
+        data = os.urandom(2 * net.REL_WINDOW + 5)
+        in_path, out_path = "{}/in.bin".format(self.tmp_dir), "{}/out.bin".format(self.tmp_dir)
+        with open(in_path, "wb") as f:
+            f.write(data)
+
+        def receive(peer):
+            # the sender has to wait for the receiver's credit
+            time.sleep(0.3)
+            peer.receive_rel_file(1, "rel", out_path)
+
+        self.run_peers({1: lambda peer: peer.send_rel_file(2, "rel", in_path), 2: receive})
+        with open(out_path, "rb") as f:
+            self.assertEqual(f.read(), data)
+
+    def test_buffers_both_ways(self):
+        net.REL_WINDOW = net.REL_CHUNK_SIZE
+        data = bytearray(os.urandom(3 * net.REL_CHUNK_SIZE + 7))
+
+        def one(peer):
+            peer.send_rel_data(2, "empty", b"")
+            peer.send_rel_data(2, "rel", b"first")
+            peer.send_rel_data(2, "rel", b"second")
+            return peer.receive_rel_data(2, "back")
+
+        def two(peer):
+            received = [peer.receive_rel_data(1, name) for name in ["empty", "rel", "rel"]]
+            peer.send_rel_data(1, "back", memoryview(data))
+            return received
+
+        results = self.run_peers({1: one, 2: two})
+        self.assertEqual(results, {1: bytes(data), 2: [b"", b"first", b"second"]})
+
+
+if __name__ == "__main__":
+    unittest.main()